@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+
+"""
+Preface:
+    - production settings for gunicorn, used by the Dockerfile:
+        gunicorn -c gunicorn.conf.py server:APP
+    - each worker process serves several requests at once on its threads, so
+    one slow request no longer holds up every other user
+    - the app is loaded once in the master and forked into the workers, and
+    every worker then starts its own database pool, as connections cannot be
+    shared across processes
+    - on SIGTERM workers stop taking requests, finish the ones in flight (for up
+    to GUNICORN_GRACEFUL_TIMEOUT seconds) and close their connections
+"""
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Processes, and threads each one serves requests on. Each thread may hold a
+# database connection, so keep DB_POOL_SIZE + DB_MAX_OVERFLOW >= threads.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+
+# Loads the app (and sets up the database) once, before forking the workers
+preload_app = True
+
+# Seconds a request may take, and seconds workers get to finish on shutdown
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# Restarts workers now and then, to bound the effect of any slow leaks
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    """Gives the new worker a pool of its own.
+
+    The master's pooled connections were copied into the worker by the fork,
+    so they are dropped (without closing them, as the master still owns them)
+    and the worker opens fresh ones on first use.
+    """
+    from main.database import db_manager as dbm
+
+    app = worker.app.wsgi()
+    with app.app_context():
+        dbm.dispose_engine(close=False)
+
+    worker.log.info("Worker %s started with a fresh database pool", worker.pid)
+
+
+def worker_exit(server, worker):
+    """Closes the worker's pooled connections once it has finished its requests."""
+    from main.database import db_manager as dbm
+
+    app = worker.app.wsgi()
+    with app.app_context():
+        dbm.dispose_engine()
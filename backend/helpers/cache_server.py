@@ -0,0 +1,268 @@
+from fnmatch import fnmatchcase
+from threading import Lock
+import argparse
+import socketserver
+import time
+
+"""
+Preface:
+    - a small stand-in for redis, speaking the subset of its protocol that
+    main/database/db_cache.py's RedisBackend uses: GET, SET (with EX/PX),
+    DEL, EXISTS, SCAN, FLUSHDB, PUBLISH and SUBSCRIBE
+    - lets the shared caches be run and tested locally without installing
+    redis, e.g.
+        python3 helpers/cache_server.py --port 6380
+        CACHE_URL=redis://localhost:6380/0 python3 -m flask run
+    - entries only live in this process's memory, so use real redis anywhere
+    the data has to survive a restart
+"""
+
+
+class CacheStore:
+    """Thread safe key value store whose entries can expire, with pubsub
+    channels.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # key -> (expiry time or None, value)
+        self.entries = {}
+        # channel -> set of CacheRequestHandler subscribed to it
+        self.channels = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                return None
+
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self.lock:
+            self.entries[key] = (expires, value)
+
+    def delete(self, keys):
+        with self.lock:
+            return sum(self.entries.pop(key, None) is not None for key in keys)
+
+    def keys(self, pattern):
+        now = time.monotonic()
+        with self.lock:
+            return [
+                key
+                for key, (expires, _) in self.entries.items()
+                if (expires is None or expires > now)
+                and fnmatchcase(key.decode("utf-8", "replace"), pattern)
+            ]
+
+    def flush(self):
+        with self.lock:
+            self.entries.clear()
+
+    def subscribe(self, channel, handler):
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(handler)
+
+    def unsubscribe(self, channel, handler):
+        with self.lock:
+            self.channels.get(channel, set()).discard(handler)
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+
+        for handler in subscribers:
+            handler.send([b"message", channel, message])
+
+        return len(subscribers)
+
+
+class CacheRequestHandler(socketserver.StreamRequestHandler):
+    """Handles one client connection, reading commands and sending replies."""
+
+    def setup(self):
+        super().setup()
+        self.write_lock = Lock()
+        self.subscriptions = set()
+
+    def handle(self):
+        store = self.server.store
+
+        try:
+            while True:
+                command = self.read_command()
+                if command is None:
+                    break
+
+                name = command[0].upper()
+                if name == b"QUIT":
+                    self.send(b"OK")
+                    break
+
+                try:
+                    self.send(self.run(store, name, command[1:]))
+                except (ValueError, IndexError):
+                    self.send(CommandError(f"ERR syntax error in '{name.decode()}'"))
+        except ConnectionError:
+            pass
+        finally:
+            for channel in self.subscriptions:
+                store.unsubscribe(channel, self)
+
+    def run(self, store, name, args):
+        """Runs a command, returning its reply."""
+        if name == b"PING":
+            if self.subscriptions:
+                return [b"pong", args[0] if args else b""]
+            return args[0] if args else b"PONG"
+
+        if name == b"GET":
+            return store.get(args[0])
+
+        if name == b"SET":
+            ttl = None
+            options = [arg.upper() for arg in args[2:]]
+            if b"EX" in options:
+                ttl = int(args[2 + options.index(b"EX") + 1])
+            elif b"PX" in options:
+                ttl = int(args[2 + options.index(b"PX") + 1]) / 1000
+            store.set(args[0], args[1], ttl)
+            return b"OK"
+
+        if name == b"DEL":
+            return store.delete(args)
+
+        if name == b"EXISTS":
+            return sum(store.get(key) is not None for key in args)
+
+        if name == b"SCAN":
+            # Every key is returned in one pass, so the cursor is always "0"
+            options = [arg.upper() for arg in args[1:]]
+            pattern = "*"
+            if b"MATCH" in options:
+                pattern = args[1 + options.index(b"MATCH") + 1].decode("utf-8")
+            return [b"0", store.keys(pattern)]
+
+        if name in (b"FLUSHDB", b"FLUSHALL"):
+            store.flush()
+            return b"OK"
+
+        if name == b"PUBLISH":
+            return store.publish(args[0], args[1])
+
+        if name == b"SUBSCRIBE":
+            for channel in args:
+                store.subscribe(channel, self)
+                self.subscriptions.add(channel)
+                self.send([b"subscribe", channel, len(self.subscriptions)])
+            return NO_REPLY
+
+        if name == b"UNSUBSCRIBE":
+            for channel in args or list(self.subscriptions):
+                store.unsubscribe(channel, self)
+                self.subscriptions.discard(channel)
+                self.send([b"unsubscribe", channel, len(self.subscriptions)])
+            return NO_REPLY
+
+        # Connection setup commands (CLIENT SETINFO, SELECT, ...) are accepted
+        if name in (b"CLIENT", b"SELECT", b"READONLY"):
+            return b"OK"
+
+        return CommandError(f"ERR unknown command '{name.decode()}'")
+
+    def read_command(self):
+        """Reads one command, as a list of bytes, or None if the client left."""
+        line = self.rfile.readline()
+        if not line:
+            return None
+
+        # Inline commands, e.g. from telnet
+        if not line.startswith(b"*"):
+            return line.split() or self.read_command()
+
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+
+        return args
+
+    def send(self, reply):
+        if reply is NO_REPLY:
+            return
+
+        with self.write_lock:
+            self.wfile.write(encode_reply(reply))
+
+
+class CommandError(Exception):
+    """Error reply to a command."""
+
+
+# Returned by commands that have already sent their replies
+NO_REPLY = object()
+
+
+def encode_reply(reply):
+    """Encodes a reply in redis' protocol (RESP).
+
+    Args:
+        reply (None/int/bytes/list/CommandError): the reply
+
+    Returns:
+        bytes: the encoded reply
+    """
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, CommandError):
+        return f"-{reply}\r\n".encode("utf-8")
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode("utf-8")
+    if isinstance(reply, list):
+        return f"*{len(reply)}\r\n".encode("utf-8") + b"".join(
+            encode_reply(item) for item in reply
+        )
+    if reply in (b"OK", b"PONG"):
+        return b"+" + reply + b"\r\n"
+
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+class CacheServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, CacheRequestHandler)
+        self.store = CacheStore()
+
+
+def serve(host="127.0.0.1", port=6380):
+    """Runs the stand-in cache server until it is interrupted.
+
+    Args:
+        host (string): address to listen on
+        port (int): port to listen on
+    """
+    with CacheServer((host, port)) as server:
+        print(f"Cache server listening on {host}:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for redis")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+
+    serve(args.host, args.port)
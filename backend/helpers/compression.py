@@ -0,0 +1,168 @@
+from flask import current_app, request
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Preface:
+    - responses are compressed with brotli or gzip, whichever the client
+    prefers in its Accept-Encoding header, with brotli winning ties
+    - responses smaller than COMPRESS_MIN_SIZE bytes are sent as they are,
+    since compressing them costs more than it saves
+    - streamed responses are compressed chunk by chunk as they are sent, and
+    each chunk is flushed so the client receives rows as they are produced
+"""
+
+# Only text-like responses are worth compressing
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/css"}
+
+
+def init_app(app):
+    """Compresses the app's responses for clients that accept it.
+
+    Args:
+        app (Flask): the flask app whose responses we want to compress
+    """
+    app.after_request(compress_response)
+
+
+def compress_response(response):
+    """Compresses a response with the encoding negotiated for the request.
+
+    Args:
+        response (Response): response the view returned
+
+    Returns:
+        Response: the same response, compressed if it should be
+    """
+    if not is_compressible(response):
+        return response
+
+    # Whether the response is compressed depends on the request's Accept-Encoding
+    response.vary.add("Accept-Encoding")
+
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    level, min_size = compression_settings()
+
+    if response.is_streamed:
+        compressor = make_compressor(encoding, level)
+        response.response = compress_stream(response.response, compressor)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        if encoding == "br":
+            response.set_data(brotli.compress(data, quality=level["br"]))
+        else:
+            response.set_data(gzip.compress(data, compresslevel=level["gzip"]))
+
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+""" |------------------------------------|
+    |  Helper functions for compression  |
+    |------------------------------------| """
+
+
+def is_compressible(response):
+    """Returns whether a response is a candidate for compression.
+
+    Args:
+        response (Response): response the view returned
+
+    Returns:
+        boolean: whether the response could be compressed
+    """
+    return (
+        200 <= response.status_code < 300
+        and response.status_code != 204
+        and request.method != "HEAD"
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSIBLE_MIMETYPES
+    )
+
+
+def negotiate_encoding():
+    """Picks the encoding to use from the request's Accept-Encoding header.
+
+    Returns:
+        string: "br" or "gzip", or None if the client accepts neither
+    """
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def compression_settings():
+    """Reads the compression settings of the current app.
+
+    Returns:
+        dictionary, int: levels for each encoding, and the minimum response size
+    """
+    level = {
+        "gzip": current_app.config.get("COMPRESS_LEVEL", 6),
+        "br": current_app.config.get("COMPRESS_BROTLI_QUALITY", 4),
+    }
+    return level, current_app.config.get("COMPRESS_MIN_SIZE", 500)
+
+
+def make_compressor(encoding, level):
+    """Returns the (compress, flush, finish) functions of a streaming compressor.
+
+    Args:
+        encoding (string): "br" or "gzip"
+        level (dictionary): levels for each encoding
+
+    Returns:
+        (function, function, function): compress a chunk, flush what has been
+                                        compressed so far, and end the stream
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=level["br"])
+        return compressor.process, compressor.flush, compressor.finish
+
+    # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+    compressor = zlib.compressobj(level["gzip"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+        compressor.flush,
+    )
+
+
+def compress_stream(chunks, compressor):
+    """Compresses a streamed response's chunks as they are produced.
+
+    Args:
+        chunks (iterable of bytes/strings): chunks of the original response
+        compressor ((function, function, function)): from make_compressor
+
+    Returns:
+        generator of bytes: chunks of the compressed response
+    """
+    compress, flush, finish = compressor
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+
+        yield finish()
+    finally:
+        # Lets the original stream clean up, e.g. release its db connection
+        if hasattr(chunks, "close"):
+            chunks.close()
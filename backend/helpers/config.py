@@ -1,3 +1,5 @@
+import os
+
 host='0.0.0.0'
 port=5000
 
@@ -5,13 +7,65 @@ class BaseConfig:
     """Base configuration"""
     DEBUG = False
     TESTING = False
+    ALLOW_DATABASE_RESET = False
+
+    # Connection pool settings for the process-wide database engine
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+
+    # Seconds a worker trusts its list of banned collectors before reloading it
+    PRIVELAGE_REVOCATION_TTL = int(os.environ.get("PRIVELAGE_REVOCATION_TTL", 30))
+
+    # JSON library used for responses: "orjson", "stdlib" or "auto"
+    JSON_PROVIDER = os.environ.get("JSON_PROVIDER", "auto")
+
+    # Response compression: gzip level (1-9), brotli quality (0-11), and the
+    # size in bytes below which responses are sent uncompressed
+    COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 4))
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+
+    # Caches of catalog, profile and manager lookups: max entries per cache,
+    # and seconds an entry is kept for
+    CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 4096))
+    CACHE_TTL = int(os.environ.get("CACHE_TTL", 600))
+
+    # Shared cache store, e.g. "redis://localhost:6379/0" (in-memory if unset),
+    # and seconds each worker keeps its own copy of a shared entry
+    CACHE_URL = os.environ.get("CACHE_URL")
+    CACHE_LOCAL_TTL = int(os.environ.get("CACHE_LOCAL_TTL", 5))
 class DevelopmentConfig(BaseConfig):
     """Development configuration"""
     DEBUG = True
+    # Lets /initdb delete and rebuild the database
+    ALLOW_DATABASE_RESET = True
 class TestingConfig(BaseConfig):
     """Testing configuration"""
     DEBUG = True
     TESTING = True
+    ALLOW_DATABASE_RESET = True
 class ProductionConfig(BaseConfig):
     """Production configuration"""
-    DEBUG = False
\ No newline at end of file
+    DEBUG = False
+    PROPAGATE_EXCEPTIONS = False
+
+
+# APP_ENV value -> configuration the app runs with
+configs = {
+    "development": DevelopmentConfig,
+    "testing": TestingConfig,
+    "production": ProductionConfig,
+}
+
+
+def get_config():
+    """Returns the configuration selected by the APP_ENV environment variable
+    ("development" if unset)."""
+    app_env = os.environ.get("APP_ENV", "development")
+    if app_env not in configs:
+        raise ValueError(f"Unknown APP_ENV {app_env!r}, expected one of {list(configs)}")
+
+    return configs[app_env]
@@ -0,0 +1,169 @@
+from datetime import date, timedelta
+from flask.json.provider import DefaultJSONProvider
+import json
+import timeit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+Preface:
+    - the app's JSON provider is picked by the JSON_PROVIDER setting:
+    "orjson", "stdlib", or "auto" (orjson when it is installed)
+    - both providers output the same JSON, including dates, which are sent in
+    the same HTTP date format flask uses, so switching is safe for the frontend
+"""
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes and decodes with orjson.
+
+    Keeps the behaviour of flask's default provider: keys are sorted, and any
+    type orjson does not handle itself (dates included) is passed to the same
+    default function flask uses.
+    """
+
+    options = (
+        orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if orjson
+        else 0
+    )
+
+    def dumps(self, obj, **kwargs):
+        option = self.options
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def create_json_provider(app, name="auto"):
+    """Returns the JSON provider the app should use.
+
+    Args:
+        app (Flask): app the provider is for
+        name (string): "orjson", "stdlib" or "auto"
+
+    Returns:
+        JSONProvider: orjson provider if asked for (or "auto") and installed,
+                      otherwise flask's stdlib provider
+    """
+    if name in ("auto", "orjson") and orjson is not None:
+        return OrjsonProvider(app)
+
+    if name == "orjson":
+        app.logger.warning("orjson is not installed, using the stdlib JSON provider")
+
+    return DefaultJSONProvider(app)
+
+
+""" |------------------------------------|
+    |             Benchmark              |
+    |------------------------------------| """
+
+
+def sample_payloads(rows=10000):
+    """Builds payloads shaped like the get_collection and find_exchange_history
+    responses.
+
+    Args:
+        rows (int): number of rows in each payload
+
+    Returns:
+        dictionary: payload name -> payload
+    """
+    released = date(2022, 1, 16)
+
+    collection = {
+        "collection": [
+            {
+                "id": i,
+                "collectible_id": i % 100,
+                "date_added": (released + timedelta(days=i % 365)).strftime("%d/%m/%Y"),
+                "campaign_id": i % 5,
+                "name": f"Collectible {i % 100}",
+                "description": "Morbi non quam nec dui luctus rutrum. Nulla tellus.",
+                "image": f"https://robohash.org/{i % 100}.png?size=500x500&set=set1",
+                "campaign_name": f"Campaign {i % 5}",
+                "date_released": released.strftime("%d/%m/%Y"),
+            }
+            for i in range(rows)
+        ]
+    }
+
+    exchange_history = {
+        "exchanges": [
+            {
+                "exchange_id": i,
+                "traded_collectible_id": i % 100,
+                "traded_collectible_name": f"Collectible {i % 100}",
+                "traded_collectible_img": f"https://robohash.org/{i % 100}.png",
+                "accepted_collectible_id": (i + 1) % 100,
+                "accepted_collectible_name": f"Collectible {(i + 1) % 100}",
+                "accepted_collectible_img": f"https://robohash.org/{(i + 1) % 100}.png",
+                "trader_collector_id": i % 25,
+                "trader_username": f"collector{i % 25}",
+                "trader_profile_img": "",
+                "offer_made_date": "12/11/2023",
+                "accepted_date": "25/11/2023",
+            }
+            for i in range(rows)
+        ],
+        "next": None,
+    }
+
+    return {"get_collection": collection, "find_exchange_history": exchange_history}
+
+
+def benchmark_json_providers(rows=10000, number=20):
+    """Times how long each available provider takes to encode the sample payloads.
+
+    Args:
+        rows (int): number of rows in each payload
+        number (int): number of times each payload is encoded
+
+    Returns:
+        [dictionary]: one result per payload and provider
+
+    Example Output:
+        [
+            {"payload": "get_collection", "provider": "stdlib", "ms_per_encode": 31.2},
+            {"payload": "get_collection", "provider": "orjson", "ms_per_encode": 3.1},
+        ]
+    """
+    # Compact output, as jsonify produces outside of debug mode
+    encoders = {
+        "stdlib": lambda obj: json.dumps(
+            obj, default=DefaultJSONProvider.default, sort_keys=True, separators=(",", ":")
+        ),
+    }
+    if orjson is not None:
+        encoders["orjson"] = lambda obj: orjson.dumps(
+            obj, default=DefaultJSONProvider.default, option=OrjsonProvider.options
+        )
+
+    results = []
+    for payload_name, payload in sample_payloads(rows).items():
+        for provider, encode in encoders.items():
+            seconds = timeit.timeit(lambda: encode(payload), number=number)
+            results.append(
+                {
+                    "payload": payload_name,
+                    "provider": provider,
+                    "ms_per_encode": round(seconds / number * 1000, 2),
+                }
+            )
+
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark_json_providers():
+        print(
+            f"{result['payload']:<24}{result['provider']:<10}{result['ms_per_encode']} ms"
+        )
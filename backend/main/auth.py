@@ -1,12 +1,16 @@
+from functools import wraps
 from random import randrange
-import smtplib, ssl
+import smtplib, ssl, time
 
 from email.message import EmailMessage
 from email.mime.text import MIMEText
-from flask import jsonify
+from flask import current_app, jsonify
 from flask_jwt_extended import (
     create_access_token,
     create_refresh_token,
+    get_jwt,
+    get_jwt_identity,
+    jwt_required,
     set_access_cookies,
     set_refresh_cookies,
     unset_jwt_cookies,
@@ -59,13 +63,19 @@ def login(email=None, password=None):
     user_id = db_collectors.get_collector_id(email=email)
     
     privelage = get_user_privelage(user_id)
+    token_privelage = privelage
     if privelage == MANAGERPENDING:
         update_privelage(user_id, MANAGER)
+        token_privelage = MANAGER
     elif privelage == BANNED:
         return jsonify({"msg": "You have been banned!"}), AccessError
 
     response = jsonify({"userId": user_id, "privelage": privelage})
-    access_token = create_access_token(identity=user_id, fresh=True)
+    access_token = create_access_token(
+        identity=user_id,
+        fresh=True,
+        additional_claims={"privelage": token_privelage},
+    )
     refresh_token = create_refresh_token(identity=user_id)
     set_access_cookies(response, access_token)
     set_refresh_cookies(response, refresh_token)
@@ -121,10 +131,14 @@ def register_collector(email, username, password, privelage=COLLECTOR):
     if status != OK:
         return jsonify({"msg": "Account unsuccessfully registered!"}), status
 
-    collector_id = db_collectors.get_collector_id(email=email, username=username)
+    collector_id = resp.get_json().get("user_id")
 
     response = jsonify({"msg": "Account successfully registered!", "user_id": collector_id})
-    access_token = create_access_token(identity=collector_id, fresh=True)
+    access_token = create_access_token(
+        identity=collector_id,
+        fresh=True,
+        additional_claims={"privelage": privelage},
+    )
     refresh_token = create_refresh_token(identity=collector_id)
     set_access_cookies(response, access_token)
     set_refresh_cookies(response, refresh_token)
@@ -175,13 +189,30 @@ def send_manager_email(admin_id, email):
 
 
 def refresh(user_id):
-    # TODO: Write docstring clearly explainig what refresh does.
-    """refresh.
+    """Issues a new (non-fresh) access token for the user, re-reading their
+    privelage so the token's privelage claim picks up any changes.
 
     Args:
-        user_id:
+        user_id (int): id of the user whose access token is refreshed
+
+    Returns:
+        JSON:
+            - on success: {"refresh": True}
+            - on error: {"msg": (string)}
+        int: success/error code
+
+    Raises:
+        AccessError: banned user tries to refresh
     """
-    access_token = create_access_token(identity=user_id)
+    privelage = get_user_privelage(user_id)
+    if privelage == BANNED:
+        response = jsonify({"msg": "You have been banned!"})
+        unset_jwt_cookies(response)
+        return response, AccessError
+
+    access_token = create_access_token(
+        identity=user_id, additional_claims={"privelage": privelage}
+    )
     response = jsonify({"refresh": True})
     set_access_cookies(response, access_token)
     return response, OK
@@ -195,7 +226,7 @@ def get_privelage(user_id):
 def update_privelage(user_id, privelage):
     engine, conn, metadata = dbm.db_connect()
 
-    privelages = db.Table("privelages", metadata, autoload_with=engine)
+    privelages = dbm.privelage_table
 
     update_stmt = (
         db.update(privelages)
@@ -204,6 +235,7 @@ def update_privelage(user_id, privelage):
     )
     conn.execute(update_stmt)
     conn.close()
+    db_collectors.find_managers.invalidate()
 
     user_privelage = get_user_privelage(user_id)
 
@@ -263,7 +295,7 @@ def hash_password(password):
 
 def get_user_privelage(user_id):
     engine, conn, metadata = dbm.db_connect()
-    privelages = db.Table("privelages", metadata, autoload_with=engine)
+    privelages = dbm.privelage_table
     select_stmt = db.select(privelages.c.privelage).where(
         privelages.c.collector_id == user_id
     )
@@ -275,7 +307,110 @@ def get_user_privelage(user_id):
 
 
 def check_user_privelage(user_id, required_privelage):
-    user_privelage = get_user_privelage(user_id)
+    user_privelage = get_token_privelage(user_id)
+    if user_privelage is None:
+        user_privelage = get_user_privelage(user_id)
+
     return user_privelage >= required_privelage
 
 
+def privelage_required(required_privelage):
+    """Route decorator that only lets through users with at least the required
+    privelage, read from the privelage claim of their access token.
+
+    Args:
+        required_privelage (int): minimum privelage level needed for the route
+
+    Example:
+        @APP.route("/admin/campaign/approve", methods=["POST"])
+        @auth.privelage_required(ADMIN)
+        def admin_campaign_approve():
+    """
+
+    def wrapper(fn):
+        @wraps(fn)
+        @jwt_required(fresh=False)
+        def decorator(*args, **kwargs):
+            user_id = get_jwt_identity()
+            if not check_user_privelage(user_id, required_privelage):
+                return (
+                    jsonify({"msg": "User does not have privelage level required!"}),
+                    AccessError,
+                )
+
+            return fn(*args, **kwargs)
+
+        return decorator
+
+    return wrapper
+
+
+def get_token_privelage(user_id):
+    """Returns the privelage claim of the current request's access token.
+
+    Notes:
+        - the claim is only trusted for the user the token belongs to, and
+          tokens from before the claim was added have none
+        - bans take effect before the token expires through the list of
+          banned collectors, see get_banned_collectors()
+
+    Args:
+        user_id (int): id of user whose privelage we want
+
+    Returns:
+        int: privelage of the user, or None if the request carries no claim for them
+    """
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        # No access token has been verified in this context
+        return None
+
+    if get_jwt_identity() != user_id or claims.get("privelage") is None:
+        return None
+
+    if user_id in get_banned_collectors():
+        return BANNED
+
+    return claims.get("privelage")
+
+
+def get_banned_collectors():
+    """Returns the set of banned collector ids.
+
+    The set is shared by the app and reloaded at most every
+    PRIVELAGE_REVOCATION_TTL seconds, so a ban made by another worker
+    revokes the banned user's token claims within that time.
+
+    Returns:
+        set: ids of banned collectors
+    """
+    banned = current_app.extensions.get("banned_collectors")
+    now = time.monotonic()
+    ttl = current_app.config.get("PRIVELAGE_REVOCATION_TTL", 30)
+
+    if banned is None or now - banned[0] > ttl:
+        engine, conn, metadata = dbm.db_connect()
+        privelages = dbm.privelage_table
+        select_stmt = db.select(privelages.c.collector_id).where(
+            privelages.c.privelage == BANNED
+        )
+        banned = (now, set(conn.execute(select_stmt).scalars()))
+        conn.close()
+        current_app.extensions["banned_collectors"] = banned
+
+    return banned[1]
+
+
+def revoke_privelage(user_id):
+    """Adds a freshly banned user to this worker's banned collectors straight
+    away, instead of waiting for the next reload.
+
+    Args:
+        user_id (int): id of the user that has been banned
+    """
+    banned = current_app.extensions.get("banned_collectors")
+    if banned is not None:
+        banned[1].add(user_id)
+
+
@@ -0,0 +1,532 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+import copy
+import logging
+import os
+import pickle
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+"""
+Preface:
+    - lookups of data that rarely changes (collectibles, campaigns, profiles,
+    the manager list) go through named caches, one per kind of data
+    - every cache keeps its entries in a CacheBackend, picked by CACHE_URL:
+        - unset: MemoryBackend, an LRU cache in the worker's own memory
+        - "redis://host:port/db": RedisBackend, a store shared by every worker,
+        with a small MemoryBackend in front of it
+    - entries are forgotten after CACHE_TTL seconds, and write functions
+    invalidate the entries they change; with RedisBackend the invalidation is
+    broadcast so every worker drops its local copy
+    - broadcast() sends other kinds of messages to every worker over the same
+    channel, e.g. changes to db_matching's index
+    - always import this module as main.database.db_cache, so every module
+    shares the same caches
+"""
+
+logger = logging.getLogger(__name__)
+
+# Returned by CacheBackend.get when a key is not cached, as None can be cached
+MISSING = object()
+
+# Cache name -> CacheBackend
+CACHES = {}
+
+# Cache name -> seconds its entries are kept for, for caches not using CACHE_TTL
+TTLS = {}
+
+# Name -> function handling the messages broadcast to that name, see broadcast()
+SUBSCRIBERS = {}
+
+# Client of the shared store, None when the caches are in-memory
+_client = None
+
+# Redis channel invalidations are broadcast on, and prefix of every cache key
+REDIS_PREFIX = "cache:"
+INVALIDATION_CHANNEL = REDIS_PREFIX + "invalidate"
+
+
+class CacheBackend:
+    """Store a cache keeps its entries in.
+
+    Keys are strings, and values anything that can be pickled.
+
+    Args:
+        name (string): name of the cache, used in its stats
+        max_entries (int): max number of entries kept in memory
+        ttl (int): seconds an entry is kept for
+    """
+
+    def __init__(self, name, max_entries=1024, ttl=300):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        """Returns the value cached for key, or MISSING."""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Caches value for key."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Removes the entry for key, if there is one."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Removes every entry."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns the cache's size and counters."""
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Thread safe LRU cache, in the worker's memory, whose entries expire
+    after ttl seconds.
+    """
+
+    def __init__(self, name, max_entries=1024, ttl=300):
+        super().__init__(name, max_entries, ttl)
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Caches value for key, evicting the least recently used entries if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the cache's size and counters.
+
+        Example Output:
+            {
+                "name": "collectibles",
+                "backend": "memory",
+                "entries": 100,
+                "max_entries": 4096,
+                "ttl": 600,
+                "hits": 950,
+                "misses": 100,
+                "evictions": 0,
+                "expirations": 0,
+                "invalidations": 2
+            }
+        """
+        with self._lock:
+            return {
+                "name": self.name,
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class RedisBackend(CacheBackend):
+    """Cache shared by every worker, kept in redis (or anything speaking its
+    protocol, e.g. helpers/cache_server.py).
+
+    Notes:
+        - recently used entries are also kept in a MemoryBackend for
+          local_ttl seconds, to save a round trip on repeated lookups
+        - deletes are broadcast on INVALIDATION_CHANNEL, and every worker drops
+          its local copy when it hears them
+        - if redis cannot be reached, lookups are misses, so the caller falls
+          back to the database
+
+    Args:
+        name (string): name of the cache
+        client (redis.Redis): client connected to the shared store
+        max_entries (int): max number of entries kept in memory
+        ttl (int): seconds an entry is kept in the shared store
+        local_ttl (int): seconds an entry is kept in memory
+    """
+
+    def __init__(self, name, client, max_entries=1024, ttl=300, local_ttl=5):
+        super().__init__(name, max_entries, ttl)
+
+        self.client = client
+        self.local = MemoryBackend(name, max_entries, local_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def redis_key(self, key):
+        return f"{REDIS_PREFIX}{self.name}:{key}"
+
+    def get(self, key):
+        start_listener(self.client)
+
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+
+        try:
+            data = self.client.get(self.redis_key(key))
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning("Cache %s unavailable: %s", self.name, e)
+            return MISSING
+
+        if data is None:
+            self.misses += 1
+            return MISSING
+
+        self.hits += 1
+        value = pickle.loads(data)
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        start_listener(self.client)
+
+        try:
+            self.client.set(self.redis_key(key), pickle.dumps(value), ex=self.ttl)
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning("Cache %s unavailable: %s", self.name, e)
+
+        self.local.set(key, value)
+
+    def delete(self, key):
+        self.local.delete(key)
+
+        try:
+            self.client.delete(self.redis_key(key))
+            self.client.publish(INVALIDATION_CHANNEL, f"{self.name}\n{key}")
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.error("Could not invalidate %s in cache %s: %s", key, self.name, e)
+
+    def clear(self):
+        self.local.clear()
+
+        try:
+            keys = list(self.client.scan_iter(match=self.redis_key("*")))
+            if keys:
+                self.client.delete(*keys)
+            # An empty key clears the whole cache
+            self.client.publish(INVALIDATION_CHANNEL, f"{self.name}\n")
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.error("Could not clear cache %s: %s", self.name, e)
+
+    def stats(self):
+        """Returns the cache's size and counters.
+
+        Notes:
+            hits and misses count lookups that reached redis, local holds the
+            stats of the worker's local copy
+
+        Example Output:
+            {
+                "name": "collectibles",
+                "backend": "redis",
+                "ttl": 600,
+                "hits": 90,
+                "misses": 10,
+                "errors": 0,
+                "local": {"name": "collectibles", "backend": "memory", ...}
+            }
+        """
+        return {
+            "name": self.name,
+            "backend": "redis",
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "local": self.local.stats(),
+        }
+
+    def drop_local(self, key):
+        """Drops the local copy of an entry invalidated by another worker.
+
+        Args:
+            key (string): key of the entry, or "" to drop every entry
+        """
+        if key:
+            self.local.delete(key)
+        else:
+            self.local.clear()
+
+
+""" |------------------------------------|
+    |     Broadcasting invalidations     |
+    |------------------------------------| """
+
+# Process id -> thread listening for invalidations in that process. Keyed by
+# pid as threads do not survive a fork, so each worker starts its own.
+_listeners = {}
+_listeners_lock = Lock()
+
+
+def start_listener(client):
+    """Starts listening for invalidations broadcast by other workers, if this
+    process is not already.
+
+    Args:
+        client (redis.Redis): client connected to the shared store
+    """
+    pid = os.getpid()
+    if pid in _listeners:
+        return
+
+    with _listeners_lock:
+        if pid in _listeners:
+            return
+
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: handle_invalidation})
+        except redis.RedisError as e:
+            # Tried again on the next lookup
+            logger.warning("Could not listen for cache invalidations: %s", e)
+            return
+
+        _listeners[pid] = pubsub.run_in_thread(
+            sleep_time=1, daemon=True, exception_handler=handle_listener_error
+        )
+
+
+def handle_invalidation(message):
+    """Drops the local copy of an entry another worker invalidated.
+
+    Args:
+        message (dictionary): pubsub message, whose data is "<cache>\\n<key>"
+    """
+    name, _, key = message["data"].decode("utf-8").partition("\n")
+    if name in SUBSCRIBERS:
+        SUBSCRIBERS[name](key)
+        return
+
+    cache = CACHES.get(name)
+
+    if isinstance(cache, RedisBackend):
+        cache.drop_local(key)
+
+
+def handle_listener_error(e, pubsub, thread):
+    """Keeps listening after the connection to redis drops.
+
+    Invalidations sent while disconnected are lost, so every local copy is
+    dropped.
+    """
+    logger.warning("Lost cache invalidation channel: %s", e)
+
+    for cache in CACHES.values():
+        if isinstance(cache, RedisBackend):
+            cache.drop_local("")
+
+    # None tells subscribers they may have missed messages
+    for handler in SUBSCRIBERS.values():
+        handler(None)
+
+    time.sleep(1)
+
+
+def subscribe(name, handler):
+    """Registers the function handling the messages broadcast to name.
+
+    Args:
+        name (string): name the messages are sent to, different from any cache's
+        handler (function): called with each message (a string), or with None
+                            when messages may have been lost
+    """
+    SUBSCRIBERS[name] = handler
+
+
+def broadcast(name, message):
+    """Sends a message to the handler subscribed to name in every worker.
+
+    Notes:
+        - this worker's handler gets the message straight away, other workers'
+          get it shortly after, or not at all if redis is unavailable
+        - without a shared store only this worker's handler gets it
+
+    Args:
+        name (string): name the handler was subscribed with
+        message (string): the message, e.g. a change to apply
+    """
+    if name in SUBSCRIBERS:
+        SUBSCRIBERS[name](message)
+
+    if _client is None:
+        return
+
+    start_listener(_client)
+    try:
+        _client.publish(INVALIDATION_CHANNEL, f"{name}\n{message}")
+    except redis.RedisError as e:
+        logger.error("Could not broadcast to %s: %s", name, e)
+
+
+""" |------------------------------------|
+    |        Functions for caches        |
+    |------------------------------------| """
+
+
+def init_app(app):
+    """Sets up the caches' backend and sizes from the app's settings.
+
+    Args:
+        app (Flask): the flask app whose settings we want to use
+    """
+    global _client
+
+    max_entries = app.config.get("CACHE_MAX_ENTRIES", 1024)
+    ttl = app.config.get("CACHE_TTL", 300)
+    url = app.config.get("CACHE_URL")
+
+    if url and redis is None:
+        app.logger.warning("redis is not installed, using in-memory caches")
+        url = None
+
+    client = _client = redis.Redis.from_url(url, socket_timeout=1) if url else None
+    local_ttl = app.config.get("CACHE_LOCAL_TTL", 5)
+
+    for name in list(CACHES):
+        cache_ttl = TTLS.get(name, ttl)
+        if client is not None:
+            CACHES[name] = RedisBackend(
+                name, client, max_entries, cache_ttl, min(local_ttl, cache_ttl)
+            )
+        else:
+            CACHES[name] = MemoryBackend(name, max_entries, cache_ttl)
+
+
+def get_cache(name, ttl=None):
+    """Returns the cache called name, creating an in-memory one if needed.
+
+    Args:
+        name (string): name of the cache, e.g. "collectibles"
+        ttl (int): seconds the cache keeps entries for, CACHE_TTL if None
+
+    Returns:
+        CacheBackend: the cache
+    """
+    if ttl is not None:
+        TTLS[name] = ttl
+
+    if name not in CACHES:
+        CACHES[name] = MemoryBackend(name, ttl=TTLS.get(name, 300))
+
+    return CACHES[name]
+
+
+def cached(name, ttl=None):
+    """Decorator caching a function's results by its arguments.
+
+    Notes:
+        - None results (e.g. an id that does not exist yet) are not cached
+        - the decorated function gets an invalidate(*args, **kwargs) function,
+          which removes the entry for those arguments
+        - callers get a deep copy of the cached value, so changing it, or the
+          rows inside it, is safe
+
+    Args:
+        name (string): name of the cache to keep the results in
+        ttl (int): seconds results are kept for, CACHE_TTL if None; for data
+                   that changes too often to invalidate on every write
+
+    Example:
+        @db_cache.cached("campaigns")
+        def get_campaign_name(campaign_id):
+            ...
+
+        get_campaign_name.invalidate(campaign_id)
+    """
+    get_cache(name, ttl)
+
+    def wrapper(fn):
+        def make_key(args, kwargs):
+            return f"{fn.__name__}:{args!r}:{sorted(kwargs.items())!r}"
+
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            # Looked up on each call, as init_app may have replaced the cache
+            cache = CACHES[name]
+            key = make_key(args, kwargs)
+
+            value = cache.get(key)
+            if value is MISSING:
+                value = fn(*args, **kwargs)
+                if value is None:
+                    return None
+                cache.set(key, value)
+
+            return copy.deepcopy(value)
+
+        decorator.invalidate = lambda *args, **kwargs: CACHES[name].delete(
+            make_key(args, kwargs)
+        )
+        return decorator
+
+    return wrapper
+
+
+def clear_all():
+    """Empties every cache, e.g. after the database has been reset."""
+    for cache in CACHES.values():
+        cache.clear()
+
+
+def stats():
+    """Returns the size and counters of every cache.
+
+    Returns:
+        [dictionary]: one CacheBackend.stats() per cache
+    """
+    return [cache.stats() for cache in CACHES.values()]
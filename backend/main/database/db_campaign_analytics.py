@@ -1,15 +1,55 @@
 from flask import jsonify
 import sqlalchemy as db
+from sqlalchemy.dialects import postgresql
 
 from db_helpers import rows_to_list
-from error import OK, InputError, AccessError
+from error import OK, InputError
+from main.database import db_cache
 import db_manager as dbm
 
-def return_analytics(manager_id):
+"""
+Preface:
+    - campaign analytics are read from two rollup tables, so a dashboard reads
+    a few rows per campaign or collectible per day instead of aggregating the
+    whole exchange history, wantlist and collections tables:
+        - campaign_daily_exchanges: how many times each campaign's collectibles
+        were sent and received in exchanges each day
+        - collectible_daily_activity: how many exchanges each collectible was
+        in each day, and how many of its wantlist and collection entries are
+        dated that day
+    - record_exchange() and record_activity() update the rollups in the same
+    transaction as the change they count, and rebuild_rollups() recounts them
+    from the tables, e.g. after data is loaded straight into the database:
+        flask --app server backfill-analytics
+    - the time series (return_timeseries) are bucketed, totalled and gathered
+    into one array per series by postgres, using window functions, so Python
+    only passes the arrays on
+"""
+
+# Sizes of the buckets analytics can be returned in
+BUCKETS = ("day", "week", "month")
+
+# Counters of collectible_daily_activity, see record_activity()
+ACTIVITY = ("exchanges", "wanted", "collected")
+
+# Most collectibles in the most wanted and most traded lists
+MAX_TOP = 50
+
+# Seconds time series are cached for, as the rollups change with every
+# exchange and wantlist or collection change
+TIMESERIES_CACHE_TTL = 60
+
+
+def return_analytics(manager_id, bucket="day"):
     """Given a manager, return the analytics for all their campaigns
 
+    Notes:
+        - only exchanges made while the campaign was running are counted
+        - weeks start on Monday, and each bucket is dated by its first day
+
     Args:
         manager_id (int): id of manager we want to find the analytics for
+        bucket (string): one of BUCKETS, the period each count is for
 
     Returns:
         JSON: information of our analytics
@@ -22,84 +62,521 @@ def return_analytics(manager_id):
                     "campaign_id": 5,
                     "campaign_name": "Galapagos Dove",
                     "exchange_dates": ["16/11/2023"],
-                    "exchanges_made": [2]
+                    "exchanges_made": [2],
+                    "exchanges_sent": [1],
+                    "exchanges_received": [1]
                 },
                 {
                     "campaign_id": 4,
                     "campaign_name": "Egyptian Viper",
                     "exchange_dates": ["16/11/2023"],
-                    "exchanges_made": [1]
+                    "exchanges_made": [1],
+                    "exchanges_sent": [0],
+                    "exchanges_received": [1]
                 }
             ]
         }, 200
     """
+    if bucket not in BUCKETS:
+        return jsonify({"msg": f"Bucket must be one of {', '.join(BUCKETS)}!"}), InputError
+
     engine, conn, metadata = dbm.db_connect()
 
-    # Loads in the campaigns, collectors and exchange_history tables
-    camp = db.Table("campaigns", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-    eh = db.Table("exchange_history", metadata, autoload_with=engine)
+    # Loads in the campaigns and campaign_daily_exchanges tables
+    camp = dbm.campaign_table
+    daily = dbm.campaign_daily_exchanges_table
 
-    # Find exchanges where collectible is being sent
-    join = db.join(camp, cbl,
-        (camp.c.manager_id == manager_id) &
-        (cbl.c.campaign_id == camp.c.id)).join(eh,
-        (eh.c.collectible_send_id == cbl.c.id) &
-        (eh.c.date_accepted >= camp.c.start_date) &
-        (eh.c.date_accepted < camp.c.end_date))
-    
-    outgoing_select_stmt = (db.select(
-        camp.c.id.label("campaign_id"),
-        camp.c.name.label("campaign_name"),
-        eh.c.date_accepted.label("exchange_dates"),
-        db.func.count(cbl.c.id).label("exchanges_made"),
-    ).group_by(
-        camp.c.id, camp.c.name, camp.c.start_date, camp.c.end_date, 
-        eh.c.date_accepted
-    ).order_by(
-        camp.c.id, eh.c.date_accepted
-    ).select_from(join))
+    period = bucket_start(daily.c.day, bucket)
 
-    outgoing_analytics = rows_to_list(conn.execute(outgoing_select_stmt).fetchall())
-
-    # Find exchanges where collectible is being received
-    join = db.join(camp, cbl,
+    # Reads the manager's campaigns' days within each campaign's dates
+    join = db.join(camp, daily,
         (camp.c.manager_id == manager_id) &
-        (cbl.c.campaign_id == camp.c.id)).join(eh,
-        (eh.c.collectible_receive_id == cbl.c.id) &
-        (eh.c.date_accepted >= camp.c.start_date) &
-        (eh.c.date_accepted < camp.c.end_date))
-    
-    incoming_select_stmt = (db.select(
+        (daily.c.campaign_id == camp.c.id) &
+        (daily.c.day >= camp.c.start_date) &
+        (daily.c.day < camp.c.end_date))
+
+    select_stmt = (db.select(
         camp.c.id.label("campaign_id"),
         camp.c.name.label("campaign_name"),
-        eh.c.date_accepted.label("exchange_dates"),
-        db.func.count(cbl.c.id).label("exchanges_made"),
+        period.label("exchange_date"),
+        db.func.sum(daily.c.sent_count + daily.c.received_count).label("exchanges_made"),
+        db.func.sum(daily.c.sent_count).label("exchanges_sent"),
+        db.func.sum(daily.c.received_count).label("exchanges_received"),
     ).group_by(
-        camp.c.id, camp.c.name, camp.c.start_date, camp.c.end_date, 
-        eh.c.date_accepted
+        camp.c.id, camp.c.name, period
     ).order_by(
-        camp.c.id, eh.c.date_accepted
+        camp.c.id, period
     ).select_from(join))
 
-    incoming_analytics = rows_to_list(conn.execute(incoming_select_stmt).fetchall())
-
-    all_analytics = outgoing_analytics + incoming_analytics
+    analytics = rows_to_list(conn.execute(select_stmt).fetchall())
+    conn.close()
 
     result = {}
 
-    for item in all_analytics:
+    for item in analytics:
         key = item['campaign_id']
-        if key in result:
-            result[key]['exchange_dates'].append(item['exchange_dates'])
-            result[key]['exchanges_made'].append(item['exchanges_made'])
-        else:
+        if key not in result:
             result[key] = {
                 'campaign_id': key,
                 'campaign_name': item['campaign_name'],
-                'exchange_dates': [item['exchange_dates']],
-                'exchanges_made': [item['exchanges_made']]
+                'exchange_dates': [],
+                'exchanges_made': [],
+                'exchanges_sent': [],
+                'exchanges_received': []
             }
 
+        result[key]['exchange_dates'].append(item['exchange_date'])
+        result[key]['exchanges_made'].append(item['exchanges_made'])
+        result[key]['exchanges_sent'].append(item['exchanges_sent'])
+        result[key]['exchanges_received'].append(item['exchanges_received'])
+
     return jsonify(list(result.values())), OK
 
+
+def return_timeseries(manager_id, bucket="week", top=10):
+    """Given a manager, return time series of the activity around their
+    campaigns' collectibles
+
+    Notes:
+        - trade_velocity: exchanges of each collectible per bucket, and their
+          running total
+        - campaigns: wantlist entries and collection entries of each campaign's
+          collectibles added per bucket (by date_added), and their running
+          totals, i.e. the wantlist demand and collection size over time
+        - most_wanted / most_traded: the top collectibles by wantlist entries
+          and by exchanges
+        - buckets with no activity are left out, each series lists the dates
+          its buckets start on
+        - results are cached for TIMESERIES_CACHE_TTL seconds
+
+    Args:
+        manager_id (int): id of manager we want to find the analytics for
+        bucket (string): one of BUCKETS, the period each count is for
+        top (int): number of collectibles in the top lists, at most MAX_TOP
+
+    Returns:
+        JSON, int: JSON holds the time series, int is the error code
+
+    Example Output:
+        {
+            "bucket": "week",
+            "trade_velocity": [
+                {
+                    "collectible_id": 12,
+                    "collectible_name": "Chimp",
+                    "campaign_id": 5,
+                    "dates": ["06/11/2023", "13/11/2023"],
+                    "exchanges": [2, 1],
+                    "total_exchanges": [2, 3]
+                }
+            ],
+            "campaigns": [
+                {
+                    "campaign_id": 5,
+                    "campaign_name": "Galapagos Dove",
+                    "dates": ["06/11/2023", "13/11/2023"],
+                    "wanted": [4, 0],
+                    "total_wanted": [4, 4],
+                    "collected": [10, 2],
+                    "total_collected": [10, 12]
+                }
+            ],
+            "most_wanted": [
+                {"rank": 1, "collectible_id": 12, "collectible_name": "Chimp",
+                 "campaign_id": 5, "wanted": 4, "exchanges": 3}
+            ],
+            "most_traded": [...]
+        }, 200
+    """
+    if bucket not in BUCKETS:
+        return jsonify({"msg": f"Bucket must be one of {', '.join(BUCKETS)}!"}), InputError
+
+    top = max(1, min(top, MAX_TOP))
+
+    return jsonify(find_timeseries(manager_id, bucket, top)), OK
+
+
+@db_cache.cached("analytics", ttl=TIMESERIES_CACHE_TTL)
+def find_timeseries(manager_id, bucket, top):
+    """Returns return_timeseries()'s time series as a dictionary."""
+    camp = dbm.campaign_table
+    cbl = dbm.collectible_table
+    activity = dbm.collectible_daily_activity_table
+
+    # The daily activity of the manager's collectibles
+    join = db.join(camp, cbl,
+        (camp.c.manager_id == manager_id) &
+        (cbl.c.campaign_id == camp.c.id)).join(activity,
+        (activity.c.collectible_id == cbl.c.id))
+    period = bucket_start(activity.c.day, bucket).label("period")
+
+    # Exchanges of each collectible per bucket
+    exchanges = db.select(
+        cbl.c.id.label("collectible_id"),
+        cbl.c.name.label("collectible_name"),
+        cbl.c.campaign_id,
+        period,
+        total(activity.c.exchanges).label("exchanges"),
+    ).select_from(join).where(activity.c.exchanges != 0).group_by(
+        cbl.c.id, cbl.c.name, cbl.c.campaign_id, period
+    ).subquery()
+
+    velocity_stmt = series_stmt(
+        exchanges, ["collectible_id", "collectible_name", "campaign_id"], ["exchanges"]
+    )
+
+    # Wantlist and collection entries of each campaign per bucket
+    entries = db.select(
+        camp.c.id.label("campaign_id"),
+        camp.c.name.label("campaign_name"),
+        period,
+        total(activity.c.wanted).label("wanted"),
+        total(activity.c.collected).label("collected"),
+    ).select_from(join).where(
+        (activity.c.wanted != 0) | (activity.c.collected != 0)
+    ).group_by(camp.c.id, camp.c.name, period).subquery()
+
+    campaigns_stmt = series_stmt(
+        entries, ["campaign_id", "campaign_name"], ["wanted", "collected"]
+    )
+
+    # Totals of each collectible, ranked both ways
+    totals = db.select(
+        cbl.c.id.label("collectible_id"),
+        cbl.c.name.label("collectible_name"),
+        cbl.c.campaign_id,
+        total(activity.c.wanted).label("wanted"),
+        total(activity.c.exchanges).label("exchanges"),
+    ).select_from(join).group_by(cbl.c.id, cbl.c.name, cbl.c.campaign_id).subquery()
+
+    ranked = db.select(
+        totals,
+        db.func.row_number().over(
+            order_by=(totals.c.wanted.desc(), totals.c.collectible_id)
+        ).label("wanted_rank"),
+        db.func.row_number().over(
+            order_by=(totals.c.exchanges.desc(), totals.c.collectible_id)
+        ).label("traded_rank"),
+    ).subquery()
+
+    top_stmt = db.select(ranked).where(
+        ((ranked.c.wanted_rank <= top) & (ranked.c.wanted > 0))
+        | ((ranked.c.traded_rank <= top) & (ranked.c.exchanges > 0))
+    )
+
+    engine, conn, metadata = dbm.db_connect()
+    velocity = [row._asdict() for row in conn.execute(velocity_stmt)]
+    campaigns = [row._asdict() for row in conn.execute(campaigns_stmt)]
+    top_rows = conn.execute(top_stmt).fetchall()
+    conn.close()
+
+    def top_list(rank, count):
+        rows = sorted(
+            (row for row in top_rows if getattr(row, rank) <= top and getattr(row, count) > 0),
+            key=lambda row: getattr(row, rank),
+        )
+        return [
+            {
+                "rank": getattr(row, rank),
+                "collectible_id": row.collectible_id,
+                "collectible_name": row.collectible_name,
+                "campaign_id": row.campaign_id,
+                "wanted": row.wanted,
+                "exchanges": row.exchanges,
+            }
+            for row in rows
+        ]
+
+    return {
+        "bucket": bucket,
+        "trade_velocity": velocity,
+        "campaigns": campaigns,
+        "most_wanted": top_list("wanted_rank", "wanted"),
+        "most_traded": top_list("traded_rank", "exchanges"),
+    }
+
+
+def series_stmt(counts, keys, columns):
+    """Select statement turning per bucket counts into one row per series
+
+    Args:
+        counts (Subquery): one row per series and bucket, with the keys, a
+                           period column and the count columns
+        keys ([string]): columns identifying a series
+        columns ([string]): count columns, each also gets a total_<column>
+                            running total
+
+    Returns:
+        Select: one row per series, with the keys, "dates" and an array per
+                count and running total, all in date order
+    """
+    key_columns = [counts.c[key] for key in keys]
+
+    running = db.select(
+        counts,
+        *(
+            db.func.sum(counts.c[column]).over(
+                partition_by=key_columns, order_by=counts.c.period
+            ).label(f"total_{column}")
+            for column in columns
+        ),
+    ).subquery()
+
+    def in_order(column):
+        return db.func.array_agg(postgresql.aggregate_order_by(column, running.c.period))
+
+    arrays = [in_order(db.func.to_char(running.c.period, "DD/MM/YYYY")).label("dates")]
+    for column in columns:
+        arrays.append(in_order(running.c[column]).label(column))
+        arrays.append(in_order(db.cast(running.c[f"total_{column}"], db.Integer)).label(f"total_{column}"))
+
+    running_keys = [running.c[key] for key in keys]
+    return db.select(*running_keys, *arrays).group_by(*running_keys).order_by(*running_keys)
+
+
+def bucket_start(day, bucket):
+    """Returns the first day of the bucket holding day, for one of BUCKETS."""
+    if bucket == "day":
+        return day
+
+    return db.cast(db.func.date_trunc(bucket, day), db.DATE)
+
+
+def total(column):
+    """Returns the sum of a counter, as an integer rather than a bigint."""
+    return db.cast(db.func.sum(column), db.Integer)
+
+
+""" |------------------------------------|
+    |   Functions for analytics rollups  |
+    |------------------------------------| """
+
+
+def record_exchange(collectible_s_id, collectible_r_id, date_accepted, conn):
+    """Counts an exchange in its collectibles' campaigns' day
+
+    Notes:
+        - conn is passed in so the count is written in the same transaction
+          as the exchange
+        - both campaigns are counted in one statement, in campaign order, so
+          two exchanges between the same campaigns lock their rows in the same
+          order instead of deadlocking
+
+    Args:
+        collectible_s_id (int): id of the collectible that was sent
+        collectible_r_id (int): id of the collectible that was received
+        date_accepted (date): day the exchange was made
+        conn (Connection): connection of the transaction adding the exchange
+    """
+    if date_accepted is None:
+        return
+
+    cbl = dbm.collectible_table
+    daily = dbm.campaign_daily_exchanges_table
+
+    sides = db.union_all(
+        db.select(
+            cbl.c.campaign_id,
+            db.literal(1).label("sent"),
+            db.literal(0).label("received"),
+        ).where(cbl.c.id == collectible_s_id),
+        db.select(
+            cbl.c.campaign_id,
+            db.literal(0).label("sent"),
+            db.literal(1).label("received"),
+        ).where(cbl.c.id == collectible_r_id),
+    ).subquery()
+
+    counts = db.select(
+        sides.c.campaign_id,
+        db.literal(date_accepted, db.DATE),
+        db.func.sum(sides.c.sent),
+        db.func.sum(sides.c.received),
+    ).where(sides.c.campaign_id.is_not(None)).group_by(
+        sides.c.campaign_id).order_by(sides.c.campaign_id)
+
+    insert_stmt = postgresql.insert(daily).from_select(
+        ["campaign_id", "day", "sent_count", "received_count"], counts)
+    conn.execute(insert_stmt.on_conflict_do_update(
+        index_elements=[daily.c.campaign_id, daily.c.day],
+        set_={
+            "sent_count": daily.c.sent_count + insert_stmt.excluded.sent_count,
+            "received_count": daily.c.received_count + insert_stmt.excluded.received_count,
+        },
+    ))
+
+    record_activity([
+        (collectible_s_id, date_accepted, "exchanges", 1),
+        (collectible_r_id, date_accepted, "exchanges", 1),
+    ], conn)
+
+
+def record_activity(changes, conn):
+    """Changes counters of collectible_daily_activity
+
+    Notes:
+        - conn is passed in so the counters change in the same transaction as
+          the entries they count
+        - the rows are changed in one statement, in (collectible_id, day)
+          order, so concurrent changes lock them in the same order
+
+    Args:
+        changes ([tuple]): (collectible_id, day, counter, change) for each
+                           change, counter being one of ACTIVITY, e.g.
+                           (5, date(2023, 11, 16), "wanted", 1)
+        conn (Connection): connection of the transaction making the changes
+    """
+    activity = dbm.collectible_daily_activity_table
+
+    rows = {}
+    for collectible_id, day, counter, change in changes:
+        # Entries without a date are not counted, see rebuild_rollups()
+        if collectible_id is None or day is None:
+            continue
+        row = rows.setdefault(
+            (collectible_id, day),
+            {"collectible_id": collectible_id, "day": day, **dict.fromkeys(ACTIVITY, 0)},
+        )
+        row[counter] += change
+
+    values = [
+        row for key, row in sorted(rows.items())
+        if any(row[counter] for counter in ACTIVITY)
+    ]
+    if not values:
+        return
+
+    insert_stmt = postgresql.insert(activity).values(values)
+    conn.execute(insert_stmt.on_conflict_do_update(
+        index_elements=[activity.c.collectible_id, activity.c.day],
+        set_={
+            counter: activity.c[counter] + insert_stmt.excluded[counter]
+            for counter in ACTIVITY
+        },
+    ))
+
+
+def rebuild_rollups(conn=None):
+    """Recounts both rollup tables from the exchange history, wantlist and
+    collections
+
+    Args:
+        conn (Connection): transaction to rebuild in, a new one if None
+
+    Returns:
+        dictionary: table name -> number of rows counted
+
+    Example Output:
+        {"campaign_daily_exchanges": 670, "collectible_daily_activity": 1200}
+    """
+    if conn is None:
+        with dbm.db_transaction() as conn:
+            return rebuild_rollups(conn)
+
+    return {
+        dbm.campaign_daily_exchanges_table.name: rebuild_campaign_exchanges(conn),
+        dbm.collectible_daily_activity_table.name: rebuild_collectible_activity(conn),
+    }
+
+
+def rebuild_campaign_exchanges(conn):
+    """Recounts campaign_daily_exchanges from the whole exchange history
+
+    Notes:
+        - the table is locked against writes while it is rebuilt, so exchanges
+          accepted meanwhile wait, and are then counted on top of the rebuild
+
+    Args:
+        conn (Connection): transaction to rebuild in
+
+    Returns:
+        int: number of campaign days counted
+    """
+    cbl = dbm.collectible_table
+    eh = dbm.exchange_history_table
+    daily = dbm.campaign_daily_exchanges_table
+
+    conn.execute(db.text(f"LOCK TABLE {daily.name} IN EXCLUSIVE MODE"))
+    conn.execute(db.delete(daily))
+
+    sides = db.union_all(
+        db.select(
+            eh.c.collectible_send_id.label("collectible_id"),
+            eh.c.date_accepted.label("day"),
+            db.literal(1).label("sent"),
+            db.literal(0).label("received"),
+        ),
+        db.select(
+            eh.c.collectible_receive_id.label("collectible_id"),
+            eh.c.date_accepted.label("day"),
+            db.literal(0).label("sent"),
+            db.literal(1).label("received"),
+        ),
+    ).subquery()
+
+    counts = db.select(
+        cbl.c.campaign_id,
+        sides.c.day,
+        db.func.sum(sides.c.sent),
+        db.func.sum(sides.c.received),
+    ).select_from(
+        db.join(sides, cbl, sides.c.collectible_id == cbl.c.id)
+    ).where(
+        cbl.c.campaign_id.is_not(None) & sides.c.day.is_not(None)
+    ).group_by(cbl.c.campaign_id, sides.c.day)
+
+    insert_stmt = db.insert(daily).from_select(
+        ["campaign_id", "day", "sent_count", "received_count"], counts)
+
+    return conn.execute(insert_stmt).rowcount
+
+
+def rebuild_collectible_activity(conn):
+    """Recounts collectible_daily_activity from the exchange history, wantlist
+    and collections
+
+    Notes:
+        - entries without a date are not counted
+        - the table is locked against writes while it is rebuilt, like
+          rebuild_campaign_exchanges()
+
+    Args:
+        conn (Connection): transaction to rebuild in
+
+    Returns:
+        int: number of collectible days counted
+    """
+    eh = dbm.exchange_history_table
+    want = dbm.wantlist_table
+    ctn = dbm.collections_table
+    activity = dbm.collectible_daily_activity_table
+
+    conn.execute(db.text(f"LOCK TABLE {activity.name} IN EXCLUSIVE MODE"))
+    conn.execute(db.delete(activity))
+
+    def counted(collectible_id, day, counter):
+        return db.select(
+            collectible_id.label("collectible_id"),
+            day.label("day"),
+            *(db.literal(int(c == counter)).label(c) for c in ACTIVITY),
+        )
+
+    entries = db.union_all(
+        counted(eh.c.collectible_send_id, eh.c.date_accepted, "exchanges"),
+        counted(eh.c.collectible_receive_id, eh.c.date_accepted, "exchanges"),
+        counted(want.c.collectible_id, want.c.date_added, "wanted"),
+        counted(ctn.c.collectible_id, ctn.c.date_added, "collected"),
+    ).subquery()
+
+    counts = db.select(
+        entries.c.collectible_id,
+        entries.c.day,
+        *(db.func.sum(entries.c[c]) for c in ACTIVITY),
+    ).where(
+        entries.c.collectible_id.is_not(None) & entries.c.day.is_not(None)
+    ).group_by(entries.c.collectible_id, entries.c.day)
+
+    insert_stmt = db.insert(activity).from_select(
+        ["collectible_id", "day", *ACTIVITY], counts)
+
+    return conn.execute(insert_stmt).rowcount
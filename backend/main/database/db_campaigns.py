@@ -3,9 +3,9 @@ from flask import jsonify
 import sqlalchemy as db
 
 from main import auth
-from main.database import db_collectibles
 from main.error import OK, InputError, AccessError
 from main.privelage import ADMIN, MANAGER
+from main.database import db_cache, db_versions
 import db_helpers, db_manager as dbm
 
 """ |------------------------------------|
@@ -20,7 +20,7 @@ def register_campaign(
     image,
     start_date,
     end_date,
-    collectibles,
+    collectibles=None,
     approved=False,
 ):
     """Register a new campaign into the database.
@@ -32,7 +32,8 @@ def register_campaign(
         image (string): url of image the campaign image
         start_date (string): start_date of campaign ("DD/MM/YYYY")
         end_date (string): end date of campaign ("DD/MM/YYYY")
-        collectibles ([dictionary]): list of collectibles to add to the campaign
+        collectibles ([dictionary]): list of collectibles to add to the campaign,
+            each with a "name", "description" and "image"
         approved (boolean): approval status of campaign (approved/not approved)
 
     Returns:
@@ -48,10 +49,8 @@ def register_campaign(
     start_date_obj = datetime.strptime(start_date, "%d/%m/%Y").date()
     end_date_obj = datetime.strptime(end_date, "%d/%m/%Y").date()
 
-    engine, conn, metadata = dbm.db_connect()
-
     # Loads in the campaign table into our metadata
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    campaigns = dbm.campaign_table
 
     insert_stmt = db.insert(campaigns).values(
         {
@@ -63,18 +62,32 @@ def register_campaign(
             "end_date": end_date_obj,
             "approved": approved,
         }
-    )
-    conn.execute(insert_stmt)
-    conn.close()
+    ).returning(campaigns.c.id)
+
+    # The campaign and its collectibles are added together, or not at all
+    with dbm.db_transaction() as conn:
+        campaign_id = conn.execute(insert_stmt).scalar_one()
+
+        # Registers all of the campaign's collectibles in a single insert
+        if collectibles:
+            collectible_rows = [
+                {
+                    "campaign_id": campaign_id,
+                    "name": collectible.get("name"),
+                    "description": collectible.get("description"),
+                    "image": collectible.get("image"),
+                }
+                for collectible in collectibles
+            ]
+            conn.execute(db.insert(dbm.collectible_table).values(collectible_rows))
 
-    for collectible in collectibles:
-        db_collectibles.register_collectible()
+    db_versions.bump_version(db_versions.CATALOG)
 
     return (
         jsonify(
             {
                 "msg": "Campaign successfully registered!",
-                "campaign_id": get_campaign_id(name),
+                "campaign_id": campaign_id,
             }
         ),
         OK,
@@ -99,7 +112,7 @@ def approve_campaign(admin_id, campaign_id):
         )
 
     engine, conn, metadata = dbm.db_connect()
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    campaigns = dbm.campaign_table
     update_stmt = (
         db.update(campaigns)
         .where(campaigns.c.id == campaign_id)
@@ -107,6 +120,8 @@ def approve_campaign(admin_id, campaign_id):
     )
     conn.execute(update_stmt)
     conn.close()
+    invalidate_campaign(campaign_id)
+    db_versions.bump_version(db_versions.CATALOG)
     return jsonify({"msg": "Campaign apporoved!"}), OK
 
 
@@ -118,7 +133,7 @@ def decline_campaign(admin_id, campaign_id):
         )
 
     engine, conn, metadata = dbm.db_connect()
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    campaigns = dbm.campaign_table
     update_stmt = (
         db.update(campaigns)
         .where(campaigns.c.id == campaign_id)
@@ -126,26 +141,16 @@ def decline_campaign(admin_id, campaign_id):
     )
     conn.execute(update_stmt)
     conn.close()
+    invalidate_campaign(campaign_id)
+    db_versions.bump_version(db_versions.CATALOG)
     return jsonify({"msg": "Campaign declined!"}), OK
 
 
 def get_campaign(name=None, id=None):
-    engine, conn, metadata = dbm.db_connect()
-
-    # Loads in the campaign table into our metadata
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    campaign = find_campaign(name=name, id=id)
 
-    select_stmt = None
-    if name:
-        select_stmt = db.select(campaigns).where(campaigns.c.name == name)
-    elif id:
-        select_stmt = db.select(campaigns).where(campaigns.c.id == id)
-    else:
-        return None
-
-    execute = conn.execute(select_stmt)
-    campaign = execute.fetchone()._asdict()
-    conn.close()
+    if campaign is None:
+        return jsonify({"msg": "Campaign does not exist!"}), InputError
 
     return jsonify(campaign), 200
 
@@ -153,7 +158,7 @@ def get_campaign(name=None, id=None):
 def get_all_campaigns():
     engine, conn, metadata = dbm.db_connect()
 
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    campaigns = dbm.campaign_table
     select_stmt = db.select(campaigns).where(campaigns.c.approved == True)
     results = conn.execute(select_stmt)
     conn.close()
@@ -182,7 +187,7 @@ def get_campaign_collectibles(campaign_id):
 
     engine, conn, metadata = dbm.db_connect()
 
-    collectibles = db.Table("collectibles", metadata, autoload_with=engine)
+    collectibles = dbm.collectible_table
 
     select_stmt = db.select(collectibles).where(
         collectibles.c.campaign_id == campaign_id
@@ -203,8 +208,27 @@ def get_campaign_collectibles(campaign_id):
     )
 
 
-def get_campaigns_and_collectibles():
-    """
+def get_campaigns_and_collectibles(
+    approved=None, limit=None, cursor=None, include_collectibles=True
+):
+    """Returns the campaigns, and the collectibles in each campaign.
+
+    Notes:
+        - the collectibles of every campaign on the page are found in one
+          query and grouped by campaign here
+        - when limit is given, campaigns are paginated by id and a "next"
+          cursor is added to the result, which is passed back in as cursor
+          to get the following page (null on the last page)
+
+    Args:
+        approved (boolean): only return campaigns with this approval status,
+                            all when None
+        limit (int): max number of campaigns to return, at most
+                     db_helpers.MAX_PAGE_SIZE, all when None
+        cursor (string): cursor from the previous page
+        include_collectibles (boolean): whether to add each campaign's
+                                        "collection_list"
+
     stub_return = {
         "campaigns": [
             {
@@ -243,10 +267,15 @@ def get_campaigns_and_collectibles():
                 "approved": False,
             },
     """
+    try:
+        limit = db_helpers.parse_limit(limit)
+    except ValueError:
+        return jsonify({"msg": "Limit must be at least 1!"}), InputError
+
     engine, conn, metadata = dbm.db_connect()
 
-    collectibles = db.Table("collectibles", metadata, autoload_with=engine)
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    collectibles = dbm.collectible_table
+    campaigns = dbm.campaign_table
 
     select_stmt = db.select(
         campaigns.c.id.label("campaign_id"),
@@ -256,38 +285,63 @@ def get_campaigns_and_collectibles():
         campaigns.c.start_date.label("campaign_start_date"),
         campaigns.c.end_date.label("campaign_end_date"),
         campaigns.c.approved.label("approved"),
-    ).select_from(campaigns)
-
-    campaigns = conn.execute(select_stmt)
-    campaigns = db_helpers.rows_to_list(campaigns.fetchall())
+    ).select_from(campaigns).order_by(campaigns.c.id)
+
+    if approved is not None:
+        select_stmt = select_stmt.where(campaigns.c.approved == approved)
+
+    # Continue on from the last campaign of the previous page
+    if limit is not None:
+        if cursor:
+            try:
+                (cursor_id,) = db_helpers.decode_cursor(cursor)
+                cursor_id = int(cursor_id)
+            except (TypeError, ValueError):
+                conn.close()
+                return jsonify({"msg": "Invalid cursor!"}), InputError
+            select_stmt = select_stmt.where(campaigns.c.id > cursor_id)
+
+        # Fetch one extra row to find out if there is another page
+        select_stmt = select_stmt.limit(limit + 1)
+
+    campaign_list = db_helpers.rows_to_list(conn.execute(select_stmt).fetchall())
+
+    next_cursor = None
+    if limit is not None and len(campaign_list) > limit:
+        campaign_list = campaign_list[:limit]
+        next_cursor = db_helpers.encode_cursor(campaign_list[-1]["campaign_id"])
+
+    if include_collectibles and campaign_list:
+        # Find the collectibles of every campaign on the page at once
+        campaign_dict = {}
+        for campaign in campaign_list:
+            campaign["collection_list"] = []
+            campaign_dict[campaign["campaign_id"]] = campaign
 
-    campaign_list = []
-    for campaign in campaigns:
-        campaign_id = campaign.get("campaign_id")
         select_stmt = (
             db.select(
+                collectibles.c.campaign_id.label("campaign_id"),
                 collectibles.c.id.label("collectible_id"),
                 collectibles.c.name.label("name"),
                 collectibles.c.image.label("image"),
                 collectibles.c.description.label("caption"),
             )
-            .where(collectibles.c.campaign_id == campaign_id)
-            .select_from(collectibles)
+            .where(collectibles.c.campaign_id.in_(list(campaign_dict.keys())))
+            .order_by(collectibles.c.campaign_id, collectibles.c.id)
         )
-        campaign_collectibles = conn.execute(select_stmt)
-        campaign["collection_list"] = db_helpers.rows_to_list(campaign_collectibles)
-        campaign_list.append(campaign)
+        collectible_list = db_helpers.rows_to_list(conn.execute(select_stmt).fetchall())
+
+        for collectible in collectible_list:
+            campaign_id = collectible.pop("campaign_id")
+            campaign_dict[campaign_id]["collection_list"].append(collectible)
 
     conn.close()
 
-    return (
-        jsonify(
-            {
-                "campaigns": campaign_list,
-            }
-        ),
-        OK,
-    )
+    result = {"campaigns": campaign_list}
+    if limit is not None:
+        result["next"] = next_cursor
+
+    return jsonify(result), OK
 
 
 def get_campaigns_in_period(time_period):
@@ -332,7 +386,7 @@ def get_campaigns_in_period(time_period):
 
     engine, conn, metadata = dbm.db_connect()
 
-    camp = db.Table("campaigns", metadata, autoload_with=engine)
+    camp = dbm.campaign_table
 
     cur_date = date.today()
     search_stmt = db.select(camp)
@@ -368,7 +422,7 @@ def add_campaign_feedback(user_id, campaign_id, feedback):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the campaign table into our metadata
-    feedback_table = db.Table("campaign_feedback", metadata, autoload_with=engine)
+    feedback_table = dbm.campaign_feedback_table
 
     cur_date = date.today()
 
@@ -396,6 +450,7 @@ def add_campaign_feedback(user_id, campaign_id, feedback):
 def get_campaign_feedback(user_id):
     """
     Returns the feedback to the campaign manager for a campaign.
+    The feedback is streamed out, see db_helpers.stream_list.
 
     stub_return = {
         "feedback": [
@@ -418,11 +473,9 @@ def get_campaign_feedback(user_id):
         ]
     }
     """
-    engine, conn, metadata = dbm.db_connect()
-
-    feedback = db.Table("campaign_feedback", metadata, autoload_with=engine)
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    feedback = dbm.campaign_feedback_table
+    collectors = dbm.collector_table
+    campaigns = dbm.campaign_table
 
     join = db.join(
         collectors, feedback, (collectors.c.id == feedback.c.collector_id)
@@ -440,12 +493,7 @@ def get_campaign_feedback(user_id):
         .select_from(join)
     )
 
-    res = conn.execute(select_stmt)
-    if res is None:
-        return jsonify({"msg": "Campaign id does not exist!"}), InputError
-    else:
-        feedback_list = db_helpers.rows_to_list(res.fetchall())
-        return jsonify({"feedback": feedback_list}), OK
+    return db_helpers.stream_list(select_stmt, "feedback"), OK
 
 
 """ |------------------------------------|
@@ -465,7 +513,7 @@ def get_campaign_id(campaign_name):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the campaign table into our metadata
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    campaigns = dbm.campaign_table
 
     select_stmt = db.select(campaigns.c.id).where(campaigns.c.name == campaign_name)
 
@@ -476,6 +524,7 @@ def get_campaign_id(campaign_name):
     return campaign_id
 
 
+@db_cache.cached("campaigns")
 def get_campaign_name(campaign_id):
     """Find the campaign name associated with the campaign_id.
 
@@ -483,17 +532,62 @@ def get_campaign_name(campaign_id):
         campaign_id (int): id of the campaign we want to find the name for
 
     Returns:
-        string: name of the campaign
+        string: name of the campaign, or None if the campaign does not exist
     """
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the campaign table into our metadata
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    campaigns = dbm.campaign_table
 
     select_stmt = db.select(campaigns.c.name).where(campaigns.c.id == campaign_id)
 
-    execute = conn.execute(select_stmt)
-    campaign_name = execute.fetchone()._asdict().get("name", None)
+    campaign_name = conn.execute(select_stmt).scalar_one_or_none()
     conn.close()
 
     return campaign_name
+
+
+@db_cache.cached("campaigns")
+def find_campaign(name=None, id=None):
+    """Returns a campaign's details, found by its name or id.
+
+    Notes:
+        always pass both arguments by keyword, so invalidate_campaign finds
+        the cached entries
+
+    Args:
+        name (string): name of the campaign
+        id (int): id of the campaign, used if no name is given
+
+    Returns:
+        dictionary: the campaign's row, or None if there is no such campaign
+    """
+    engine, conn, metadata = dbm.db_connect()
+
+    # Loads in the campaign table into our metadata
+    campaigns = dbm.campaign_table
+
+    if name:
+        select_stmt = db.select(campaigns).where(campaigns.c.name == name)
+    elif id:
+        select_stmt = db.select(campaigns).where(campaigns.c.id == id)
+    else:
+        return None
+
+    row = conn.execute(select_stmt).fetchone()
+    conn.close()
+
+    if row is None:
+        return None
+
+    return row._asdict()
+
+
+def invalidate_campaign(campaign_id):
+    """Removes a campaign's cached details after it has been changed.
+
+    Args:
+        campaign_id (int): id of the campaign that changed
+    """
+    find_campaign.invalidate(name=None, id=campaign_id)
+    find_campaign.invalidate(name=get_campaign_name(campaign_id), id=None)
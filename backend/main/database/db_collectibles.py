@@ -1,9 +1,15 @@
+from datetime import datetime
 from flask import jsonify
+import re
 import sqlalchemy as db
 
 from main.error import OK, InputError
+from main.database import db_cache, db_versions
 import db_helpers, db_manager as dbm
 
+# Number of collectibles a search returns when no limit is given
+SEARCH_PAGE_SIZE = 25
+
 """ |------------------------------------|
     |     Functions for collectibles     |
     |------------------------------------| """
@@ -29,10 +35,13 @@ def register_collectible(campaign_id, collectible_name, description, image):
     }
 
     engine, conn, metadata = dbm.db_connect()
-    collectibles = db.Table("collectibles", metadata, autoload_with=engine)
-    insert_stmt = db.insert(collectibles).values(collectible_dict)
-    conn.execute(insert_stmt)
+    collectibles = dbm.collectible_table
+    insert_stmt = (
+        db.insert(collectibles).values(collectible_dict).returning(collectibles.c.id)
+    )
+    collectible_id = conn.execute(insert_stmt).scalar_one()
     conn.close()
+    db_versions.bump_version(db_versions.CATALOG)
 
     return (
         jsonify(
@@ -41,7 +50,7 @@ def register_collectible(campaign_id, collectible_name, description, image):
                     collectible_name
                 ),
                 "campaign_id": campaign_id,
-                "collectible_id": find_collectible_id(collectible_name),
+                "collectible_id": collectible_id,
             }
         ),
         OK,
@@ -60,42 +69,106 @@ def get_collectible_info(user_id, collectible_id):
             - on success: dictionary of our collectible information
             - on error: error message
     """
-    engine, conn, metadata = dbm.db_connect()
-    collectibles = db.Table("collectibles", metadata, autoload_with=engine)
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    collectible_info = find_collectible_info(collectible_id)
+
+    if collectible_info is None:
+        return jsonify({"msg": "Invalid collectible id"}), InputError
+    else:
+        return jsonify(collectible_info), OK
+
+
+def get_all_collectibles():
+    """Returns all collectibles that are in our database.
+
+    Notes:
+        the list is streamed out, see db_helpers.stream_list
+
+    Returns:
+        JSON: list of collectibles and their information
+    """
+    collectibles = dbm.collectible_table
+    campaigns = dbm.campaign_table
 
     join = db.join(
-        collectibles, campaigns, 
-        (collectibles.c.campaign_id == campaigns.c.id) &
-        (collectibles.c.id == collectible_id)
+        collectibles, campaigns, (collectibles.c.campaign_id == campaigns.c.id)
     )
 
     select_stmt = db.select(
+        collectibles.c.id.label("id"),
         collectibles.c.name.label("collectible_name"),
-        campaigns.c.id.label("campaign_id"),
-        campaigns.c.name.label("campaign_name"),
         collectibles.c.image.label("collectible_image"),
         collectibles.c.description.label("collectible_description"),
-        campaigns.c.start_date.label("date_added"),
+        campaigns.c.name.label("campaign_name"),
+        campaigns.c.start_date.label("date_released"),
     ).select_from(join)
 
-    res = conn.execute(select_stmt)
+    return db_helpers.stream_list(select_stmt, "collectibles"), OK
 
-    if res is None:
-        return jsonify({"msg": "Invalid collectible id"}), InputError
-    else:
-        return jsonify(res.fetchone()._asdict()), OK    
 
+def search_collectibles(
+    query=None,
+    campaign_id=None,
+    released_after=None,
+    released_before=None,
+    sort="name",
+    limit=None,
+    cursor=None,
+):
+    """Searches the catalog of collectibles.
 
-def get_all_collectibles():
-    """Returns all collectibles that are in our database.
+    Notes:
+        - every word of query has to start a word in the collectible's name or
+          description, e.g. "chimp" matches "Chimpanzee"
+        - sort is "name" or "date_released", prefixed with "-" for descending
+        - a page continues after the row the cursor was made from, so cursors
+          are only valid for the sort they were made with
+
+    Args:
+        query (string): words to search for in names and descriptions
+        campaign_id (int): only return collectibles from this campaign
+        released_after (string): earliest release date ("DD/MM/YYYY")
+        released_before (string): latest release date ("DD/MM/YYYY")
+        sort (string): what to order the collectibles by
+        limit (int): max number of collectibles to return, at most
+                     db_helpers.MAX_PAGE_SIZE, SEARCH_PAGE_SIZE if None
+        cursor (string): "next" cursor returned with the previous page
 
     Returns:
-        JSON: list of collectibles and their information
+        JSON, int: JSON of matching collectibles, int of success/error code
+
+    Example Output:
+        {
+            "collectibles": [
+                {
+                    "id": 1,
+                    "collectible_name": "Chimpanzee",
+                    "collectible_image": "https://robohash.org/namutmagni.png",
+                    "collectible_description": "Morbi non quam nec dui luctus rutrum.",
+                    "campaign_name": "Mountain Duck",
+                    "date_released": "16/01/2022"
+                },
+            ],
+            "next": "WyJDaGltcGFuemVlIiwgMV0="
+        }, 200
     """
-    engine, conn, metadata = dbm.db_connect()
-    collectibles = db.Table("collectibles", metadata, autoload_with=engine)
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    try:
+        limit = db_helpers.parse_limit(limit, SEARCH_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"msg": "Limit must be at least 1!"}), InputError
+
+    collectibles = dbm.collectible_table
+    campaigns = dbm.campaign_table
+
+    # Sort name -> (column to order by, label of that column in the results)
+    sort_columns = {
+        "name": (collectibles.c.name, "collectible_name"),
+        "date_released": (campaigns.c.start_date, "date_released"),
+    }
+    descending = sort.startswith("-")
+    sort_name = sort.lstrip("-")
+    if sort_name not in sort_columns:
+        return jsonify({"msg": "Invalid sort!"}), InputError
+    sort_column, sort_label = sort_columns[sort_name]
 
     join = db.join(
         collectibles, campaigns, (collectibles.c.campaign_id == campaigns.c.id)
@@ -110,9 +183,69 @@ def get_all_collectibles():
         campaigns.c.start_date.label("date_released"),
     ).select_from(join)
 
-    coll_list = db_helpers.rows_to_list(conn.execute(select_stmt).fetchall())
+    # Each word is matched as a prefix, e.g. "chimp dui" -> "chimp:* & dui:*"
+    words = re.findall(r"\w+", query or "")
+    if words:
+        ts_query = " & ".join(f"{word}:*" for word in words)
+        select_stmt = select_stmt.where(
+            dbm.collectible_search_document.bool_op("@@")(
+                db.func.to_tsquery(db.literal("simple", db.String), ts_query)
+            )
+        )
+
+    if campaign_id is not None:
+        select_stmt = select_stmt.where(collectibles.c.campaign_id == campaign_id)
+
+    try:
+        if released_after is not None:
+            after = datetime.strptime(released_after, "%d/%m/%Y").date()
+            select_stmt = select_stmt.where(campaigns.c.start_date >= after)
+        if released_before is not None:
+            before = datetime.strptime(released_before, "%d/%m/%Y").date()
+            select_stmt = select_stmt.where(campaigns.c.start_date <= before)
+    except ValueError:
+        return jsonify({"msg": "Invalid date!"}), InputError
+
+    if cursor is not None:
+        key = db_helpers.decode_cursor(cursor)
+        try:
+            cursor_value, cursor_id = key
+            cursor_id = int(cursor_id)
+            if sort_name == "date_released":
+                cursor_value = datetime.strptime(cursor_value, "%Y-%m-%d").date()
+            elif not isinstance(cursor_value, str):
+                raise ValueError("cursor name must be a string")
+        except (TypeError, ValueError):
+            return jsonify({"msg": "Invalid cursor!"}), InputError
+
+        sort_key = db.tuple_(sort_column, collectibles.c.id)
+        cursor_key = db.tuple_(cursor_value, cursor_id)
+        select_stmt = select_stmt.where(
+            sort_key < cursor_key if descending else sort_key > cursor_key
+        )
+
+    if descending:
+        select_stmt = select_stmt.order_by(sort_column.desc(), collectibles.c.id.desc())
+    else:
+        select_stmt = select_stmt.order_by(sort_column, collectibles.c.id)
 
-    return jsonify({"collectibles": coll_list}), OK
+    # One extra row tells us whether there is a next page
+    select_stmt = select_stmt.limit(limit + 1)
+
+    engine, conn, metadata = dbm.db_connect()
+    rows = conn.execute(select_stmt).fetchall()
+    conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]._asdict()
+        next_cursor = db_helpers.encode_cursor(last[sort_label], last["id"])
+
+    return (
+        jsonify({"collectibles": db_helpers.rows_to_list(rows), "next": next_cursor}),
+        OK,
+    )
 
 
 """ |------------------------------------|
@@ -120,6 +253,7 @@ def get_all_collectibles():
     |------------------------------------| """
 
 
+@db_cache.cached("collectibles")
 def get_collectible(collectible_id):
     """Returns a collectible's information.
 
@@ -127,19 +261,59 @@ def get_collectible(collectible_id):
         collectible_id (int): id of the collectible we want id for
     
     Returns:
-        dictionary: dictionary containing the collectible's information
+        dictionary: dictionary containing the collectible's information, or
+                    None if the collectible does not exist
     """
     engine, conn, metadata = dbm.db_connect()
 
-    collectibles = db.Table("collectibles", metadata, autoload_with=engine)
+    collectibles = dbm.collectible_table
     select_stmt = db.select(collectibles).where(collectibles.c.id == collectible_id)
-    result = conn.execute(select_stmt)
+    row = conn.execute(select_stmt).fetchone()
+    conn.close()
+
+    if row is None:
+        return None
+
+    return row._asdict()
+
+
+@db_cache.cached("collectibles")
+def find_collectible_info(collectible_id):
+    """Returns a collectible's information along with its campaign's.
+
+    Args:
+        collectible_id (int): id of collectible we want to get info for
+
+    Returns:
+        dictionary: the collectible's information, or None if the collectible
+                    does not exist
+    """
+    engine, conn, metadata = dbm.db_connect()
+    collectibles = dbm.collectible_table
+    campaigns = dbm.campaign_table
+
+    join = db.join(
+        collectibles, campaigns, 
+        (collectibles.c.campaign_id == campaigns.c.id) &
+        (collectibles.c.id == collectible_id)
+    )
+
+    select_stmt = db.select(
+        collectibles.c.name.label("collectible_name"),
+        campaigns.c.id.label("campaign_id"),
+        campaigns.c.name.label("campaign_name"),
+        collectibles.c.image.label("collectible_image"),
+        collectibles.c.description.label("collectible_description"),
+        campaigns.c.start_date.label("date_added"),
+    ).select_from(join)
+
+    row = conn.execute(select_stmt).fetchone()
     conn.close()
 
-    if result is None:
-        return {}
+    if row is None:
+        return None
 
-    return result.fetchone()._asdict()
+    return row._asdict()
 
 
 def find_collectible_id(collectible_name):
@@ -155,7 +329,7 @@ def find_collectible_id(collectible_name):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the collectibles table
-    coll = db.Table("collectibles", metadata, autoload_with=engine)
+    coll = dbm.collectible_table
 
     # Finds and returns the id associated with the collectible_name
     select_stmt = db.select(coll).where(coll.c.name == collectible_name)
@@ -3,7 +3,8 @@ from datetime import date
 import sqlalchemy as db
 
 from main.error import OK, InputError
-import db_collectibles, db_helpers, db_manager as dbm
+from main.database import db_cache, db_matching
+import db_campaign_analytics, db_collectibles, db_helpers, db_manager as dbm
 
 
 """ |------------------------------------|
@@ -34,17 +35,24 @@ def insert_collectible(user_id, collectible_id):
             InputError,
         )
 
-    engine, conn, metadata = dbm.db_connect()
-    collections = db.Table("collections", metadata, autoload_with=engine)
+    collections = dbm.collections_table
+    curr_date = date.today()
     insert_stmt = db.insert(collections).values(
         {
             "collector_id": user_id,
             "collectible_id": collectible_id,
-            "date_added": date.today(),
+            "date_added": curr_date,
         }
-    )
-    result = conn.execute(insert_stmt)
-    conn.close()
+    ).returning(collections.c.id)
+
+    with dbm.db_transaction() as conn:
+        result = conn.execute(insert_stmt).scalar_one_or_none()
+        if result is not None:
+            db_campaign_analytics.record_activity(
+                [(collectible_id, curr_date, "collected", 1)], conn)
+
+    if result is not None:
+        db_matching.update_holding(user_id, collectible_id)
 
     if result is None:
         return (
@@ -64,6 +72,7 @@ def insert_collectible(user_id, collectible_id):
                     "msg": "Collectible {} successfully added to collection!".format(
                         collectible_id
                     ),
+                    "collection_id": result,
                 }
             ),
             OK,
@@ -94,12 +103,21 @@ def remove_collectible(user_id, collection_id):
             InputError,
         )
 
-    engine, conn, metadata = dbm.db_connect()
-    collections = db.Table("collections", metadata, autoload_with=engine)
+    collections = dbm.collections_table
 
-    dlt_stmt = db.delete(collections).where(collections.c.id == collection_id)
-    result = conn.execute(dlt_stmt)
-    conn.close()
+    dlt_stmt = db.delete(collections).where(
+        collections.c.id == collection_id
+    ).returning(collections.c.collectible_id, collections.c.date_added)
+
+    with dbm.db_transaction() as conn:
+        removed = conn.execute(dlt_stmt).one_or_none()
+        if removed is not None:
+            db_campaign_analytics.record_activity(
+                [(removed.collectible_id, removed.date_added, "collected", -1)], conn)
+    get_collectible_id.invalidate(collection_id)
+
+    if removed is not None:
+        db_matching.update_holding(user_id, removed.collectible_id)
 
     return (
         jsonify(
@@ -124,6 +142,9 @@ def get_collection(collector_id):
             - on success: list of colllectibles in collection
             - on error: error message
         int: success/error code
+
+    Notes:
+        the collection is streamed out, see db_helpers.stream_list
         
     Example Output:
         {"collection": [
@@ -140,10 +161,9 @@ def get_collection(collector_id):
     }
     """
 
-    engine, conn, metadata = dbm.db_connect()
-    collections = db.Table("collections", metadata, autoload_with=engine)
-    collectibles = db.Table("collectibles", metadata, autoload_with=engine)
-    campaigns = db.Table("campaigns", metadata, autoload_with=engine)
+    collections = dbm.collections_table
+    collectibles = dbm.collectible_table
+    campaigns = dbm.campaign_table
 
     join = db.join(
         collections,
@@ -164,24 +184,7 @@ def get_collection(collector_id):
         campaigns.c.start_date.label("date_released")
     ).select_from(join)
 
-    results = conn.execute(select_stmt)
-    conn.close()
-
-    if results is None:
-        return (
-            jsonify(
-                {
-                    "msg": "User {}'s collection is empty!".format(collector_id),
-                }
-            ),
-            InputError,
-        )
-
-    rows = results.fetchall()
-
-    collection = db_helpers.rows_to_list(rows)
-
-    return jsonify({"collection": collection}), OK
+    return db_helpers.stream_list(select_stmt, "collection"), OK
 
 
 def user_has_collectible(user_id, collectible_id):
@@ -195,7 +198,7 @@ def user_has_collectible(user_id, collectible_id):
         JSON: success/error message
     """
     engine, conn, metadata = dbm.db_connect()
-    collections = db.Table("collections", metadata, autoload_with=engine)
+    collections = dbm.collections_table
     exists_criteria = db.select(collections).where(
         (collections.c.collector_id == user_id)
         & (collections.c.collectible_id == collectible_id)
@@ -227,25 +230,10 @@ def move_collectible(sender_id, receiver_id, collection_id):
     Example Output:
         {"msg": "Collectible has successfully been moved!}, 200
     """
-    engine, conn, metadata = dbm.db_connect()
-
-    # Loads in the collections and collectibles table
-    ctn = db.Table("collections", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-
-    # Find id of collectible associated with the collection
-    join = db.join(ctn, cbl,
-        (ctn.c.collectible_id == cbl.c.id) & (ctn.c.id == collection_id))
-    
-    select_stmt = (db.select(
-        cbl.c.id.label("collectible_id")
-    )).select_from(join)
-
     # Find the collectible id, remove the collection from sender, and add to collection of receiver
-    collectible_id = conn.execute(select_stmt).fetchone()._asdict().get("collectible_id")
+    collectible_id = get_collectible_id(collection_id)
     remove_collectible(sender_id, collection_id)
     insert_collectible(receiver_id, collectible_id)
-    conn.close()
 
     return jsonify({"msg": "Collectible has successfully been moved!"}), OK
 
@@ -265,7 +253,7 @@ def user_owns_collection(user_id, collection_id):
         boolean: whether or not the collection_id is linked to that user
     """
     engine, conn, metadata = dbm.db_connect()
-    collections = db.Table("collections", metadata, autoload_with=engine)
+    collections = dbm.collections_table
     select_stmt = db.select(collections).where(collections.c.id == collection_id)
     result = conn.execute(select_stmt)
     conn.close()
@@ -284,7 +272,7 @@ def get_last_collection(user_id):
     """
     engine, conn, metadata = dbm.db_connect()
 
-    collections = db.Table("collections", metadata, autoload_with=engine)
+    collections = dbm.collections_table
     select_stmt = (
         db.select(collections)
         .where(collections.c.collector_id == user_id)
@@ -296,33 +284,33 @@ def get_last_collection(user_id):
     collection_dict = results.fetchone()._asdict()
     return collection_dict
 
+@db_cache.cached("collections")
 def get_collectible_id(collection_id):
     """Find the collectible_id from the collection_id
 
+    Notes:
+        the collectible in a collection never changes (trades only change who
+        owns it), so the result is cached until the collection is removed
+
     Args:
         collection_id (int): id of the collection we want to find a collectible_id for
     
     Returns:
-        int: int of the collectible_id from the collection_id
+        int: int of the collectible_id from the collection_id, or None if the
+             collection does not exist
 
     Example Output:
         2
     """
     engine, conn, metadata = dbm.db_connect()
 
-    # Loads in the collection and collectible tables
-    ctn = db.Table("collections", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
+    # Loads in the collections table
+    ctn = dbm.collections_table
 
-    join = db.join(ctn, cbl,
-        (ctn.c.collectible_id == cbl.c.id) & (ctn.c.id == collection_id))
-    
-    select_stmt = (db.select(
-        cbl.c.id.label("collectible_id")
-    )).select_from(join)
+    select_stmt = db.select(ctn.c.collectible_id).where(ctn.c.id == collection_id)
 
     # Find the collectible id
-    collectible_id = conn.execute(select_stmt).fetchone()._asdict().get("collectible_id")
+    collectible_id = conn.execute(select_stmt).scalar_one_or_none()
     conn.close()
 
     return collectible_id
@@ -1,7 +1,7 @@
 from flask import jsonify
 import sqlalchemy as db
 
-from main.database import db_helpers
+from main.database import db_cache, db_helpers
 from main.error import OK, InputError
 from main.privelage import BANNED, COLLECTOR, MANAGER
 import auth
@@ -26,25 +26,30 @@ def insert_collector(email, username, password, privelage=COLLECTOR):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the collector table into our metadata
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
-    privelages = db.Table("privelages", metadata, autoload_with=engine)
-
-    # Inserts a collector into the collector table
-    insert_stmt = db.insert(collectors).values(
-        {"email": email, "username": username, "password": password}
+    collectors = dbm.collector_table
+    privelages = dbm.privelage_table
+
+    # Inserts a collector into the collector table, and uses the generated id
+    # to insert their privelage within the same statement
+    collector_cte = (
+        db.insert(collectors)
+        .values({"email": email, "username": username, "password": password})
+        .returning(collectors.c.id)
+        .cte("new_collector")
     )
-    conn.execute(insert_stmt)
-
-    select_stmt = db.select(collectors.c.id).where(collectors.c.email == email)
-    cursor = conn.execute(select_stmt)
-    collector_id = cursor.fetchone()._asdict().get("id")
-
-    insert_stmt = db.insert(privelages).values(
-        {"collector_id": collector_id, "privelage": privelage}
+    insert_stmt = (
+        db.insert(privelages)
+        .from_select(
+            ["collector_id", "privelage"],
+            db.select(collector_cte.c.id, db.literal(privelage)),
+        )
+        .returning(privelages.c.collector_id)
     )
-    cursor = conn.execute(insert_stmt)
+    collector_id = conn.execute(insert_stmt).scalar_one()
 
     conn.close()
+    if privelage == MANAGER:
+        find_managers.invalidate()
 
     return (
         jsonify({"msg": "Collector successfully added!", "user_id": collector_id}),
@@ -88,7 +93,7 @@ def update_collector(
 
     engine, conn, metadata = dbm.db_connect()
 
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
+    collectors = dbm.collector_table
 
     update_stmt = db.update(collectors).where(collectors.c.id == id).values(update_dict)
     conn.execute(update_stmt)
@@ -98,6 +103,8 @@ def update_collector(
     collector_info = result.fetchone()._asdict()
 
     conn.close()
+    find_collector.invalidate(id)
+    find_managers.invalidate()
 
     return (
         jsonify(
@@ -111,22 +118,17 @@ def get_all_collectors():
     """get_all_collectors.
 
     Returns dictionary with collectors value a list of all collectors.
+    The list is streamed out, see db_helpers.stream_list.
     """
-    engine, conn, metadata = dbm.db_connect()
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
-    privelages = db.Table("privelages", metadata, autoload_with=engine)
+    collectors = dbm.collector_table
+    privelages = dbm.privelage_table
 
     join = db.join(collectors, privelages,
         (collectors.c.id == privelages.c.collector_id))
 
     select_stmt = db.select(collectors).where(privelages.c.privelage == COLLECTOR).select_from(join)
-    result = conn.execute(select_stmt)
-    conn.close()
-
-    all_collectors_rows = result.all()
-    all_collectors = [row._asdict() for row in all_collectors_rows]
 
-    return jsonify({"collectors": all_collectors}), OK
+    return db_helpers.stream_list(select_stmt, "collectors"), OK
 
 
 def get_collector(user_id=None, email=None, username=None):
@@ -159,25 +161,13 @@ def get_collector(user_id=None, email=None, username=None):
         Raises:
             InputError: Not a valid collector
     """
-    engine, conn, metadata = dbm.db_connect()
-
-    # Loads in the collector table into our metadata
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
-    select_stmt = None
-    if email:
-        select_stmt = db.select(collectors).where(collectors.c.email == email)
-    elif username:
-        select_stmt = db.select(collectors).where(collectors.c.username == username)
-    elif user_id:
-        select_stmt = db.select(collectors).where(collectors.c.id == user_id)
+    if email or username:
+        user_id = get_collector_id(email=email, username=username)
 
-    result = conn.execute(select_stmt)
-    if result is None:
+    collector_info = find_collector(user_id) if user_id else None
+    if collector_info is None:
         return jsonify({"msg": "Invalid collector id"}), InputError
 
-    collector_info = result.fetchone()._asdict()
-    conn.close()
-
     return jsonify(collector_info), OK
 
 
@@ -212,33 +202,7 @@ def get_managers():
         ]
     }
     """
-    engine, conn, metadata = dbm.db_connect()
-
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
-    privelages = db.Table("privelages", metadata, autoload_with=engine)
-
-    join = db.join(
-        collectors,
-        privelages,
-        (privelages.c.privelage == MANAGER)
-        & (collectors.c.id == privelages.c.collector_id),
-    )
-
-    select_stmt = db.select(
-        collectors.c.id.label("user_id"),
-        collectors.c.username.label("username"),
-        collectors.c.profile_picture.label("profile_img"),
-        collectors.c.first_name.label("first_name"),
-        collectors.c.last_name.label("last_name"),
-        collectors.c.email.label("email"),
-        collectors.c.phone.label("phone"),
-        privelages.c.privelage.label("privelage"),
-    ).select_from(join)
-
-    result = conn.execute(select_stmt)
-    managers = db_helpers.rows_to_list(result.fetchall())
-
-    return jsonify({"managers": managers}), OK
+    return jsonify({"managers": find_managers()}), OK
 
 
 def update_socials(user_id, twitter_handle=None, facebook_handle=None, instagram_handle=None):
@@ -259,7 +223,7 @@ def update_socials(user_id, twitter_handle=None, facebook_handle=None, instagram
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the collectors table
-    ctr = db.Table("collectors", metadata, autoload_with=engine)
+    ctr = dbm.collector_table
 
     update_dict = {}
 
@@ -273,6 +237,7 @@ def update_socials(user_id, twitter_handle=None, facebook_handle=None, instagram
     
     conn.execute(update_stmt)
     conn.close()
+    find_collector.invalidate(user_id)
 
     return jsonify({"msg": f"User {user_id}'s socials have been updated!"}), OK
 
@@ -287,7 +252,7 @@ def ban_collector(admin_id, collector_id):
     """
     engine, conn, metadata = dbm.db_connect()
 
-    privelages = db.Table("privelages", metadata, autoload_with=engine)
+    privelages = dbm.privelage_table
 
     update_stmt = (
         db.update(privelages)
@@ -297,6 +262,10 @@ def ban_collector(admin_id, collector_id):
     conn.execute(update_stmt)
     conn.close()
 
+    # Stop trusting the privelage claim in the banned collector's token
+    auth.revoke_privelage(collector_id)
+    find_managers.invalidate()
+
     return
 
 
@@ -305,6 +274,78 @@ def ban_collector(admin_id, collector_id):
     |------------------------------------| """
 
 
+@db_cache.cached("collectors")
+def find_collector(user_id):
+    """Returns a collector's details.
+
+    Notes:
+        - the password hash is left out, as the result is kept in a cache
+          shared by every worker
+        - user_id must be an int, as it is part of the cache key that
+          find_collector.invalidate(user_id) removes
+
+    Args:
+        user_id (int): id of the collector
+
+    Returns:
+        dictionary: the collector's row, or None if there is no such collector
+    """
+    engine, conn, metadata = dbm.db_connect()
+
+    # Loads in the collector table into our metadata
+    collectors = dbm.collector_table
+    select_stmt = db.select(
+        *(column for column in collectors.c if column.name != "password")
+    ).where(collectors.c.id == user_id)
+    row = conn.execute(select_stmt).fetchone()
+    conn.close()
+
+    if row is None:
+        return None
+
+    return row._asdict()
+
+
+@db_cache.cached("managers")
+def find_managers():
+    """Returns every manager's details.
+
+    Notes:
+        cached until a collector's details or privelage change
+
+    Returns:
+        [dictionary]: list of dictionaries of our managers
+    """
+    engine, conn, metadata = dbm.db_connect()
+
+    collectors = dbm.collector_table
+    privelages = dbm.privelage_table
+
+    join = db.join(
+        collectors,
+        privelages,
+        (privelages.c.privelage == MANAGER)
+        & (collectors.c.id == privelages.c.collector_id),
+    )
+
+    select_stmt = db.select(
+        collectors.c.id.label("user_id"),
+        collectors.c.username.label("username"),
+        collectors.c.profile_picture.label("profile_img"),
+        collectors.c.first_name.label("first_name"),
+        collectors.c.last_name.label("last_name"),
+        collectors.c.email.label("email"),
+        collectors.c.phone.label("phone"),
+        privelages.c.privelage.label("privelage"),
+    ).select_from(join)
+
+    result = conn.execute(select_stmt)
+    managers = db_helpers.rows_to_list(result.fetchall())
+    conn.close()
+
+    return managers
+
+
 def get_collector_id(email=None, username=None):
     """Returns the user id associated with an email or username.
 
@@ -318,7 +359,7 @@ def get_collector_id(email=None, username=None):
         int: id of the user
     """
     engine, conn, metadata = dbm.db_connect()
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
+    collectors = dbm.collector_table
 
     select_stmt = None
     if email:
@@ -350,7 +391,7 @@ def get_collector_pw(id=None, email=None):
         string: string of the hashed password
     """
     engine, conn, metadata = dbm.db_connect()
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
+    collectors = dbm.collector_table
 
     select_stmt = None
     if id:
@@ -380,7 +421,7 @@ def get_collector_dict(user_id=None, email=None, username=None):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the collector table into our metadata
-    collectors = db.Table("collectors", metadata, autoload_with=engine)
+    collectors = dbm.collector_table
     select_stmt = None
     if email:
         select_stmt = db.select(collectors).where(collectors.c.email == email)
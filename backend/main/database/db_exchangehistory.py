@@ -2,56 +2,69 @@ from datetime import datetime
 from flask import jsonify
 import sqlalchemy as db
 
-from db_helpers import rows_to_list
-from error import OK
-import db_collections, db_manager as dbm
+from db_helpers import decode_cursor, encode_cursor, parse_limit, rows_to_list
+from error import OK, InputError
+import db_campaign_analytics, db_manager as dbm
 
 
-def add_exhange_history(trade_info, engine, conn, metadata):
+def add_exhange_history(trade_info, conn):
     """Add an accepted trade offer to our exchange history table
 
+    Notes:
+        - conn is passed in so the entry is written in the caller's transaction
+        - the exchange is also counted in the campaign analytics rollups
+
     Args:
-        trade_information (dictionary): trade information to add to exchange history
-        engine, conn, metadata: db connection helpers 
-    
+        trade_info (dictionary): trade information to add to exchange history,
+            holding sender_id, collectible_s_id, receiver_id, collectible_r_id,
+            date_offered and date_accepted
+        conn (Connection): connection of the transaction accepting the trade
+
     Returns:
-        JSON, int: JSON of success/error message, int of success/error code
+        dictionary: message of success/error
 
     Example Output:
-        {"msg": "Entry into exchange history added successfully!"}, 200
+        {"msg": "Entry into exchange history added successfully!"}
     """
-    engine, conn, metadata = dbm.db_connect()
-
     # Loads in the exchange_history table
-    exchange_history = db.Table("exchange_history", metadata, autoload_with=engine)
-
-    # Convert collection ids to collectible ids
-    collectible_s_id = db_collections.get_collectible_id(trade_info.get("collection_s_id"))
-    collectible_r_id = db_collections.get_collectible_id(trade_info.get("collection_r_id"))
-
-    # Convert the dates from strings to Date objects
-    date_offered_obj = datetime.strptime(trade_info.get("date_offered"), "%d/%m/%Y").date()
-    date_accepted_obj = datetime.strptime(trade_info.get("date_updated"), "%d/%m/%Y").date()
+    exchange_history = dbm.exchange_history_table
 
     eh_insert_stmt = db.insert(exchange_history).values({
         "trade_sender_id": trade_info.get("sender_id"),
-        "collectible_send_id": collectible_s_id,
+        "collectible_send_id": trade_info.get("collectible_s_id"),
         "trade_receiver_id": trade_info.get("receiver_id"),
-        "collectible_receive_id": collectible_r_id,
-        "date_offered": date_offered_obj,
-        "date_accepted": date_accepted_obj
+        "collectible_receive_id": trade_info.get("collectible_r_id"),
+        "date_offered": trade_info.get("date_offered"),
+        "date_accepted": trade_info.get("date_accepted")
     })
     conn.execute(eh_insert_stmt)
 
-    return jsonify({"msg": "Entry into exchange history added successfully!"}), OK
+    # Counts the exchange in the campaign analytics, in the same transaction
+    db_campaign_analytics.record_exchange(
+        trade_info.get("collectible_s_id"),
+        trade_info.get("collectible_r_id"),
+        trade_info.get("date_accepted"),
+        conn,
+    )
 
+    return {"msg": "Entry into exchange history added successfully!"}
 
-def find_exchange_history(user_id):
+
+def find_exchange_history(user_id, limit=None, cursor=None):
     """Finds all exchange history rows that involve the specified collector
 
+    Notes:
+        - both sides of the exchange are found in a single query, newest first
+        - when limit is given, the result is paginated and returned as
+          {"exchanges": [...], "next": cursor}, where "next" is passed back in
+          as cursor to get the following page (null on the last page)
+
     Args:
         user_id (int): id of the collector that we want to find the exchange 
         history for
+        limit (int): max number of exchanges to return, at most MAX_PAGE_SIZE,
+                     all when None
+        cursor (string): cursor from the previous page
 
     Returns:
         JSON, int: JSON of list of all accepted exchanges of user,
@@ -91,89 +104,89 @@ def find_exchange_history(user_id):
             ]
         }, 200
     """
-    engine, conn, metadata = dbm.db_connect()
+    try:
+        limit = parse_limit(limit)
+    except ValueError:
+        return jsonify({"msg": "Limit must be at least 1!"}), InputError
 
-    # Loads in the exchange history table
-    eh = db.Table("exchange_history", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-    ctr = db.Table("collectors", metadata, autoload_with=engine)
+    engine, conn, metadata = dbm.db_connect()
 
-    # First find all accepted trades where the user sent the trade
-    join = db.join(eh, cbl,
-        (eh.c.collectible_send_id == cbl.c.id)).join(ctr,
-        (eh.c.trade_sender_id == ctr.c.id) &
-        (ctr.c.id == user_id))
+    # Loads in the exchange history, collectibles and collectors tables
+    eh = dbm.exchange_history_table
+    ctr = dbm.collector_table
+    traded_cbl = dbm.collectible_table.alias("traded_cbl")
+    accepted_cbl = dbm.collectible_table.alias("accepted_cbl")
 
-    select_stmt = (db.select(
+    # Exchanges where the user sent the trade, and where the user received it
+    sent_stmt = db.select(
         eh.c.id.label("exchange_id"),
-        cbl.c.id.label("traded_collectible_id"),
-        cbl.c.name.label("traded_collectible_name"),
-        cbl.c.image.label("traded_collectible_img"),
-        eh.c.date_offered.label("offer_made_date"),
-        eh.c.date_accepted.label("accepted_date"),
+        eh.c.collectible_send_id.label("traded_collectible_id"),
+        eh.c.collectible_receive_id.label("accepted_collectible_id"),
         eh.c.trade_receiver_id.label("trader_collector_id"),
-        eh.c.collectible_receive_id.label("collectible_receive_id")
-    ).select_from(join))
-
-    outgoing_exchanges = rows_to_list(conn.execute(select_stmt).fetchall())
-
-    for exchange in outgoing_exchanges:
-        # Find username and profile_img of trade receiver
-        trade_r_id = exchange.get("trader_collector_id")
-        receiver_select_stmt = (db.select(
-            ctr.c.username.label("trader_username"),
-            ctr.c.profile_picture.label("trader_profile_img")
-        ).where(ctr.c.id == trade_r_id))
-        receiver_info = conn.execute(receiver_select_stmt).fetchone()._asdict()
-        exchange.update(receiver_info)
-
-        collectible_r_id = exchange.get("collectible_receive_id")
-        collectible_select_stmt = (db.select(
-            cbl.c.id.label("accepted_collectible_id"),
-            cbl.c.name.label("accepted_collectible_name"),
-            cbl.c.image.label("accepted_collectible_img")
-        ).where(cbl.c.id == collectible_r_id))
-        collectible_info = conn.execute(collectible_select_stmt).fetchone()._asdict()
-        exchange.update(collectible_info)
-
-    # Second find all accepted trades where user receives the trade
-    join = db.join(eh, cbl,
-        (eh.c.collectible_receive_id == cbl.c.id)).join(ctr,
-        (eh.c.trade_receiver_id == ctr.c.id) &
-        (ctr.c.id == user_id))
+        eh.c.date_offered.label("date_offered"),
+        eh.c.date_accepted.label("date_accepted"),
+    ).where(eh.c.trade_sender_id == user_id)
 
-    select_stmt = (db.select(
+    received_stmt = db.select(
         eh.c.id.label("exchange_id"),
-        cbl.c.id.label("traded_collectible_id"),
-        cbl.c.name.label("traded_collectible_name"),
-        cbl.c.image.label("traded_collectible_img"),
-        eh.c.date_offered.label("offer_made_date"),
-        eh.c.date_accepted.label("accepted_date"),
+        eh.c.collectible_receive_id.label("traded_collectible_id"),
+        eh.c.collectible_send_id.label("accepted_collectible_id"),
         eh.c.trade_sender_id.label("trader_collector_id"),
-        eh.c.collectible_send_id.label("collectible_send_id")
-    ).select_from(join))
-
-    incoming_exchanges = rows_to_list(conn.execute(select_stmt).fetchall())
-
-    for exchange in incoming_exchanges:
-        # Find username and profile_img of trade sender
-        trade_s_id = exchange.get("trader_collector_id")
-        receiver_select_stmt = (db.select(
-            ctr.c.username.label("trader_username"),
-            ctr.c.profile_picture.label("trader_profile_img")
-        ).where(ctr.c.id == trade_s_id))
-        receiver_info = conn.execute(receiver_select_stmt).fetchone()._asdict()
-        exchange.update(receiver_info)
-
-        collectible_s_id = exchange.get("collectible_send_id")
-        collectible_select_stmt = (db.select(
-            cbl.c.id.label("accepted_collectible_id"),
-            cbl.c.name.label("accepted_collectible_name"),
-            cbl.c.image.label("accepted_collectible_img")
-        ).where(cbl.c.id == collectible_s_id))
-        collectible_info = conn.execute(collectible_select_stmt).fetchone()._asdict()
-        exchange.update(collectible_info)
-
-    all_exchanges = outgoing_exchanges + incoming_exchanges
-
-    return jsonify(all_exchanges), OK
+        eh.c.date_offered.label("date_offered"),
+        eh.c.date_accepted.label("date_accepted"),
+    ).where(eh.c.trade_receiver_id == user_id)
+
+    exchanges = db.union_all(sent_stmt, received_stmt).subquery("exchanges")
+
+    join = db.join(exchanges, traded_cbl,
+        (exchanges.c.traded_collectible_id == traded_cbl.c.id)).join(accepted_cbl,
+        (exchanges.c.accepted_collectible_id == accepted_cbl.c.id)).join(ctr,
+        (exchanges.c.trader_collector_id == ctr.c.id))
+
+    select_stmt = (db.select(
+        exchanges.c.exchange_id.label("exchange_id"),
+        traded_cbl.c.id.label("traded_collectible_id"),
+        traded_cbl.c.name.label("traded_collectible_name"),
+        traded_cbl.c.image.label("traded_collectible_img"),
+        accepted_cbl.c.id.label("accepted_collectible_id"),
+        accepted_cbl.c.name.label("accepted_collectible_name"),
+        accepted_cbl.c.image.label("accepted_collectible_img"),
+        ctr.c.id.label("trader_collector_id"),
+        ctr.c.username.label("trader_username"),
+        ctr.c.profile_picture.label("trader_profile_img"),
+        exchanges.c.date_offered.label("offer_made_date"),
+        exchanges.c.date_accepted.label("accepted_date"),
+    ).select_from(join).order_by(
+        exchanges.c.date_accepted.desc(), exchanges.c.exchange_id.desc()
+    ))
+
+    if limit is None:
+        all_exchanges = rows_to_list(conn.execute(select_stmt).fetchall())
+        conn.close()
+        return jsonify(all_exchanges), OK
+
+    # Continue on from the last exchange of the previous page
+    if cursor:
+        try:
+            cursor_date, cursor_id = decode_cursor(cursor)
+            cursor_date = datetime.strptime(cursor_date, "%Y-%m-%d").date()
+            cursor_id = int(cursor_id)
+        except (TypeError, ValueError):
+            conn.close()
+            return jsonify({"msg": "Invalid cursor!"}), InputError
+
+        select_stmt = select_stmt.where(
+            db.tuple_(exchanges.c.date_accepted, exchanges.c.exchange_id)
+            < db.tuple_(cursor_date, cursor_id)
+        )
+
+    # Fetch one extra row to find out if there is another page
+    rows = conn.execute(select_stmt.limit(limit + 1)).fetchall()
+    conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].accepted_date, rows[-1].exchange_id)
+
+    return jsonify({"exchanges": rows_to_list(rows), "next": next_cursor}), OK
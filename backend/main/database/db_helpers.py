@@ -1,9 +1,26 @@
+from datetime import date
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from functools import lru_cache
+import base64
+import json
+
+import main.database.db_manager as dbm
+
+# Encodes single JSON values the way flask's jsonify does
+_json_encoder = json.JSONEncoder(default=DefaultJSONProvider.default)
+
+# Most rows a paginated query returns in one page
+MAX_PAGE_SIZE = 100
+
+
 def rows_to_list(rows):
     """Takes in a list of tuples (that represent our rows), and returns them as a list of dictionaries
     
     NOTES:
         - If our row has a SQL date column, we will convert it into a normal
           string, which is the desired format for the frontend
+        - the conversion is compiled once per result shape, see row_serializer()
 
     Args:
         rows ([tuples]) / row (tuple): a list of tuples representing our rows
@@ -11,14 +28,228 @@ def rows_to_list(rows):
     Returns:
         [dictionary]: a list of dictionaries representing our rows
     """
-    result_list = []
+    if not rows:
+        return []
+
+    serialize = row_serializer(rows[0]._fields)
+    return [serialize(row) for row in rows]
+
+
+def rows_to_json(rows, fields):
+    """Writes rows out as a JSON array, one row at a time, without building
+    a dictionary for each row.
+
+    NOTES:
+        - keys come out sorted, which matches what jsonify produces
+        - rows can be any iterable, e.g. a streamed Result, so only one row
+          has to be held in memory at a time
+
+    Args:
+        rows (iterable of tuples): the rows to write out
+        fields (tuple of strings): names of the row's columns, e.g. Result.keys()
+
+    Returns:
+        generator of strings: pieces of the JSON array
+
+    Example Output:
+        '[', '{"date_added":"01/06/2023","id":501}', ',', '{"date_added":...}', ']'
+    """
+    encode = row_json_encoder(tuple(fields))
+
+    yield "["
+    first = True
     for row in rows:
-        new_dict = row._asdict()
+        if not first:
+            yield ","
+        first = False
+        yield encode(row)
+    yield "]"
 
-        # If key has "date" substring in it, convert it to string
-        for key, value in new_dict.items():
-            if ("date" in key) or (key == "post_created"):
-                new_dict[key] = value.strftime('%d/%m/%Y')
-        result_list.append(new_dict)
-    
-    return result_list
+
+def stream_list(select_stmt, key=None, chunk_size=1000):
+    """Returns a response that streams the rows of select_stmt as {key: [rows]},
+    or as a bare [rows] if no key is given.
+
+    NOTES:
+        - rows are read through a server-side cursor chunk_size at a time and
+          sent as they arrive, so memory stays flat however many rows there are
+        - the query only runs once the response starts being sent, on its own
+          connection inside a transaction, which server-side cursors need
+        - the status code is sent before the query runs, so an error part way
+          through cuts the JSON short instead of changing the status
+
+    Args:
+        select_stmt (Select): query whose rows make up the list
+        key (string): key of the list in the JSON object
+        chunk_size (int): number of rows fetched, and sent, at a time
+
+    Returns:
+        Response: streamed JSON response
+
+    Example Output:
+        {"collectors": [{"id": 1, ...}, {"id": 2, ...}]}
+    """
+
+    def generate():
+        with dbm.db_transaction() as conn:
+            result = conn.execute(select_stmt.execution_options(yield_per=chunk_size))
+
+            chunk = [] if key is None else ["{" + _json_encoder.encode(key) + ":"]
+            for piece in rows_to_json(result, result.keys()):
+                chunk.append(piece)
+                # Each row is a piece plus a separator
+                if len(chunk) >= 2 * chunk_size:
+                    yield "".join(chunk)
+                    chunk = []
+
+            if key is not None:
+                chunk.append("}")
+            yield "".join(chunk)
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+@lru_cache(maxsize=None)
+def row_serializer(fields):
+    """Builds the function converting rows with these columns into dictionaries.
+
+    Which columns hold dates is decided once here from the column names, rather
+    than by checking every key of every row.
+
+    Args:
+        fields (tuple of strings): names of the row's columns
+
+    Returns:
+        function: takes a row and returns it as a dictionary
+    """
+    date_indexes = date_columns(fields)
+
+    if not date_indexes:
+        return lambda row: dict(zip(fields, row))
+
+    def serialize(row):
+        values = list(row)
+        for i in date_indexes:
+            values[i] = format_date(values[i])
+        return dict(zip(fields, values))
+
+    return serialize
+
+
+@lru_cache(maxsize=None)
+def row_json_encoder(fields):
+    """Builds the function encoding rows with these columns as JSON objects.
+
+    Args:
+        fields (tuple of strings): names of the row's columns
+
+    Returns:
+        function: takes a row and returns it as a JSON object string
+    """
+    date_indexes = set(date_columns(fields))
+    encode = _json_encoder.encode
+
+    # (index of the column, its encoded key) in the order jsonify sorts keys
+    columns = [
+        (i, encode(key) + ":") for i, key in sorted(enumerate(fields), key=lambda c: c[1])
+    ]
+
+    def encode_row(row):
+        return "{" + ",".join(
+            key + encode(format_date(row[i]) if i in date_indexes else row[i])
+            for i, key in columns
+        ) + "}"
+
+    return encode_row
+
+
+def date_columns(fields):
+    """Returns the indexes of the columns holding dates, which are the ones
+    with "date" in their name, or post_created.
+
+    Args:
+        fields (tuple of strings): names of the row's columns
+
+    Returns:
+        tuple of ints: indexes of the date columns
+    """
+    return tuple(
+        i for i, key in enumerate(fields) if ("date" in key) or (key == "post_created")
+    )
+
+
+@lru_cache(maxsize=4096)
+def format_date(value):
+    """Formats a SQL date as "DD/MM/YYYY" for the frontend.
+
+    The same few dates repeat across a result (release dates, dates added),
+    so formatted dates are cached instead of calling strftime for every cell.
+
+    Args:
+        value (date): date to format
+
+    Returns:
+        string: the formatted date, or None for a NULL date
+    """
+    if value is None:
+        return None
+
+    return value.strftime("%d/%m/%Y")
+
+
+def parse_limit(limit, default=None):
+    """Checks the page size asked for by a paginated query.
+
+    NOTES:
+        - page sizes above MAX_PAGE_SIZE are lowered to it
+
+    Args:
+        limit (int): page size asked for, None if none was given
+        default (int): page size used when limit is None, None to not paginate
+
+    Returns:
+        int: the page size to use, or None to return every row
+
+    Raises:
+        ValueError: if limit is below 1
+    """
+    if limit is None:
+        limit = default
+        if limit is None:
+            return None
+
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(*values):
+    """Encodes the sort key of the last row in a page into an opaque cursor.
+
+    Args:
+        values: the values of the columns the page is ordered by
+
+    Returns:
+        string: url safe cursor to pass back in to fetch the next page
+    """
+    key = [value.isoformat() if isinstance(value, date) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor made by encode_cursor back into its sort key values.
+
+    NOTES:
+        - dates come back as "YYYY-MM-DD" strings
+
+    Args:
+        cursor (string): cursor given to the client with the previous page
+
+    Returns:
+        [values]: list of the sort key values, or None if cursor is invalid
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except (ValueError, TypeError, AttributeError):
+        return None
@@ -0,0 +1,235 @@
+import sqlalchemy as db
+
+from main.database import db_manager as dbm
+
+"""
+Preface:
+    - the hot queries below are shaped like the ones the db_* modules run on
+    every request, each paired with the index it is expected to use
+    - on a small database postgres prefers sequential scans no matter what,
+    so the plans are explained with sequential scans disabled, which shows
+    whether the index can serve the query rather than whether it currently
+    wins on cost
+"""
+
+
+def hot_queries():
+    """Returns the hot queries, and the index each of them should use.
+
+    Returns:
+        [(string, Select, string)]: list of (query name, statement, index name)
+    """
+    camp = dbm.campaign_table
+    feedback = dbm.campaign_feedback_table
+    cbl = dbm.collectible_table
+    ctn = dbm.collections_table
+    want = dbm.wantlist_table
+    tp = dbm.trade_posts_table
+    tp_imgs = dbm.trade_post_images_table
+    to = dbm.trade_offers_table
+    past_to = dbm.past_trade_offers_table
+    eh = dbm.exchange_history_table
+    priv = dbm.privelage_table
+    steps = dbm.trade_cycle_steps_table
+    daily = dbm.campaign_daily_exchanges_table
+    activity = dbm.collectible_daily_activity_table
+
+    return [
+        (
+            "manager campaigns",
+            db.select(camp.c.id).where(camp.c.manager_id == 1),
+            "ix_campaigns_manager_id",
+        ),
+        (
+            "approved campaigns",
+            db.select(camp).where(camp.c.approved == True),
+            "ix_campaigns_approved",
+        ),
+        (
+            "campaign feedback",
+            db.select(feedback).where(feedback.c.campaign_id == 1),
+            "ix_campaign_feedback_campaign_id",
+        ),
+        (
+            "campaign collectibles",
+            db.select(cbl).where(cbl.c.campaign_id == 1),
+            "ix_collectibles_campaign_id",
+        ),
+        (
+            "catalog search",
+            db.select(cbl.c.id).where(
+                dbm.collectible_search_document.bool_op("@@")(
+                    db.func.to_tsquery(db.literal("simple", db.String), "chimp:*")
+                )
+            ),
+            "ix_collectibles_search",
+        ),
+        (
+            "catalog by name",
+            db.select(cbl.c.id, cbl.c.name).order_by(cbl.c.name, cbl.c.id).limit(20),
+            "ix_collectibles_name_id",
+        ),
+        (
+            "collection",
+            db.select(ctn).where(ctn.c.collector_id == 1),
+            "ix_collections_collector_id_collectible_id",
+        ),
+        (
+            "collectible owners",
+            db.select(ctn).where(ctn.c.collectible_id == 1),
+            "ix_collections_collectible_id",
+        ),
+        (
+            "wantlist",
+            db.select(want).where(want.c.collector_id == 1),
+            "ix_wantlist_collector_id_collectible_id",
+        ),
+        (
+            "collectible wanters",
+            db.select(want).where(want.c.collectible_id == 1),
+            "ix_wantlist_collectible_id",
+        ),
+        (
+            "collector trade posts",
+            db.select(tp).where(tp.c.collector_id == 1),
+            "ix_trade_posts_collector_id_collection_id",
+        ),
+        (
+            "collection trade posts",
+            db.select(tp).where(tp.c.collection_id == 1),
+            "ix_trade_posts_collection_id",
+        ),
+        (
+            "trade post images",
+            db.select(tp_imgs).where(tp_imgs.c.trade_post_id == 1),
+            "ix_trade_post_images_trade_post_id",
+        ),
+        (
+            "trade post offers",
+            db.select(to).where(
+                (to.c.trade_post_id == 1) & (to.c.offer_status != "DECLINED")
+            ),
+            "ix_trade_offers_trade_post_id",
+        ),
+        (
+            "trade post offers received",
+            db.select(db.func.count(to.c.id)).where(
+                (to.c.trade_post_id == 1) & (to.c.offer_status == "SENT")
+            ),
+            "ix_trade_offers_trade_post_id_sent",
+        ),
+        (
+            "outgoing offers",
+            db.select(to).where(to.c.trade_sender_id == 1),
+            "ix_trade_offers_trade_sender_id_date_updated",
+        ),
+        (
+            "past outgoing offers",
+            db.select(past_to).where(past_to.c.trade_sender_id == 1),
+            "ix_past_trade_offers_trade_sender_id_date_updated",
+        ),
+        (
+            "exchanges sent",
+            db.select(eh).where(eh.c.trade_sender_id == 1),
+            "ix_exchange_history_trade_sender_id_date_accepted",
+        ),
+        (
+            "exchanges received",
+            db.select(eh).where(eh.c.trade_receiver_id == 1),
+            "ix_exchange_history_trade_receiver_id_date_accepted",
+        ),
+        (
+            "collectible exchanges sent",
+            db.select(eh).where(eh.c.collectible_send_id == 1),
+            "ix_exchange_history_collectible_send_id",
+        ),
+        (
+            "collectible exchanges received",
+            db.select(eh).where(eh.c.collectible_receive_id == 1),
+            "ix_exchange_history_collectible_receive_id",
+        ),
+        (
+            "campaign analytics",
+            db.select(daily).where(
+                (daily.c.campaign_id == 1) & (daily.c.day >= db.func.current_date())
+            ),
+            "campaign_daily_exchanges_pkey",
+        ),
+        (
+            "collectible activity",
+            db.select(activity).where(activity.c.collectible_id == 1),
+            "collectible_daily_activity_pkey",
+        ),
+        (
+            "collector trade cycles",
+            db.select(steps.c.cycle_id).where(steps.c.giver_id == 1),
+            "ix_trade_cycle_steps_giver_id",
+        ),
+        (
+            "managers",
+            db.select(priv).where(priv.c.privelage == 3),
+            "ix_privelages_privelage",
+        ),
+    ]
+
+
+def check_index_usage():
+    """Explains every hot query, and checks its plan uses the expected index.
+
+    Returns:
+        [dictionary]: one entry per hot query with the indexes its plan used
+
+    Example Output:
+        [
+            {
+                "query": "collection",
+                "expected_index": "ix_collections_collector_id_collectible_id",
+                "used_indexes": ["ix_collections_collector_id_collectible_id"],
+                "ok": True
+            },
+        ]
+    """
+    engine = dbm.get_engine()
+    results = []
+
+    with engine.connect() as conn:
+        conn.execute(db.text("SET enable_seqscan = off"))
+        try:
+            for name, stmt, index_name in hot_queries():
+                compiled = stmt.compile(
+                    dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+                )
+                plan = conn.execute(
+                    db.text(f"EXPLAIN (FORMAT JSON) {compiled}")
+                ).scalar()
+                used_indexes = sorted(find_plan_indexes(plan[0]["Plan"]))
+                results.append(
+                    {
+                        "query": name,
+                        "expected_index": index_name,
+                        "used_indexes": used_indexes,
+                        "ok": index_name in used_indexes,
+                    }
+                )
+        finally:
+            conn.execute(db.text("RESET enable_seqscan"))
+
+    return results
+
+
+def find_plan_indexes(plan):
+    """Finds the names of every index scanned within a query plan node.
+
+    Args:
+        plan (dictionary): node of an EXPLAIN (FORMAT JSON) plan
+
+    Returns:
+        {string}: set of index names
+    """
+    indexes = set()
+    if "Index Name" in plan:
+        indexes.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        indexes |= find_plan_indexes(child)
+
+    return indexes
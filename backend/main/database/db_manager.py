@@ -1,190 +1,543 @@
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context
+from threading import Lock
 import sqlalchemy as db
 import psycopg2
 import os
 
+from helpers import config
+from main.database import db_cache
+
 db_name = "collectibles_db"
 db_user = "postgres"
 db_password = os.environ["POSTGRES_PASSWORD"]
-db_host = "db"
+db_host = os.environ.get("POSTGRES_HOST", "db")
+
+# Engine used when there is no app context (e.g. scripts run outside Flask)
+_engine = None
+_engine_lock = Lock()
+
+
+""" |------------------------------------|
+    |          Database Schema           |
+    |------------------------------------| """
+
+# Shared schema registry, db_* modules use these tables instead of reflecting
+# them from the database on every call
+metadata = db.MetaData()
+
+# Table that stores all collectibles
+collector_table = db.Table(
+    "collectors",
+    metadata,  # Names cannot be uppercase
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("email", db.String, unique=True),
+    db.Column("username", db.String, unique=True),
+    db.Column("first_name", db.String),
+    db.Column("last_name", db.String),
+    db.Column("phone", db.VARCHAR(10)),
+    db.Column("password", db.String),
+    db.Column("address", db.String),
+    db.Column("profile_picture", db.String),
+    db.Column("twitter_handle", db.String),
+    db.Column("facebook_handle", db.String),
+    db.Column("instagram_handle", db.String),
+)
+
+# Table that stores all campaigns
+campaign_table = db.Table(
+    "campaigns",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("name", db.String, unique=True),
+    db.Column("image", db.String),
+    db.Column("description", db.String),
+    db.Column("manager_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("start_date", db.DATE),
+    db.Column("end_date", db.DATE),
+    db.Column("approved", db.Boolean),
+)
+
+# Table that stores all campaign feedback
+campaign_feedback_table = db.Table(
+    "campaign_feedback",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("campaign_id", db.Integer, db.ForeignKey("campaigns.id")),
+    db.Column("collector_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("feedback", db.String),
+    db.Column("feedback_date", db.DATE),
+)
+
+# Table that stores all collectibles
+collectible_table = db.Table(
+    "collectibles",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("name", db.String),
+    db.Column("description", db.String),
+    db.Column("image", db.String),
+    db.Column("campaign_id", db.Integer, db.ForeignKey("campaigns.id")),
+)
+
+# Table that stores what collectibles belong to what user's collection
+collections_table = db.Table(
+    "collections",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("collector_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("collectible_id", db.Integer, db.ForeignKey("collectibles.id")),
+    db.Column("date_added", db.DATE),
+)
+
+# Table that stores what collectibles a user wants
+wantlist_table = db.Table(
+    "wantlist",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("collector_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("collectible_id", db.Integer, db.ForeignKey("collectibles.id")),
+    db.Column("date_added", db.DATE),
+)
+
+# Table that lists all current trade posts
+trade_posts_table = db.Table(
+    "trade_posts",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("collector_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("collection_id", db.Integer, db.ForeignKey("collections.id")),
+    db.Column("post_title", db.String),
+    db.Column("post_description", db.String),
+    db.Column("post_date", db.DATE),
+    # Number of the post's offers that are still SENT, kept up to date by
+    # db_tradeoffers (see db_tradeposts.reconcile_offer_counts)
+    db.Column("offers_received", db.Integer, nullable=False, server_default="0"),
+)
+
+# Table that stores the images of the trade posts
+trade_post_images_table = db.Table(
+    "trade_post_images",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("trade_post_id", db.Integer, db.ForeignKey("trade_posts.id")),
+    db.Column("name", db.String),
+    db.Column("caption", db.String),
+    db.Column("image_url", db.String)
+)
+
+# Table that stores all sent trade offers
+trade_offers_table = db.Table(
+    "trade_offers",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("trade_post_id", db.Integer, db.ForeignKey("trade_posts.id")),
+    db.Column("trade_sender_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("collection_send_id", db.Integer, db.ForeignKey("collections.id")),
+    db.Column("offer_message", db.String),
+    db.Column("offer_image", db.String),
+    db.Column("offer_status", db.String),
+    db.Column("date_offered", db.DATE),
+    db.Column("date_updated", db.DATE),
+)
+
+# Table that stores all accepted/declined offers
+past_trade_offers_table = db.Table(
+    "past_trade_offers",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("trade_sender_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("collectible_send_id", db.Integer, db.ForeignKey("collectibles.id")),
+    db.Column("trade_receiver_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("collectible_receive_id", db.Integer, db.ForeignKey("collectibles.id")),
+    db.Column("offer_status", db.String),
+    db.Column("date_offered", db.DATE),
+    db.Column("date_updated", db.DATE),
+)
+
+# Table that stores all accepted trade interactions
+exchange_history_table = db.Table(
+    "exchange_history",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("trade_sender_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("collectible_send_id", db.Integer, db.ForeignKey("collectibles.id")),
+    db.Column("trade_receiver_id", db.Integer, db.ForeignKey("collectors.id")),
+    db.Column("collectible_receive_id", db.Integer, db.ForeignKey("collectibles.id")),
+    db.Column("date_offered", db.DATE),
+    db.Column("date_accepted", db.DATE),
+)
+
+# Table that stores how many exchanges the collectibles of each campaign were in
+# each day, kept up to date by add_exhange_history (see db_campaign_analytics)
+campaign_daily_exchanges_table = db.Table(
+    "campaign_daily_exchanges",
+    metadata,
+    db.Column("campaign_id", db.Integer, db.ForeignKey("campaigns.id"), primary_key=True),
+    db.Column("day", db.DATE, primary_key=True),
+    db.Column("sent_count", db.Integer, nullable=False, server_default="0"),
+    db.Column("received_count", db.Integer, nullable=False, server_default="0"),
+)
+
+# Table that stores, for each collectible and day, how many exchanges it was in
+# and how many of its wantlist and collection entries are dated that day, kept
+# up to date by the functions changing them (see db_campaign_analytics)
+collectible_daily_activity_table = db.Table(
+    "collectible_daily_activity",
+    metadata,
+    db.Column(
+        "collectible_id", db.Integer, db.ForeignKey("collectibles.id"), primary_key=True
+    ),
+    db.Column("day", db.DATE, primary_key=True),
+    db.Column("exchanges", db.Integer, nullable=False, server_default="0"),
+    db.Column("wanted", db.Integer, nullable=False, server_default="0"),
+    db.Column("collected", db.Integer, nullable=False, server_default="0"),
+)
+
+# Table that stores the trade cycles found by db_trade_cycles, in which every
+# collector gives a collectible to the one before them
+trade_cycles_table = db.Table(
+    "trade_cycles",
+    metadata,
+    db.Column("id", db.Integer, db.Identity(), primary_key=True),
+    db.Column("size", db.Integer, nullable=False),
+    db.Column("date_found", db.DATE),
+)
+
+# Table that stores the steps of each trade cycle, one for each collector in it
+trade_cycle_steps_table = db.Table(
+    "trade_cycle_steps",
+    metadata,
+    db.Column(
+        "cycle_id",
+        db.Integer,
+        db.ForeignKey("trade_cycles.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Column("position", db.Integer, primary_key=True),
+    # No foreign keys, as checking them made saving a run's cycles several
+    # times slower; steps are checked against collections and wantlist when read
+    db.Column("giver_id", db.Integer, nullable=False),
+    db.Column("receiver_id", db.Integer, nullable=False),
+    db.Column("collectible_id", db.Integer, nullable=False),
+)
+
+# Table that stores the privelages of a certain user
+privelage_table = db.Table(
+    "privelages",
+    metadata,
+    db.Column(
+        "collector_id", db.Integer, db.ForeignKey("collectors.id"), primary_key=True
+    ),
+    db.Column("privelage", db.Integer),
+    db.Column("code", db.Integer)
+)
+
+# Table that stores version counters of data that clients cache, bumped on every write
+data_versions_table = db.Table(
+    "data_versions",
+    metadata,
+    db.Column("name", db.String, primary_key=True),
+    db.Column("version", db.BigInteger, nullable=False),
+    db.Column("updated_at", db.DateTime(timezone=True), nullable=False),
+)
+
+# Table that stores which schema migrations have been applied (see db_migrations)
+schema_migrations_table = db.Table(
+    "schema_migrations",
+    metadata,
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("name", db.String, nullable=False),
+    db.Column(
+        "applied_at",
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=db.func.now(),
+    ),
+)
+
+# Secondary indexes, one for each filter or join column the db_* modules use
+# (db_indexes.check_index_usage verifies the hot queries can use them)
+
+# Campaigns of a manager (analytics) and the approved campaign list
+db.Index("ix_campaigns_manager_id", campaign_table.c.manager_id)
+db.Index(
+    "ix_campaigns_approved",
+    campaign_table.c.id,
+    postgresql_where=campaign_table.c.approved == True,
+)
+
+# Feedback of a campaign
+db.Index("ix_campaign_feedback_campaign_id", campaign_feedback_table.c.campaign_id)
+
+# Collectibles of a campaign
+db.Index("ix_collectibles_campaign_id", collectible_table.c.campaign_id)
+
+# Words of a collectible's name and description matched by the catalog search.
+# Queries have to use this exact expression for ix_collectibles_search to serve them
+collectible_search_document = db.func.to_tsvector(
+    db.literal("simple", db.String),
+    db.func.coalesce(collectible_table.c.name, "")
+    + " "
+    + db.func.coalesce(collectible_table.c.description, ""),
+)
+db.Index(
+    "ix_collectibles_search", collectible_search_document, postgresql_using="gin"
+)
+
+# Catalog search sorted by name
+db.Index("ix_collectibles_name_id", collectible_table.c.name, collectible_table.c.id)
+
+# A collector's collection, and the owners of a collectible
+db.Index(
+    "ix_collections_collector_id_collectible_id",
+    collections_table.c.collector_id,
+    collections_table.c.collectible_id,
+)
+db.Index("ix_collections_collectible_id", collections_table.c.collectible_id)
+
+# A collector's wantlist, and the collectors wanting a collectible
+db.Index(
+    "ix_wantlist_collector_id_collectible_id",
+    wantlist_table.c.collector_id,
+    wantlist_table.c.collectible_id,
+)
+db.Index("ix_wantlist_collectible_id", wantlist_table.c.collectible_id)
+
+# A collector's trade posts, and the trade posts of a collection entry
+db.Index(
+    "ix_trade_posts_collector_id_collection_id",
+    trade_posts_table.c.collector_id,
+    trade_posts_table.c.collection_id,
+)
+db.Index("ix_trade_posts_collection_id", trade_posts_table.c.collection_id)
+
+# Images of a trade post
+db.Index("ix_trade_post_images_trade_post_id", trade_post_images_table.c.trade_post_id)
+
+# Offers made on a trade post, the offers still waiting on a reply (counted
+# for every trade post listing), and the offers a collector has sent
+db.Index("ix_trade_offers_trade_post_id", trade_offers_table.c.trade_post_id)
+db.Index(
+    "ix_trade_offers_trade_post_id_sent",
+    trade_offers_table.c.trade_post_id,
+    postgresql_where=trade_offers_table.c.offer_status == "SENT",
+)
+db.Index(
+    "ix_trade_offers_trade_sender_id_date_updated",
+    trade_offers_table.c.trade_sender_id,
+    trade_offers_table.c.date_updated,
+)
+
+# Past offers a collector has sent
+db.Index(
+    "ix_past_trade_offers_trade_sender_id_date_updated",
+    past_trade_offers_table.c.trade_sender_id,
+    past_trade_offers_table.c.date_updated,
+)
+
+# Both sides of a collector's exchange history, newest first, and the
+# exchanges of a collectible (campaign analytics)
+db.Index(
+    "ix_exchange_history_trade_sender_id_date_accepted",
+    exchange_history_table.c.trade_sender_id,
+    exchange_history_table.c.date_accepted,
+)
+db.Index(
+    "ix_exchange_history_trade_receiver_id_date_accepted",
+    exchange_history_table.c.trade_receiver_id,
+    exchange_history_table.c.date_accepted,
+)
+db.Index(
+    "ix_exchange_history_collectible_send_id",
+    exchange_history_table.c.collectible_send_id,
+)
+db.Index(
+    "ix_exchange_history_collectible_receive_id",
+    exchange_history_table.c.collectible_receive_id,
+)
+
+# Trade cycles a collector is in (every collector gives in exactly one step)
+db.Index("ix_trade_cycle_steps_giver_id", trade_cycle_steps_table.c.giver_id)
+
+# Collectors with a certain privelage (e.g. the manager list)
+db.Index("ix_privelages_privelage", privelage_table.c.privelage)
+
+
+def init_app(app):
+    """Registers the pooled engine and the per-request connection teardown.
+
+    Args:
+        app (Flask): the flask app we want to attach the database to
+    """
+    app.extensions["db_engine"] = None
+    app.teardown_appcontext(close_request_connection)
+
+
+def create_database():
+    """Creates the database if it does not exist yet.
 
-# Function to setup our database
-def database_setup():
-    # Establish connection
+    Returns:
+        boolean: whether the database was created
+    """
     conn = psycopg2.connect(user=db_user, password=db_password, host=db_host)
     conn.autocommit = True
 
-    # Use cursor to create our database if it doesn't exist
     cursor = conn.cursor()
-    cursor.execute(f"DROP DATABASE IF EXISTS {db_name} WITH (FORCE)")
-    cursor.execute(f"CREATE DATABASE {db_name}")
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (db_name,))
+    created = cursor.fetchone() is None
+    if created:
+        try:
+            cursor.execute(f"CREATE DATABASE {db_name}")
+        except (psycopg2.errors.DuplicateDatabase, psycopg2.errors.UniqueViolation):
+            # Another worker created it first
+            created = False
     conn.close()
 
-    # Connect to the database
-    engine, conn, metadata = db_connect()
-
-    # Table that stores all collectibles
-    collector_table = db.Table(
-        "collectors",
-        metadata,  # Names cannot be uppercase
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("email", db.String, unique=True),
-        db.Column("username", db.String, unique=True),
-        db.Column("first_name", db.String),
-        db.Column("last_name", db.String),
-        db.Column("phone", db.VARCHAR(10)),
-        db.Column("password", db.String),
-        db.Column("address", db.String),
-        db.Column("profile_picture", db.String),
-        db.Column("twitter_handle", db.String),
-        db.Column("facebook_handle", db.String),
-        db.Column("instagram_handle", db.String),
-    )
-
-    # Table that stores all campaigns
-    campaign_table = db.Table(
-        "campaigns",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("name", db.String, unique=True),
-        db.Column("image", db.String),
-        db.Column("description", db.String),
-        db.Column("manager_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("start_date", db.DATE),
-        db.Column("end_date", db.DATE),
-        db.Column("approved", db.Boolean),
-    )
-
-    # Table that stores all campaign feedback
-    campaign_feedback_table = db.Table(
-        "campaign_feedback",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("campaign_id", db.Integer, db.ForeignKey("campaigns.id")),
-        db.Column("collector_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("feedback", db.String),
-        db.Column("feedback_date", db.DATE),
-    )
-
-    # Table that stores all collectibles
-    collectible_table = db.Table(
-        "collectibles",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("name", db.String),
-        db.Column("description", db.String),
-        db.Column("image", db.String),
-        db.Column("campaign_id", db.Integer, db.ForeignKey("campaigns.id")),
-    )
-
-    # Table that stores what collectibles belong to what user's collection
-    collections_table = db.Table(
-        "collections",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("collector_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("collectible_id", db.Integer, db.ForeignKey("collectibles.id")),
-        db.Column("date_added", db.DATE),
-    )
-
-    # Table that stores what collectibles a user wants
-    wantlist_table = db.Table(
-        "wantlist",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("collector_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("collectible_id", db.Integer, db.ForeignKey("collectibles.id")),
-        db.Column("date_added", db.DATE),
-    )
-
-    # Table that lists all current trade posts
-    trade_posts_table = db.Table(
-        "trade_posts",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("collector_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("collection_id", db.Integer, db.ForeignKey("collections.id")),
-        db.Column("post_title", db.String),
-        db.Column("post_description", db.String),
-        db.Column("post_date", db.DATE)
-    )
-
-    # Table that stores the images of the trade posts
-    trade_post_images_table = db.Table(
-        "trade_post_images",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("trade_post_id", db.Integer, db.ForeignKey("trade_posts.id")),
-        db.Column("name", db.String),
-        db.Column("caption", db.String),
-        db.Column("image_url", db.String)
-    )
-
-    # Table that stores all sent trade offers
-    trade_offers_table = db.Table(
-        "trade_offers",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("trade_post_id", db.Integer, db.ForeignKey("trade_posts.id")),
-        db.Column("trade_sender_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("collection_send_id", db.Integer, db.ForeignKey("collections.id")),
-        db.Column("offer_message", db.String),
-        db.Column("offer_image", db.String),
-        db.Column("offer_status", db.String),
-        db.Column("date_offered", db.DATE),
-        db.Column("date_updated", db.DATE),
-    )
-
-    # Table that stores all accepted/declined offers
-    past_trade_offers_table = db.Table(
-        "past_trade_offers",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("trade_sender_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("collectible_send_id", db.Integer, db.ForeignKey("collectibles.id")),
-        db.Column("trade_receiver_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("collectible_receive_id", db.Integer, db.ForeignKey("collectibles.id")),
-        db.Column("offer_status", db.String),
-        db.Column("date_offered", db.DATE),
-        db.Column("date_updated", db.DATE),
-    )
-
-    # Table that stores all accepted trade interactions
-    exchange_history_table = db.Table(
-        "exchange_history",
-        metadata,
-        db.Column("id", db.Integer, db.Identity(), primary_key=True),
-        db.Column("trade_sender_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("collectible_send_id", db.Integer, db.ForeignKey("collectibles.id")),
-        db.Column("trade_receiver_id", db.Integer, db.ForeignKey("collectors.id")),
-        db.Column("collectible_receive_id", db.Integer, db.ForeignKey("collectibles.id")),
-        db.Column("date_offered", db.DATE),
-        db.Column("date_accepted", db.DATE),
-    )
-
-    # Table that stores the privelages of a certain user
-    privelage_table = db.Table(
-        "privelages",
-        metadata,
-        db.Column(
-            "collector_id", db.Integer, db.ForeignKey("collectors.id"), primary_key=True
-        ),
-        db.Column("privelage", db.Integer),
-        db.Column("code", db.Integer)
-    )
-
-    # Creates all tables stored within metadata
-    metadata.create_all(engine)
+    return created
+
+
+def drop_database():
+    """Drops the database, deleting all of its data."""
+    # Pooled connections point at the database we are about to drop
+    dispose_engine()
+    # Cached rows belong to the database we are about to drop
+    db_cache.clear_all()
+
+    conn = psycopg2.connect(user=db_user, password=db_password, host=db_host)
+    conn.autocommit = True
+
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {db_name} WITH (FORCE)")
     conn.close()
 
 
 def db_connect():
     """Function to connect to the db and return [engine, conn, metadata].
+
+    Notes:
+        - metadata is the shared schema registry holding every table
+        - within an app context every call shares one pooled connection, which
+          is returned to the pool when the request is torn down, so calling
+          close() on it is a no-op
+        - outside of an app context a connection is checked out of the pool
+          and returned when the caller closes it
     """
-    # Create an engine and connect to the db
-    engine = db.create_engine(
-        f"postgresql://{db_user}:{db_password}@{db_host}/{db_name}"
-    ).execution_options(isolation_level="AUTOCOMMIT")
-    conn = engine.connect()
-    metadata = db.MetaData()
+    engine = get_engine()
+
+    if has_app_context():
+        if "db_conn" not in g:
+            g.db_conn = engine.connect()
+        conn = RequestConnection(g.db_conn)
+    else:
+        conn = engine.connect()
 
     return engine, conn, metadata
+
+
+@contextmanager
+def db_transaction():
+    """Yields a connection whose statements all run in a single transaction.
+
+    Notes:
+        - the transaction commits when the block exits and is rolled back if
+          the block raises
+        - the connection is checked out separately from the one shared by
+          db_connect(), so its statements are not autocommitted
+
+    Example:
+        with dbm.db_transaction() as conn:
+            conn.execute(...)
+            conn.execute(...)
+    """
+    with get_engine().connect() as conn:
+        # The isolation level is reset to autocommit when the pool takes it back
+        conn.execution_options(isolation_level="READ COMMITTED")
+        with conn.begin():
+            yield conn
+
+
+def get_engine():
+    """Returns the process-wide pooled engine, creating it on first use."""
+    global _engine
+
+    if has_app_context():
+        engine = current_app.extensions.get("db_engine")
+        if engine is None:
+            with _engine_lock:
+                engine = current_app.extensions.get("db_engine")
+                if engine is None:
+                    engine = create_db_engine(current_app.config)
+                    current_app.extensions["db_engine"] = engine
+        return engine
+
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_db_engine(vars(config.BaseConfig))
+        return _engine
+
+
+def create_db_engine(app_config):
+    """Creates an engine backed by a QueuePool configured from app_config.
+
+    Args:
+        app_config (dictionary): config holding the DB_POOL_* settings
+
+    Returns:
+        Engine: engine that runs statements in autocommit mode
+    """
+    return db.create_engine(
+        f"postgresql://{db_user}:{db_password}@{db_host}/{db_name}",
+        poolclass=db.QueuePool,
+        pool_size=app_config.get("DB_POOL_SIZE", 5),
+        max_overflow=app_config.get("DB_MAX_OVERFLOW", 10),
+        pool_timeout=app_config.get("DB_POOL_TIMEOUT", 30),
+        pool_recycle=app_config.get("DB_POOL_RECYCLE", 1800),
+        pool_pre_ping=app_config.get("DB_POOL_PRE_PING", True),
+    ).execution_options(isolation_level="AUTOCOMMIT")
+
+
+def dispose_engine(close=True):
+    """Empties the pool, e.g. after a fork or a database reset.
+
+    Args:
+        close (boolean): whether to close the pooled connections. In a forked
+                         worker the connections are still the parent's, so they
+                         are dropped without being closed.
+    """
+    close_request_connection()
+
+    if has_app_context():
+        engine = current_app.extensions.get("db_engine")
+    else:
+        engine = _engine
+
+    if engine is not None:
+        engine.dispose(close=close)
+
+
+def close_request_connection(exception=None):
+    """Returns the connection shared by the current request to the pool."""
+    if not has_app_context():
+        return
+
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        conn.close()
+
+
+class RequestConnection:
+    """Connection shared by every db_connect() call within one request.
+
+    Forwards everything to the pooled connection, except close(), which is
+    left to the request teardown.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        pass
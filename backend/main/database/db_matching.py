@@ -0,0 +1,385 @@
+from threading import Lock
+from flask import jsonify
+import sqlalchemy as db
+import time
+
+from main.error import OK
+from main.database import db_cache, db_manager as dbm
+
+"""
+Preface:
+    - finds trade partners for a collector: collectors who have collectibles in
+    their wantlist, and want collectibles in their collection
+    - every worker keeps an index of who owns and who wants each collectible in
+    memory, so a search only touches the collectors sharing a collectible with
+    the user instead of scanning the collections and wantlist tables
+    - the index is built from the database on the first search, and kept up to
+    date by update_holding(), which the functions changing collections and
+    wantlists call after every change
+    - update_holding() broadcasts which collector and collectible changed to
+    every worker (see db_cache.broadcast), and each worker reads their current
+    state from the database itself, one change at a time; messages can arrive
+    in any order or twice, as the last one read always sees the last change
+    - messages only reach other workers through the redis cache backend; with
+    the default in-memory backend each worker only hears its own changes, and
+    relies on the index being rebuilt every REBUILD_INTERVAL seconds
+    - rebuild() makes every worker build its index again on its next search,
+    e.g. after data is loaded outside of these functions
+"""
+
+# Name the index's changes are broadcast to
+BROADCAST_NAME = "matching"
+
+# Broadcast by rebuild(), every other message is a change to one collector
+REBUILD_MESSAGE = "*"
+
+# Rows read from the database at a time when building the index
+BUILD_BATCH_SIZE = 10000
+
+# Most partners a search returns
+MAX_MATCHES = 100
+
+# Seconds after which a worker builds its index again, which also catches
+# up on changes broadcast while it could not hear them
+REBUILD_INTERVAL = 15 * 60
+
+
+class MatchIndex:
+    """Who owns and who wants each collectible, and what each collector owns
+    and wants.
+
+    Not thread safe, see get_index() and handle_change() for the locking.
+    """
+
+    def __init__(self):
+        # Collectible id -> ids of the collectors that own / want it
+        self.owners = {}
+        self.wanters = {}
+        # Collector id -> ids of the collectibles they own / want
+        self.owned = {}
+        self.wanted = {}
+
+    def set_owned(self, collector_id, collectible_id, owned):
+        set_pair(self.owners, self.owned, collectible_id, collector_id, owned)
+
+    def set_wanted(self, collector_id, collectible_id, wanted):
+        set_pair(self.wanters, self.wanted, collectible_id, collector_id, wanted)
+
+    def matches(self, collector_id, limit):
+        """Returns the best trade partners of a collector.
+
+        Args:
+            collector_id (int): id of the collector looking for partners
+            limit (int): max number of partners returned
+
+        Returns:
+            [(int, set, set)]: partner's id, ids of the collectibles they have
+                               that the collector wants, and of the ones they
+                               want that the collector has, best first
+        """
+        wants = self.wanted.get(collector_id)
+        owns = self.owned.get(collector_id)
+        if not wants or not owns:
+            return []
+
+        # Candidates come from whichever side has fewer of them, as every
+        # partner must be on both sides
+        have_count = sum(len(self.owners.get(c, ())) for c in wants)
+        want_count = sum(len(self.wanters.get(c, ())) for c in owns)
+        if have_count <= want_count:
+            candidates = set().union(*(self.owners.get(c, ()) for c in wants))
+        else:
+            candidates = set().union(*(self.wanters.get(c, ()) for c in owns))
+        candidates.discard(collector_id)
+
+        results = []
+        for partner in candidates:
+            they_have = wants & self.owned.get(partner, set())
+            if not they_have:
+                continue
+
+            they_want = owns & self.wanted.get(partner, set())
+            if they_want:
+                results.append((partner, they_have, they_want))
+
+        # Most possible one for one trades first, then most collectibles in common
+        results.sort(key=lambda r: (-trade_score(r[1], r[2]), -len(r[1]) - len(r[2]), r[0]))
+        return results[:limit]
+
+
+def set_pair(by_collectible, by_collector, collectible_id, collector_id, present):
+    """Adds or removes a collector and collectible in a pair of indexes."""
+    if present:
+        by_collectible.setdefault(collectible_id, set()).add(collector_id)
+        by_collector.setdefault(collector_id, set()).add(collectible_id)
+        return
+
+    for index, key, value in (
+        (by_collectible, collectible_id, collector_id),
+        (by_collector, collector_id, collectible_id),
+    ):
+        values = index.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del index[key]
+
+
+def trade_score(they_have, they_want):
+    """Returns the number of one for one trades possible with a partner."""
+    return min(len(they_have), len(they_want))
+
+
+""" |------------------------------------|
+    |     Functions for the index        |
+    |------------------------------------| """
+
+# This worker's index, None until the first search builds it
+_index = None
+_stale = False
+_built_at = 0
+# Changes heard while the index is being built, None when it is not
+_pending = None
+# Held while reading or changing the index, and while building it
+_lock = Lock()
+_build_lock = Lock()
+# Held while reading and applying a change, so changes are applied in the
+# order their states were read in
+_change_lock = Lock()
+
+
+def get_index():
+    """Returns this worker's index, building it first if needed.
+
+    Notes:
+        - changes heard while the index is being built are kept and read again
+          once it is, as the build may have read the rows before they changed
+        - an index older than REBUILD_INTERVAL is rebuilt by one search, while
+          the others keep using it
+    """
+    global _index, _stale, _pending, _built_at
+
+    current = _index is not None and not _stale
+    if current and time.monotonic() - _built_at < REBUILD_INTERVAL:
+        return _index
+
+    if not _build_lock.acquire(blocking=not current):
+        return _index
+
+    try:
+        if _index is not None and not _stale and time.monotonic() - _built_at < REBUILD_INTERVAL:
+            return _index
+
+        with _lock:
+            _stale = False
+            _pending = set()
+
+        built_at = time.monotonic()
+        index = build_index()
+
+        with _change_lock:
+            with _lock:
+                pending, _pending = _pending, None
+            holdings = read_holdings(pending)
+            with _lock:
+                for (collector_id, collectible_id), (owned, wanted) in holdings.items():
+                    index.set_owned(collector_id, collectible_id, owned)
+                    index.set_wanted(collector_id, collectible_id, wanted)
+                _index = index
+                _built_at = built_at
+    finally:
+        _build_lock.release()
+
+    return _index
+
+
+def build_index():
+    """Reads every collection and wantlist entry into a new MatchIndex."""
+    index = MatchIndex()
+    ctn = dbm.collections_table
+    want = dbm.wantlist_table
+
+    with dbm.db_transaction() as conn:
+        owned_stmt = db.select(ctn.c.collector_id, ctn.c.collectible_id)
+        for collector_id, collectible_id in conn.execute(
+            owned_stmt.execution_options(yield_per=BUILD_BATCH_SIZE)
+        ):
+            index.set_owned(collector_id, collectible_id, True)
+
+        wanted_stmt = db.select(want.c.collector_id, want.c.collectible_id)
+        for collector_id, collectible_id in conn.execute(
+            wanted_stmt.execution_options(yield_per=BUILD_BATCH_SIZE)
+        ):
+            index.set_wanted(collector_id, collectible_id, True)
+
+    return index
+
+
+def read_holdings(pairs):
+    """Reads whether collectors own and want collectibles.
+
+    Args:
+        pairs ({(int, int)}): (collector id, collectible id) pairs to read
+
+    Returns:
+        dictionary: (collector id, collectible id) -> (owned, wanted) booleans
+    """
+    if not pairs:
+        return {}
+
+    ctn = dbm.collections_table
+    want = dbm.wantlist_table
+
+    engine, conn, metadata = dbm.db_connect()
+    owned = set(conn.execute(
+        db.select(ctn.c.collector_id, ctn.c.collectible_id).where(
+            db.tuple_(ctn.c.collector_id, ctn.c.collectible_id).in_(list(pairs)))
+    ).tuples())
+    wanted = set(conn.execute(
+        db.select(want.c.collector_id, want.c.collectible_id).where(
+            db.tuple_(want.c.collector_id, want.c.collectible_id).in_(list(pairs)))
+    ).tuples())
+    conn.close()
+
+    return {pair: (pair in owned, pair in wanted) for pair in pairs}
+
+
+def handle_change(message):
+    """Handles a message broadcast to BROADCAST_NAME, see db_cache.subscribe.
+
+    Args:
+        message (string): "<collector_id> <collectible_id>", REBUILD_MESSAGE,
+                          or None if messages were lost
+    """
+    global _stale
+
+    if message is None or message == REBUILD_MESSAGE:
+        with _lock:
+            _stale = True
+        return
+
+    pair = tuple(int(v) for v in message.split())
+
+    with _change_lock:
+        with _lock:
+            if _pending is not None:
+                _pending.add(pair)
+            if _index is None:
+                return
+
+        try:
+            owned, wanted = read_holdings({pair})[pair]
+        except db.exc.SQLAlchemyError:
+            # The index can no longer be trusted without this change
+            with _lock:
+                _stale = True
+            return
+
+        with _lock:
+            _index.set_owned(*pair, owned)
+            _index.set_wanted(*pair, wanted)
+
+
+db_cache.subscribe(BROADCAST_NAME, handle_change)
+
+
+def update_holding(collector_id, collectible_id):
+    """Updates every worker's index after a collector's collection or
+    wantlist changed.
+
+    Notes:
+        - call it after the change is committed, with every collectible whose
+          entries the collector gained or lost
+
+    Args:
+        collector_id (int): id of the collector whose entries changed
+        collectible_id (int): id of the collectible the entries are for
+    """
+    db_cache.broadcast(BROADCAST_NAME, f"{collector_id} {collectible_id}")
+
+
+def rebuild():
+    """Makes every worker rebuild its index on its next search."""
+    db_cache.broadcast(BROADCAST_NAME, REBUILD_MESSAGE)
+
+
+""" |------------------------------------|
+    |      Functions for matching        |
+    |------------------------------------| """
+
+
+def find_matches(user_id, limit=20):
+    """Finds the collectors the user could trade with, where both sides get
+    something off their wantlist.
+
+    Args:
+        user_id (int): id of the collector looking for trades
+        limit (int): max number of partners returned, at most MAX_MATCHES
+
+    Returns:
+        JSON, int: JSON holds the partners, best first, int is the error code
+
+    Example Output:
+        {
+            "matches": [
+                {
+                    "collector_id": 3,
+                    "username": "lanny",
+                    "profile_img": "https://...",
+                    "score": 1,
+                    "they_have": [{"collectible_id": 5, "name": "...", "image": "..."}],
+                    "they_want": [{"collectible_id": 8, "name": "...", "image": "..."}],
+                },
+                ...
+            ]
+        }, 200
+    """
+    limit = max(1, min(limit, MAX_MATCHES))
+
+    index = get_index()
+    with _lock:
+        results = index.matches(user_id, limit)
+
+    if not results:
+        return jsonify({"matches": []}), OK
+
+    collectors = dbm.collector_table
+    collectibles = dbm.collectible_table
+    partner_ids = [partner for partner, _, _ in results]
+    collectible_ids = set().union(*(have | want for _, have, want in results))
+
+    engine, conn, metadata = dbm.db_connect()
+    profiles = {
+        row.id: row
+        for row in conn.execute(
+            db.select(collectors.c.id, collectors.c.username, collectors.c.profile_picture)
+            .where(collectors.c.id.in_(partner_ids))
+        )
+    }
+    items = {
+        row.id: {"collectible_id": row.id, "name": row.name, "image": row.image}
+        for row in conn.execute(
+            db.select(collectibles.c.id, collectibles.c.name, collectibles.c.image)
+            .where(collectibles.c.id.in_(collectible_ids))
+        )
+    }
+    conn.close()
+
+    matches = []
+    for partner, they_have, they_want in results:
+        profile = profiles.get(partner)
+        if profile is None:
+            continue
+
+        matches.append(
+            {
+                "collector_id": partner,
+                "username": profile.username,
+                "profile_img": profile.profile_picture,
+                "score": trade_score(they_have, they_want),
+                "they_have": [items[c] for c in sorted(they_have) if c in items],
+                "they_want": [items[c] for c in sorted(they_want) if c in items],
+            }
+        )
+
+    return jsonify({"matches": matches}), OK
@@ -0,0 +1,205 @@
+from flask import current_app
+import sqlalchemy as db
+
+from main.database import (
+    db_campaign_analytics,
+    db_manager as dbm,
+    db_matching,
+    db_tradeposts,
+)
+
+"""
+Preface:
+    - the schema is built up by the numbered migrations in MIGRATIONS, and the
+    schema_migrations table records which ones have been applied
+    - upgrade() runs on every start: when the schema is current it only reads
+    the schema version and returns, otherwise it applies the pending migrations
+    in one transaction, holding a lock so that workers starting together do
+    not apply them twice
+    - to change the schema, change the tables in db_manager and add a
+    migration making the same change, e.g.
+
+        @migration(3, "add the trade post offer counter")
+        def add_offers_received(conn):
+            conn.execute(db.text(
+                "ALTER TABLE trade_posts ADD COLUMN IF NOT EXISTS offers_received ..."
+            ))
+
+    - migrations must be safe to run on a database that already has their
+    change, as a new database gets every table from migration 1
+    - reset() is the only thing that deletes data, see the reset-db command
+"""
+
+# Migrations in the order they are applied, see migration()
+MIGRATIONS = []
+
+# Key of the postgres advisory lock held while migrating
+MIGRATION_LOCK = 390011
+
+
+def migration(version, name):
+    """Decorator registering a function as the migration to version.
+
+    Args:
+        version (int): schema version after the migration, one more than the last
+        name (string): what the migration does
+
+    Example:
+        @migration(3, "add the trade post offer counter")
+        def add_offers_received(conn):
+            ...
+    """
+
+    def wrapper(fn):
+        expected = len(MIGRATIONS) + 1
+        if version != expected:
+            raise ValueError(f"Migration {name!r} should be version {expected}")
+
+        MIGRATIONS.append((version, name, fn))
+        return fn
+
+    return wrapper
+
+
+""" |------------------------------------|
+    |             Migrations             |
+    |------------------------------------| """
+
+
+@migration(1, "create the initial schema")
+def create_schema(conn):
+    # Tables that already exist (e.g. from before migrations were tracked) are kept
+    dbm.metadata.create_all(conn, checkfirst=True)
+
+
+@migration(2, "add the trade cycle tables")
+def create_trade_cycles(conn):
+    for table in (dbm.trade_cycles_table, dbm.trade_cycle_steps_table):
+        table.create(conn, checkfirst=True)
+
+
+@migration(3, "add the trade post offer counter")
+def add_offers_received(conn):
+    conn.execute(db.text(
+        "ALTER TABLE trade_posts "
+        "ADD COLUMN IF NOT EXISTS offers_received INTEGER NOT NULL DEFAULT 0"
+    ))
+    # Counts the offers made before the counter existed
+    db_tradeposts.reconcile_offer_counts(conn)
+
+
+@migration(4, "add the campaign analytics rollups")
+def create_campaign_daily_exchanges(conn):
+    dbm.campaign_daily_exchanges_table.create(conn, checkfirst=True)
+    # Counts the exchanges made before the rollups existed
+    db_campaign_analytics.rebuild_campaign_exchanges(conn)
+
+
+@migration(5, "add the collectible activity rollups")
+def create_collectible_daily_activity(conn):
+    dbm.collectible_daily_activity_table.create(conn, checkfirst=True)
+    # Counts the exchanges and entries made before the rollups existed
+    db_campaign_analytics.rebuild_collectible_activity(conn)
+
+
+@migration(6, "add the indexes missing from tables made before migrations")
+def create_missing_indexes(conn):
+    # Migration 1 keeps tables that already existed, and the indexes declared
+    # on them since were never made
+    for table in dbm.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            index.create(conn, checkfirst=True)
+
+
+""" |------------------------------------|
+    |      Functions for migrations      |
+    |------------------------------------| """
+
+
+def upgrade():
+    """Brings the database up to the latest schema version, creating it first
+    if it does not exist.
+
+    Returns:
+        [int]: versions of the migrations that were applied
+    """
+    try:
+        version = get_schema_version()
+    except db.exc.OperationalError:
+        # The database itself is missing, e.g. on the first start
+        dbm.dispose_engine()
+        dbm.create_database()
+        version = get_schema_version()
+
+    if version >= latest_version():
+        return []
+
+    applied = []
+    with dbm.db_transaction() as conn:
+        conn.execute(db.select(db.func.pg_advisory_xact_lock(MIGRATION_LOCK)))
+
+        # Another worker may have migrated while we waited for the lock
+        version = get_schema_version(conn)
+
+        for migration_version, name, fn in MIGRATIONS:
+            if migration_version <= version:
+                continue
+
+            fn(conn)
+            conn.execute(
+                db.insert(dbm.schema_migrations_table).values(
+                    version=migration_version, name=name
+                )
+            )
+            applied.append(migration_version)
+            current_app.logger.info(f"Applied migration {migration_version}: {name}")
+
+    return applied
+
+
+def reset():
+    """Deletes the database and rebuilds it at the latest schema version.
+
+    Returns:
+        [int]: versions of the migrations that were applied
+    """
+    dbm.drop_database()
+    applied = upgrade()
+    db_matching.rebuild()
+
+    return applied
+
+
+def get_schema_version(conn=None):
+    """Returns the version of the database's schema.
+
+    Args:
+        conn (Connection): connection to read it with, db_connect()'s if None
+
+    Returns:
+        int: version of the last migration applied, 0 if none have been
+    """
+    close = conn is None
+    if conn is None:
+        engine, conn, metadata = dbm.db_connect()
+
+    migrations = dbm.schema_migrations_table
+
+    version = 0
+    exists = conn.execute(
+        db.select(db.func.to_regclass(migrations.name).is_not(None))
+    ).scalar_one()
+    if exists:
+        version = conn.execute(
+            db.select(db.func.coalesce(db.func.max(migrations.c.version), 0))
+        ).scalar_one()
+
+    if close:
+        conn.close()
+
+    return version
+
+
+def latest_version():
+    """Returns the version the last migration brings the schema to."""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
@@ -1,7 +1,7 @@
 from datetime import datetime
 import sqlalchemy as db
 
-import db_helpers, db_tradeoffers, db_collections
+import db_helpers, db_tradeoffers, db_collections, db_manager as dbm
 
 
 def find_past_outgoing_offers(user_id, engine, conn, metadata):
@@ -19,68 +19,58 @@ def find_past_outgoing_offers(user_id, engine, conn, metadata):
     Example Output:
         [
             {
+                "collectible_r_id": 2,
                 "collectible_r_img": "https://robohash.org/similiquenemoaut.png?size=50x50&set=set1",
                 "collectible_r_name": "Iguana iguana",
-                "collectible_receive_id": 2,
                 "collectible_s_id": 3
                 "collectible_s_img": "https://robohash.org/voluptatemetipsum.png?size=50x50&set=set1",
                 "collectible_s_name": "Phascogale calura",
                 "date_offer_sent": "13/11/2023",
                 "date_updated": "20/11/2023",
                 "offer_status": "DECLINED",
-                "trade_receiver_id": 1,
+                "trader_collector_id": 1,
                 "trader_name": "uso",
                 "trader_profile_img": "https://robohash.org/utomniseos.png?size=50x50&set=set1"
             },
         ]
     """
-    # Loads in the past_trade_offers, collectors and collectibles table
-    past_to = db.Table("past_trade_offers", metadata, autoload_with=engine)
-    ctr = db.Table("collectors", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-
-    # First we find past posts where user has sent offers
-    join = db.join(past_to, cbl,
-        (past_to.c.trade_sender_id == user_id) & 
-        (past_to.c.collectible_send_id == cbl.c.id)).join(ctr,
-        (past_to.c.trade_receiver_id == ctr.c.id))
-
-    select_stmt = (db.select(
-        cbl.c.id.label("collectible_s_id"),
-        cbl.c.name.label("collectible_s_name"),
-        cbl.c.image.label("collectible_s_img"),
-        past_to.c.offer_status.label("offer_status"),
-        past_to.c.date_offered.label("date_offer_sent"),
-        past_to.c.date_updated.label("date_updated"),
-        past_to.c.trade_receiver_id.label("trade_receiver_id"),
-        past_to.c.collectible_receive_id.label("collectible_receive_id"),
-    ).select_from(join))
+    offers = past_outgoing_offers_stmt(user_id).subquery("offers")
+    select_stmt = db_tradeoffers.offer_details_stmt(offers)
 
     offers = db_helpers.rows_to_list(conn.execute(select_stmt).fetchall())
-    
     for offer in offers:
-        trade_receiver_id = offer.get("trade_receiver_id")
-        collectible_receive_id = offer.get("collectible_receive_id")
-        
-        trader_select_stmt = (db.select(
-            ctr.c.id.label("trader_collector_id"),
-            ctr.c.username.label("trader_name"),
-            ctr.c.profile_picture.label("trader_profile_img")
-        )).where(ctr.c.id == trade_receiver_id)
-        trader_info = conn.execute(trader_select_stmt).fetchone()._asdict()
-        offer.update(trader_info)
-
-        collectible_select_stmt = (db.select(
-            cbl.c.id.label("collectible_r_id"),
-            cbl.c.name.label("collectible_r_name"),
-            cbl.c.image.label("collectible_r_img")
-        )).where(cbl.c.id == collectible_receive_id)
-        collectible_info = conn.execute(collectible_select_stmt).fetchone()._asdict()
-        offer.update(collectible_info)
-    
+        offer.pop("offer_id")
+        offer.pop("is_past")
+
     return offers
 
 
+def past_outgoing_offers_stmt(user_id):
+    """Select statement for the past offers that a user has sent
+
+    Notes:
+        - has the same columns as db_tradeoffers.outgoing_offers_stmt
+
+    Args:
+        user_id (int): id of the collector that sent the offers
+
+    Returns:
+        Select: select statement of the user's past outgoing offers
+    """
+    past_to = dbm.past_trade_offers_table
+
+    return db.select(
+        past_to.c.id.label("offer_id"),
+        db.literal(1).label("is_past"),
+        past_to.c.collectible_send_id.label("collectible_send_id"),
+        past_to.c.collectible_receive_id.label("collectible_receive_id"),
+        past_to.c.trade_receiver_id.label("trade_receiver_id"),
+        past_to.c.offer_status.label("offer_status"),
+        past_to.c.date_offered.label("date_offered"),
+        past_to.c.date_updated.label("date_updated"),
+    ).where(past_to.c.trade_sender_id == user_id)
+
+
 def move_to_past(offer_id, engine, conn, metadata):
     """Moves an offer from the trade_offers table to the past_trade_offers table
 
@@ -95,8 +85,8 @@ def move_to_past(offer_id, engine, conn, metadata):
         {"msg": "Offer 2 has been move from trade_offers to past_trade_offers!"}
     """
     # Loads in the trade_offers and past_trade_offers table
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
-    past_to = db.Table("past_trade_offers", metadata, autoload_with=engine)
+    to = dbm.trade_offers_table
+    past_to = dbm.past_trade_offers_table
 
     # Find trade_post and trade_offer information
     tp_to_info = db_tradeoffers.to_tp_info(offer_id, engine, conn, metadata)
@@ -0,0 +1,418 @@
+from datetime import date
+from flask import jsonify
+import multiprocessing
+import os
+import time
+import sqlalchemy as db
+from sqlalchemy.dialects import postgresql
+
+from main.error import OK
+from main.database import db_helpers, db_manager as dbm, db_matching
+
+"""
+Preface:
+    - finds trades between three or more collectors, where each collector gets
+    a collectible on their wantlist from the next one, e.g.
+        flask --app server find-trade-cycles --max-length 5
+    - collectors are the nodes of a graph, with an edge from A to B when B owns
+    something on A's wantlist, and every cycle in it is a possible trade
+    - the graph is db_matching's index, built fresh from the database, and is
+    searched from every collector in parallel on a pool of processes, each
+    taking a share of the collectors to start from
+    - each search is bounded: it stops after CYCLES_PER_COLLECTOR cycles or
+    SEARCH_BUDGET steps, and only steps to collectors that can still get back
+    to the start in the steps left (see CycleSearch)
+    - every run replaces the cycles found by the last one, and
+    get_trade_cycles() only returns cycles that can still go ahead
+"""
+
+# Fewest and most collectors in a cycle, two collectors are a db_matching match
+MIN_CYCLE_LENGTH = 3
+MAX_CYCLE_LENGTH = 5
+
+# Most cycles found starting from each collector
+CYCLES_PER_COLLECTOR = 3
+
+# Most collectors looked at by the search from each collector
+SEARCH_BUDGET = 10000
+
+# Largest set of collectors the search prunes with, as working out larger
+# ones costs more than the pruning saves
+REACH_LIMIT = 500
+
+# Collectors each process is given at a time
+PARTITION_SIZE = 500
+
+# Cycles inserted at a time
+INSERT_BATCH_SIZE = 10000
+
+
+class CycleSearch:
+    """Depth first search for the cycles through one collector.
+
+    Notes:
+        - reach[k] holds the collectors with a path of k edges back to the
+          start, so a collector k steps from closing the cycle is only visited
+          if it is in reach[k]; reach[k] is None once it grows past
+          REACH_LIMIT, and those steps are not pruned
+        - successors are generated as the search asks for them, so a search
+          that finds its cycles early never works out the rest
+        - shorter cycles are searched for first, as every extra collector is
+          another who has to accept
+
+    Args:
+        index (MatchIndex): who owns and wants what
+        start (int): id of the collector the cycles go through
+        max_length (int): most collectors in a cycle
+    """
+
+    def __init__(self, index, start, max_length):
+        self.index = index
+        self.start = start
+        self.start_owned = index.owned.get(start, set())
+        self.max_length = max_length
+        self.steps = 0
+        self.cycles = []
+
+        self.reach = {1: self.predecessors({start})}
+        for k in range(2, max_length):
+            previous = self.reach[k - 1]
+            self.reach[k] = None if previous is None else self.predecessors(previous)
+
+    def predecessors(self, collectors):
+        """Returns the collectors wanting something one of collectors owns,
+        or None if there are more than REACH_LIMIT of them."""
+        index = self.index
+        found = set()
+        for collector in collectors:
+            for c in index.owned.get(collector, ()):
+                found |= index.wanters.get(c, set())
+                if len(found) > REACH_LIMIT:
+                    return None
+
+        return found
+
+    def successors(self, collector, within=None):
+        """Generates the collectors owning something collector wants, only
+        those in within if it is given."""
+        index = self.index
+        seen = set()
+        for c in index.wanted.get(collector, ()):
+            owners = index.owners.get(c, set())
+            for owner in owners if within is None else owners & within:
+                if owner not in seen:
+                    seen.add(owner)
+                    yield owner
+
+    def closes(self, collector):
+        """Returns whether collector wants something the start owns."""
+        return not self.start_owned.isdisjoint(self.index.wanted.get(collector, ()))
+
+    def run(self, limit=CYCLES_PER_COLLECTOR, budget=SEARCH_BUDGET):
+        """Returns up to limit cycles through the start, each a tuple of
+        collector ids in which every collector gets something from the next."""
+        if not self.start_owned or self.reach[1] == set():
+            return []
+
+        for length in range(MIN_CYCLE_LENGTH, self.max_length + 1):
+            if self.extend([self.start], {self.start}, length, limit, budget):
+                break
+
+        return self.cycles
+
+    def extend(self, path, on_path, length, limit, budget):
+        """Extends path towards a cycle of length collectors, returning True
+        once the search should stop."""
+        left = length - len(path)
+
+        for collector in self.successors(path[-1], self.reach[left]):
+            if collector in on_path:
+                continue
+
+            self.steps += 1
+            if self.steps > budget:
+                return True
+
+            if left == 1:
+                if self.reach[1] is None and not self.closes(collector):
+                    continue
+
+                self.cycles.append(tuple(path) + (collector,))
+                if len(self.cycles) >= limit:
+                    return True
+                continue
+
+            path.append(collector)
+            on_path.add(collector)
+            done = self.extend(path, on_path, length, limit, budget)
+            path.pop()
+            on_path.discard(collector)
+
+            if done:
+                return True
+
+        return False
+
+
+def canonical(cycle):
+    """Returns a cycle rotated to start at its smallest collector, so the same
+    cycle found from different collectors compares equal."""
+    i = cycle.index(min(cycle))
+    return cycle[i:] + cycle[:i]
+
+
+""" |------------------------------------|
+    |   Functions for the cycle search   |
+    |------------------------------------| """
+
+# Graph searched by the pool's processes, which inherit it when forked
+_graph = None
+
+
+def search_partition(args):
+    """Finds the cycles through each collector of a partition.
+
+    Args:
+        args ((list, int)): ids of the collectors to start from, and the most
+                            collectors in a cycle
+
+    Returns:
+        set: the cycles found, in canonical() form
+    """
+    starts, max_length = args
+    found = set()
+    for start in starts:
+        for cycle in CycleSearch(_graph, start, max_length).run():
+            found.add(canonical(cycle))
+
+    return found
+
+
+def find_trade_cycles(max_length=MAX_CYCLE_LENGTH, workers=None):
+    """Finds the trade cycles between collectors and saves them, replacing
+    the cycles found before.
+
+    Args:
+        max_length (int): most collectors in a cycle, MIN_CYCLE_LENGTH to
+                          MAX_CYCLE_LENGTH
+        workers (int): processes searching the graph, one per CPU if None
+
+    Returns:
+        dictionary: size of the graph, number of cycles found, and seconds taken
+
+    Example Output:
+        {"collectors": 10000, "cycles": 2412, "seconds": 12.5}
+    """
+    global _graph
+
+    started = time.perf_counter()
+    max_length = max(MIN_CYCLE_LENGTH, min(max_length, MAX_CYCLE_LENGTH))
+    workers = workers or os.cpu_count() or 1
+
+    _graph = db_matching.build_index()
+    # Only collectors who own and want something can be in a cycle
+    starts = sorted(set(_graph.owned) & set(_graph.wanted))
+    partitions = [
+        (starts[i:i + PARTITION_SIZE], max_length)
+        for i in range(0, len(starts), PARTITION_SIZE)
+    ]
+
+    cycles = set()
+    try:
+        if workers == 1:
+            for partition in partitions:
+                cycles |= search_partition(partition)
+        else:
+            # Forked processes share the graph with this one instead of copying it
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                for found in pool.imap_unordered(search_partition, partitions):
+                    cycles |= found
+    finally:
+        graph, _graph = _graph, None
+
+    save_trade_cycles(graph, sorted(cycles, key=lambda c: (len(c), c)))
+
+    return {
+        "collectors": len(starts),
+        "cycles": len(cycles),
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+def save_trade_cycles(index, cycles):
+    """Replaces the saved trade cycles with cycles, in one transaction.
+
+    Notes:
+        - the cycles' ids are taken from the table's sequence up front, so the
+          rows of both tables can be sent as arrays, a batch per statement
+
+    Args:
+        index (MatchIndex): the graph the cycles were found in
+        cycles ([tuple]): cycles of collector ids, each getting something from
+                          the next
+    """
+    tc = dbm.trade_cycles_table
+    steps = dbm.trade_cycle_steps_table
+    today = date.today()
+
+    with dbm.db_transaction() as conn:
+        conn.execute(db.delete(steps))
+        conn.execute(db.delete(tc))
+
+        sequence = db.cast(db.func.pg_get_serial_sequence(tc.name, "id"), postgresql.REGCLASS)
+        for i in range(0, len(cycles), INSERT_BATCH_SIZE):
+            batch = cycles[i:i + INSERT_BATCH_SIZE]
+            ids = conn.execute(
+                db.select(db.func.nextval(sequence)).select_from(
+                    db.func.generate_series(1, len(batch)))
+            ).scalars().all()
+
+            insert_columns(conn, tc, {
+                "id": ids,
+                "size": [len(cycle) for cycle in batch],
+                "date_found": [today] * len(batch),
+            })
+
+            rows = {name: [] for name in
+                    ("cycle_id", "position", "giver_id", "receiver_id", "collectible_id")}
+            for cycle_id, cycle in zip(ids, batch):
+                for position, receiver in enumerate(cycle):
+                    giver = cycle[(position + 1) % len(cycle)]
+                    rows["cycle_id"].append(cycle_id)
+                    rows["position"].append(position)
+                    rows["giver_id"].append(giver)
+                    rows["receiver_id"].append(receiver)
+                    # Any collectible the receiver wants from the giver will do
+                    rows["collectible_id"].append(
+                        min(index.wanted[receiver] & index.owned[giver]))
+            insert_columns(conn, steps, rows)
+
+
+def insert_columns(conn, table, columns):
+    """Inserts rows into a table in one statement, sending each column's
+    values as an array.
+
+    Args:
+        conn (Connection): connection to insert the rows with
+        table (Table): the table
+        columns (dictionary): column name -> list of the rows' values
+    """
+    names = list(columns)
+    select_stmt = db.select(
+        *(
+            db.func.unnest(db.literal(columns[name], postgresql.ARRAY(table.c[name].type)))
+            for name in names
+        )
+    )
+    conn.execute(db.insert(table).from_select(names, select_stmt))
+
+
+""" |------------------------------------|
+    |   Functions for the saved cycles   |
+    |------------------------------------| """
+
+
+def get_trade_cycles(user_id):
+    """Returns the saved trade cycles the user is in, leaving out any that can
+    no longer go ahead because a giver no longer owns their collectible or a
+    receiver no longer wants theirs.
+
+    Args:
+        user_id (int): id of the collector
+
+    Returns:
+        JSON, int: JSON holds the cycles, smallest first, int is the error code
+
+    Example Output:
+        {
+            "cycles": [
+                {
+                    "cycle_id": 4,
+                    "size": 3,
+                    "date_found": "16/10/2023",
+                    "steps": [
+                        {
+                            "giver_id": 7,
+                            "giver_username": "lanny",
+                            "receiver_id": 2,
+                            "receiver_username": "meng",
+                            "collectible_id": 12,
+                            "collectible_name": "Chimp",
+                            "collectible_image": "https://...",
+                        },
+                        ...
+                    ],
+                },
+            ]
+        }, 200
+    """
+    tc = dbm.trade_cycles_table
+    steps = dbm.trade_cycle_steps_table
+    ctn = dbm.collections_table
+    want = dbm.wantlist_table
+    cbl = dbm.collectible_table
+    giver = dbm.collector_table.alias("giver")
+    receiver = dbm.collector_table.alias("receiver")
+
+    # Aliased, so the subqueries are not correlated with the outer query's steps
+    my_steps = steps.alias("my_steps")
+    cycle_steps = steps.alias("cycle_steps")
+
+    mine = db.select(my_steps.c.cycle_id).where(my_steps.c.giver_id == user_id)
+
+    still_owned = db.exists().where(
+        (ctn.c.collector_id == cycle_steps.c.giver_id)
+        & (ctn.c.collectible_id == cycle_steps.c.collectible_id)
+    )
+    still_wanted = db.exists().where(
+        (want.c.collector_id == cycle_steps.c.receiver_id)
+        & (want.c.collectible_id == cycle_steps.c.collectible_id)
+    )
+    broken = db.select(cycle_steps.c.cycle_id).where(
+        cycle_steps.c.cycle_id.in_(mine) & (~still_owned | ~still_wanted)
+    )
+
+    join = db.join(steps, tc, steps.c.cycle_id == tc.c.id).join(
+        giver, steps.c.giver_id == giver.c.id).join(
+        receiver, steps.c.receiver_id == receiver.c.id).join(
+        cbl, steps.c.collectible_id == cbl.c.id)
+
+    select_stmt = db.select(
+        tc.c.id,
+        tc.c.size,
+        tc.c.date_found,
+        steps.c.giver_id,
+        giver.c.username.label("giver_username"),
+        steps.c.receiver_id,
+        receiver.c.username.label("receiver_username"),
+        steps.c.collectible_id,
+        cbl.c.name.label("collectible_name"),
+        cbl.c.image.label("collectible_image"),
+    ).select_from(join).where(
+        tc.c.id.in_(mine) & tc.c.id.not_in(broken)
+    ).order_by(tc.c.size, tc.c.id, steps.c.position)
+
+    engine, conn, metadata = dbm.db_connect()
+    rows = conn.execute(select_stmt).fetchall()
+    conn.close()
+
+    cycles = {}
+    for row in rows:
+        cycle = cycles.setdefault(
+            row.id,
+            {"cycle_id": row.id, "size": row.size,
+             "date_found": db_helpers.format_date(row.date_found), "steps": []},
+        )
+        cycle["steps"].append(
+            {
+                "giver_id": row.giver_id,
+                "giver_username": row.giver_username,
+                "receiver_id": row.receiver_id,
+                "receiver_username": row.receiver_username,
+                "collectible_id": row.collectible_id,
+                "collectible_name": row.collectible_name,
+                "collectible_image": row.collectible_image,
+            }
+        )
+
+    return jsonify({"cycles": list(cycles.values())}), OK
@@ -1,11 +1,18 @@
-from datetime import date
+from datetime import date, datetime
 from flask import jsonify
 import sqlalchemy as db
 
-from error import OK
-import db_collections, db_exchangehistory, db_helpers
+from error import OK, InputError
+from main.database import db_matching
+import db_campaign_analytics, db_exchangehistory, db_helpers
 import db_manager as dbm, db_past_tradeoffers
 
+# Times accept_trade_offer tries to lock an offer's trade posts
+ACCEPT_ATTEMPTS = 3
+
+# Returned by lock_trade when an offer was made on the posts it was locking
+RETRY = object()
+
 
 def register_trade_offer(tp_id, send_id, ctn_s_id, offer_msg, offer_img):
     """Generates a new trade offer for a certain trade_post
@@ -18,31 +25,36 @@ def register_trade_offer(tp_id, send_id, ctn_s_id, offer_msg, offer_img):
     Returns:
         JSON, int: JSON of the trade offer's id, int of the error code
     
+    Notes:
+        - the trade post's offers_received is counted up in the same transaction
+
     Example Output:
         {"trade_offer_id": 1}, 200
     """
-    engine, conn, metadata = dbm.db_connect()
+    # Loads in the trade_posts and trade_offers table
+    tp = dbm.trade_posts_table
+    to = dbm.trade_offers_table
+
+    with dbm.db_transaction() as conn:
+        # Count the offer first, which locks the post before the offer like accept_trade_offer
+        count_stmt = db.update(tp).where(tp.c.id == tp_id).values(
+            offers_received=tp.c.offers_received + 1).returning(tp.c.id)
+        if conn.execute(count_stmt).scalar_one_or_none() is None:
+            return jsonify({"msg": f"Trade post {tp_id} does not exist!"}), InputError
+
+        insert_stmt = db.insert(to).values(
+            {
+                "trade_post_id": tp_id,
+                "trade_sender_id": send_id,
+                "collection_send_id": ctn_s_id,
+                "offer_message": offer_msg,
+                "offer_image": offer_img,
+                "offer_status": "SENT",
+                "date_offered": date.today(),
+                "date_updated": date.today()
+            }).returning(to.c.id)
+        trade_offer_id = conn.execute(insert_stmt).scalar_one()
 
-    # Loads in the trade_offers table
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
-
-    insert_stmt = db.insert(to).values(
-        {
-            "trade_post_id": tp_id,
-            "trade_sender_id": send_id,
-            "collection_send_id": ctn_s_id,
-            "offer_message": offer_msg,
-            "offer_image": offer_img,
-            "offer_status": "SENT",
-            "date_offered": date.today(),
-            "date_updated": date.today()
-        })
-    conn.execute(insert_stmt)
-    conn.close()
-
-    # Find the id associated with the trade offer
-    trade_offer_id = find_trade_offer_id(tp_id, send_id, ctn_s_id)
-    
     return jsonify({"trade_offer_id": trade_offer_id}), OK
 
 
@@ -89,10 +101,10 @@ def find_tradelist_offers(trade_post_id):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the trade_offers, collections, collectibles, and collectors table
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
-    ctn = db.Table("collections", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-    ctr = db.Table("collectors", metadata, autoload_with=engine)
+    to = dbm.trade_offers_table
+    ctn = dbm.collections_table
+    cbl = dbm.collectible_table
+    ctr = dbm.collector_table
 
     join = db.join(to, ctr, 
             (to.c.trade_sender_id == ctr.c.id) &
@@ -119,14 +131,24 @@ def find_tradelist_offers(trade_post_id):
     return jsonify(offers)
 
 
-def find_outgoing_offers(user_id):
+def find_outgoing_offers(user_id, status=None, limit=None, cursor=None):
     """Finds all outgoing offers the user has made
 
     Notes:
-        id == sender_id
+        - id == sender_id
+        - current and past offers are found in a single query, most recently
+          updated first
+        - when limit is given, the result is paginated and returned as
+          {"offers": [...], "next": cursor}, where "next" is passed back in
+          as cursor to get the following page (null on the last page)
 
     Args:
         user_id (int): id of user who we want to find outgoing trade offers for
+        status (string): only return offers with this status ("SENT",
+                         "ACCEPTED" or "DECLINED"), all when None
+        limit (int): max number of offers to return, at most
+                     db_helpers.MAX_PAGE_SIZE, all when None
+        cursor (string): cursor from the previous page
     
     Returns:
         JSON, int: JSON of list of offers the user has sent, int of error code
@@ -165,65 +187,81 @@ def find_outgoing_offers(user_id):
             ]
         }, 200
     """
-    engine, conn, metadata = dbm.db_connect()
+    try:
+        limit = db_helpers.parse_limit(limit)
+    except ValueError:
+        return jsonify({"msg": "Limit must be at least 1!"}), InputError
 
-    # Loads in the trade_offers, collections, collectibles, and collectors table
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
-    ctn = db.Table("collections", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-    ctr = db.Table("collectors", metadata, autoload_with=engine)
-
-    join = db.join(to, ctn,
-            (to.c.collection_send_id == ctn.c.id) &
-            (to.c.trade_sender_id == user_id)).join(cbl,
-            (ctn.c.collectible_id == cbl.c.id))
+    engine, conn, metadata = dbm.db_connect()
 
-    # Finds offers that the collector has made
-    select_stmt = (db.select(
-        to.c.id.label("offer_id"),
-        cbl.c.id.label("collectible_s_id"),
-        cbl.c.name.label("collectible_s_name"),
-        cbl.c.image.label("collectible_s_img"),
-        to.c.date_offered.label("date_offer_sent"),
-        to.c.offer_status.label("offer_status"),
-        to.c.date_updated.label("date_updated"),
-        to.c.trade_post_id.label("trade_post_id")
-    ).select_from(join))
+    # Combines the offers still waiting on a reply with the past offers
+    offers = db.union_all(
+        outgoing_offers_stmt(user_id),
+        db_past_tradeoffers.past_outgoing_offers_stmt(user_id),
+    ).subquery("offers")
+
+    select_stmt = offer_details_stmt(offers).order_by(
+        offers.c.date_updated.desc(), offers.c.is_past.desc(), offers.c.offer_id.desc()
+    )
+
+    if status is not None:
+        select_stmt = select_stmt.where(offers.c.offer_status == status)
+
+    # Continue on from the last offer of the previous page
+    if limit is not None and cursor:
+        try:
+            cursor_date, cursor_past, cursor_id = db_helpers.decode_cursor(cursor)
+            cursor_date = datetime.strptime(cursor_date, "%Y-%m-%d").date()
+            cursor_past, cursor_id = int(cursor_past), int(cursor_id)
+        except (TypeError, ValueError):
+            conn.close()
+            return jsonify({"msg": "Invalid cursor!"}), InputError
+
+        select_stmt = select_stmt.where(
+            db.tuple_(offers.c.date_updated, offers.c.is_past, offers.c.offer_id)
+            < db.tuple_(cursor_date, cursor_past, cursor_id)
+        )
+
+    # Fetch one extra row to find out if there is another page
+    if limit is not None:
+        select_stmt = select_stmt.limit(limit + 1)
+
+    rows = conn.execute(select_stmt).fetchall()
+    conn.close()
 
-    offers = db_helpers.rows_to_list(conn.execute(select_stmt).fetchall())
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = db_helpers.encode_cursor(
+            last.date_updated, last.is_past, last.offer_id
+        )
 
-    # Loop through all the outgoing offers, and find the poster's information
-    for offer in offers:
-        tp_id = offer.get("trade_post_id")
-        new_join = db.join(tp, ctr, 
-                    (tp.c.id == tp_id) &
-                    (tp.c.collector_id == ctr.c.id)).join(ctn,
-                    (tp.c.collection_id == ctn.c.id)).join(cbl,
-                    (ctn.c.collectible_id == cbl.c.id))
-        find_stmt = (db.select(
-            cbl.c.id.label("collectible_r_id"),
-            cbl.c.name.label("collectible_r_name"),
-            cbl.c.image.label("collectible_r_img"),
-            ctr.c.id.label("trader_collector_id"),
-            ctr.c.username.label("trader_name"),
-            ctr.c.profile_picture.label("trade_profile_img")
-        )).select_from(new_join)
-        details_dict = conn.execute(find_stmt).fetchone()._asdict()
-        offer.update(details_dict)
-        offer.pop("trade_post_id")
+    offer_list = db_helpers.rows_to_list(rows)
+    for offer in offer_list:
         offer.pop("offer_id")
-    # Finds and appends all offers that have been accepted/declined in the past
-    offer_list = offers + db_past_tradeoffers.find_past_outgoing_offers(
-        user_id, engine, conn, metadata)
+        offer.pop("is_past")
 
-    conn.close()
-    return jsonify(offer_list), OK
+    if limit is None:
+        return jsonify(offer_list), OK
+
+    return jsonify({"offers": offer_list, "next": next_cursor}), OK
 
 
 def accept_trade_offer(offer_id):
     """Function to accept a trade offer
 
+    Notes:
+        - runs as one transaction with a fixed number of statements, however
+          many offers the trade post has
+        - every trade post the accept changes is locked first, in id order,
+          then the offer, then both traded collections (see lock_trade), so
+          concurrent accepts sharing posts or collections queue up instead of
+          deadlocking, and then find the offer closed instead of trading twice
+        - every other open offer on the post, or that offers one of the two
+          traded collections, is declined and moved to past_trade_offers, and
+          posts for the traded collections are removed
+
     Args:
         offer_id (int): id of the offer we want to accept
     
@@ -233,69 +271,195 @@ def accept_trade_offer(offer_id):
     Example Output:
         {"offer_id": 2}, 200
     """
-    engine, conn, metadata = dbm.db_connect()
+    for attempt in range(ACCEPT_ATTEMPTS):
+        result = try_accept_trade_offer(offer_id)
+        if result is not None:
+            return result
 
-    # Loads in the trade_posts, trade_offers, and trade_post_images tables
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
-    tp_img = db.Table("trade_post_images", metadata, autoload_with=engine)
-    
-    # Change offer status from "SENT" to "ACCEPTED"
-    update_stmt = db.update(to).where(to.c.id == offer_id).values({
-        "offer_status": "ACCEPTED",
-        "date_updated": date.today()
-    })
+    return jsonify({"msg": f"Trade offer {offer_id} is busy, try again!"}), InputError
 
-    conn.execute(update_stmt)
 
-    # Save our trade post - trade offer information, and find the trade post id
-    tp_to_info = to_tp_info(offer_id, engine, conn, metadata)
-    trade_post_id = tp_to_info.get("trade_post_id")
+def try_accept_trade_offer(offer_id):
+    """Accepts a trade offer, see accept_trade_offer.
 
-    # This will move our trade offer to past_trade_offers table, and delete the trade offer
-    db_past_tradeoffers.move_to_past(offer_id, engine, conn, metadata)
-    
-    # For all the other trades, automatically set them to "DECLINED"
-    offers_update_stmt = db.update(to).where(
-        to.c.trade_post_id == trade_post_id).values(offer_status = "DECLINED")
-    conn.execute(offers_update_stmt)
-
-    # Find the id of the remaining trade offers, and send them to "past_trade_offers" table
-    find_remaining_offers_stmt = db.select(to).where(to.c.trade_post_id == trade_post_id)
-    remaining_offers = conn.execute(find_remaining_offers_stmt).fetchall()
-    for offer in remaining_offers:
-        curr_offer_id = offer._asdict().get("id")
-        db_past_tradeoffers.move_to_past(curr_offer_id, engine, conn, metadata)
-
-    # Delete trade post images associated with the trade post
-    post_img_delete_stmt = db.delete(tp_img).where(
-        tp_img.c.trade_post_id == trade_post_id)
-    conn.execute(post_img_delete_stmt)
-
-    # Delete the trade post
-    post_delete_stmt = db.delete(tp).where(tp.c.id == trade_post_id)
-    conn.execute(post_delete_stmt)
-
-    # Get the id's of traders, and the traders' collection_id
-    receiver_id = tp_to_info.get("receiver_id")
-    collection_r_id = tp_to_info.get("collection_r_id")
-    sender_id = tp_to_info.get("sender_id")
-    collection_s_id = tp_to_info.get("collection_s_id")
-
-    # Adds the accepted trade offer into the exchange history table
-    db_exchangehistory.add_exhange_history(tp_to_info, engine, conn, metadata)
-    
-    # Moves collectible from sender to receiver
-    db_collections.move_collectible(sender_id, receiver_id, collection_s_id)
+    Returns:
+        JSON, int: JSON of offer_id, int of success/error code, or None if an
+                   offer was made on the trade posts while locking them, and
+                   the accept has to be tried again
+    """
+    # Loads in the trade_posts, trade_offers, trade_post_images, past_trade_offers and collections tables
+    tp = dbm.trade_posts_table
+    to = dbm.trade_offers_table
+    tp_img = dbm.trade_post_images_table
+    past_to = dbm.past_trade_offers_table
+    ctn = dbm.collections_table
+
+    with dbm.db_transaction() as conn:
+        locked = lock_trade(conn, offer_id)
+        if locked is None:
+            return jsonify({"msg": f"Trade offer {offer_id} is no longer open!"}), InputError
+        if locked is RETRY:
+            return None
+
+        offer, post, traded = locked
+        sender_id = offer.trade_sender_id
+        receiver_id = post.collector_id
+        collection_s_id = offer.collection_send_id
+        collection_r_id = post.collection_id
+
+        # Check neither collection has changed hands since the offer was made
+        if (traded.get(collection_s_id) is None
+                or traded.get(collection_r_id) is None
+                or traded[collection_s_id].collector_id != sender_id
+                or traded[collection_r_id].collector_id != receiver_id):
+            return jsonify({"msg": f"Trade offer {offer_id} is no longer valid!"}), InputError
+
+        today = date.today()
+        traded_ids = [collection_s_id, collection_r_id]
+
+        # Posts of the traded collections and the offers on them, or that offer them, are closed
+        closed_posts = db.select(tp.c.id).where(tp.c.collection_id.in_(traded_ids))
+        closed_offers = to.c.trade_post_id.in_(closed_posts) | to.c.collection_send_id.in_(traded_ids)
+
+        # The closed offers no longer count towards their posts' offers_received
+        closed_counts = db.select(
+            to.c.trade_post_id, db.func.count().label("closed")
+        ).where(closed_offers & (to.c.offer_status == "SENT")).group_by(
+            to.c.trade_post_id).subquery()
+        count_stmt = db.update(tp).where(tp.c.id == closed_counts.c.trade_post_id).values(
+            offers_received=tp.c.offers_received - closed_counts.c.closed)
+        conn.execute(count_stmt)
+
+        # Accept our offer and decline every other closed offer
+        update_stmt = db.update(to).where(closed_offers).values({
+            "offer_status": db.case((to.c.id == offer_id, "ACCEPTED"), else_="DECLINED"),
+            "date_updated": db.case((to.c.id == offer_id, today), else_=to.c.date_updated),
+        })
+        conn.execute(update_stmt)
+
+        # Copy the closed offers to past_trade_offers, with the accepted offer first
+        ctn_s = ctn.alias("ctn_s")
+        ctn_r = ctn.alias("ctn_r")
+        join = db.join(to, tp, to.c.trade_post_id == tp.c.id).join(
+            ctn_s, to.c.collection_send_id == ctn_s.c.id).join(
+            ctn_r, tp.c.collection_id == ctn_r.c.id)
+
+        past_select = db.select(
+            to.c.trade_sender_id,
+            ctn_s.c.collectible_id,
+            tp.c.collector_id,
+            ctn_r.c.collectible_id,
+            to.c.date_offered,
+            to.c.date_updated,
+            to.c.offer_status,
+        ).select_from(join).where(closed_offers).order_by((to.c.id != offer_id), to.c.id)
+
+        past_insert_stmt = db.insert(past_to).from_select(
+            ["trade_sender_id", "collectible_send_id", "trade_receiver_id",
+             "collectible_receive_id", "date_offered", "date_updated", "offer_status"],
+            past_select)
+        conn.execute(past_insert_stmt)
+
+        # Adds the accepted trade offer into the exchange history table
+        db_exchangehistory.add_exhange_history({
+            "sender_id": sender_id,
+            "collectible_s_id": traded[collection_s_id].collectible_id,
+            "receiver_id": receiver_id,
+            "collectible_r_id": traded[collection_r_id].collectible_id,
+            "date_offered": offer.date_offered,
+            "date_accepted": today,
+        }, conn)
+
+        # Delete the closed offers, then the closed posts and their images
+        conn.execute(db.delete(to).where(closed_offers))
+        conn.execute(db.delete(tp_img).where(tp_img.c.trade_post_id.in_(closed_posts)))
+        conn.execute(db.delete(tp).where(tp.c.collection_id.in_(traded_ids)))
+
+        # Swap the owners of the two collections
+        ctn_update_stmt = db.update(ctn).where(ctn.c.id.in_(traded_ids)).values({
+            "collector_id": db.case(
+                (ctn.c.id == collection_s_id, receiver_id), else_=sender_id),
+            "date_added": today,
+        })
+        conn.execute(ctn_update_stmt)
 
-    # Moves the collectible from receiver to sender
-    db_collections.move_collectible(receiver_id, sender_id, collection_r_id)
+        # The traded collections now count as collected today
+        db_campaign_analytics.record_activity(
+            [(traded[i].collectible_id, traded[i].date_added, "collected", -1) for i in traded_ids]
+            + [(traded[i].collectible_id, today, "collected", 1) for i in traded_ids], conn)
 
-    conn.close()
+    # Both collectors gained one collectible and may have lost the other
+    for collector_id in (sender_id, receiver_id):
+        for collection_id in traded_ids:
+            db_matching.update_holding(collector_id, traded[collection_id].collectible_id)
 
     return jsonify({"offer_id": offer_id}), OK
 
 
+def lock_trade(conn, offer_id):
+    """Locks the rows accepting an offer changes, in the order every accept
+    locks them in.
+
+    Notes:
+        - the posts changed are the posts of the two traded collections and
+          the posts of every offer sending one of them; they are locked first,
+          in id order, then the offer, then the collections in id order
+        - the posts are found before they are locked, so an offer made in
+          between can add another one; that is checked once the collections
+          are locked, as no offer on or of them can be made after that
+
+    Args:
+        conn (Connection): connection of the accept's transaction
+        offer_id (int): id of the offer being accepted
+
+    Returns:
+        (Row, Row, dictionary): the offer, its trade post, and the traded
+                                collections by id; None if the offer is no
+                                longer open, or RETRY if more posts have to
+                                be locked
+    """
+    tp = dbm.trade_posts_table
+    to = dbm.trade_offers_table
+    ctn = dbm.collections_table
+
+    # Offers and the collection of a post never change, so they can be read
+    # before anything is locked
+    offer = conn.execute(db.select(to).where(to.c.id == offer_id)).fetchone()
+    if offer is None:
+        return None
+
+    post_ctn_id = conn.execute(
+        db.select(tp.c.collection_id).where(tp.c.id == offer.trade_post_id)
+    ).scalar_one_or_none()
+    if post_ctn_id is None:
+        return None
+
+    traded_ids = [offer.collection_send_id, post_ctn_id]
+    changed_posts = db.select(tp.c.id).where(
+        tp.c.collection_id.in_(traded_ids)
+        | tp.c.id.in_(db.select(to.c.trade_post_id).where(to.c.collection_send_id.in_(traded_ids)))
+    )
+
+    posts = {
+        row.id: row
+        for row in conn.execute(changed_posts.with_only_columns(*tp.c).order_by(tp.c.id).with_for_update())
+    }
+
+    offer = conn.execute(db.select(to).where(
+        (to.c.id == offer_id) & (to.c.offer_status == "SENT")).with_for_update()).fetchone()
+    post = posts.get(offer.trade_post_id) if offer is not None else None
+    if post is None:
+        return None
+
+    ctn_stmt = db.select(ctn).where(ctn.c.id.in_(traded_ids)).order_by(ctn.c.id).with_for_update()
+    traded = {row.id: row for row in conn.execute(ctn_stmt)}
+
+    if not set(conn.execute(changed_posts).scalars()) <= posts.keys():
+        return RETRY
+
+    return offer, post, traded
+
+
 def decline_trade_offer(offer_id):
     """Function to decline a trade offer
 
@@ -305,23 +469,39 @@ def decline_trade_offer(offer_id):
     Returns:
         JSON, int: JSON of id of declined offer, int of success/error code
     
+    Notes:
+        - runs as one transaction, which also counts the offer off its trade
+          post's offers_received
+
     Example Output:
         {"offer_id": 2}, 200
     """
-    engine, conn, metadata = dbm.db_connect()
+    # Loads in the trade_posts and trade_offers table
+    tp = dbm.trade_posts_table
+    to = dbm.trade_offers_table
+
+    with dbm.db_transaction() as conn:
+        # Lock the trade post before the offer, in the same order as accept_trade_offer
+        post_id_subq = db.select(to.c.trade_post_id).where(to.c.id == offer_id).scalar_subquery()
+        conn.execute(db.select(tp.c.id).where(tp.c.id == post_id_subq).with_for_update())
+
+        # Change offer status from "SENT" to "DECLINED"
+        update_stmt = db.update(to).where(
+            (to.c.id == offer_id) & (to.c.offer_status == "SENT")).values({
+            "offer_status": "DECLINED",
+            "date_updated": date.today()
+        }).returning(to.c.trade_post_id)
+        trade_post_id = conn.execute(update_stmt).scalar_one_or_none()
 
-    # Loads in the trade_offers table
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
+        if trade_post_id is None:
+            return jsonify({"msg": f"Trade offer {offer_id} is no longer open!"}), InputError
 
-    # Change offer status from "SENT" to "DECLINED"
-    update_stmt = db.update(to).where(to.c.id == offer_id).values({
-        "offer_status": "DECLINED",
-        "date_updated": date.today()
-    })
-    conn.execute(update_stmt)
+        count_stmt = db.update(tp).where(tp.c.id == trade_post_id).values(
+            offers_received=tp.c.offers_received - 1)
+        conn.execute(count_stmt)
 
-    # Will move our trade offer from trade_offers to past_trade_offers table
-    db_past_tradeoffers.move_to_past(offer_id, engine, conn, metadata)
+        # Will move our trade offer from trade_offers to past_trade_offers table
+        db_past_tradeoffers.move_to_past(offer_id, conn.engine, conn, dbm.metadata)
 
     return jsonify({"offer_id": offer_id}), OK
 
@@ -347,7 +527,7 @@ def find_trade_offer_id(trade_post_id, sender_id, ctn_s_id):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the trade_offers table
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
+    to = dbm.trade_offers_table
 
     select_stmt = db.select(to).where((to.c.trade_post_id == trade_post_id) &
                                       (to.c.trade_sender_id == sender_id) &
@@ -385,8 +565,8 @@ def to_tp_info(offer_id, engine, conn, metadata):
         }
     """
     # Loads in the trade_offers, collections, collectibles, and collectors table
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
+    to = dbm.trade_offers_table
+    tp = dbm.trade_posts_table
 
     join = db.join(to, tp,
         (to.c.trade_post_id == tp.c.id) & (to.c.id == offer_id))
@@ -406,4 +586,76 @@ def to_tp_info(offer_id, engine, conn, metadata):
 
     tp_to_info = db_helpers.rows_to_list(conn.execute(select_stmt).fetchall())[0]
 
-    return tp_to_info
\ No newline at end of file
+    return tp_to_info
+
+
+def outgoing_offers_stmt(user_id):
+    """Select statement for the offers a user has sent that are still open
+
+    Notes:
+        - has the same columns as past_outgoing_offers_stmt so the two can be
+          combined, and passed to offer_details_stmt
+
+    Args:
+        user_id (int): id of the collector that sent the offers
+
+    Returns:
+        Select: select statement of the user's current outgoing offers
+    """
+    to = dbm.trade_offers_table
+    tp = dbm.trade_posts_table
+    ctn_s = dbm.collections_table.alias("ctn_s")
+    ctn_r = dbm.collections_table.alias("ctn_r")
+
+    join = db.join(to, tp,
+        (to.c.trade_post_id == tp.c.id) &
+        (to.c.trade_sender_id == user_id)).join(ctn_s,
+        (to.c.collection_send_id == ctn_s.c.id)).join(ctn_r,
+        (tp.c.collection_id == ctn_r.c.id))
+
+    return db.select(
+        to.c.id.label("offer_id"),
+        db.literal(0).label("is_past"),
+        ctn_s.c.collectible_id.label("collectible_send_id"),
+        ctn_r.c.collectible_id.label("collectible_receive_id"),
+        tp.c.collector_id.label("trade_receiver_id"),
+        to.c.offer_status.label("offer_status"),
+        to.c.date_offered.label("date_offered"),
+        to.c.date_updated.label("date_updated"),
+    ).select_from(join)
+
+
+def offer_details_stmt(offers):
+    """Adds the collectible and trader details to a set of outgoing offers
+
+    Args:
+        offers (Subquery): offers with the columns of outgoing_offers_stmt
+
+    Returns:
+        Select: select statement of the offers and their details
+    """
+    cbl_s = dbm.collectible_table.alias("cbl_s")
+    cbl_r = dbm.collectible_table.alias("cbl_r")
+    ctr = dbm.collector_table
+
+    join = db.join(offers, cbl_s,
+        (offers.c.collectible_send_id == cbl_s.c.id)).join(cbl_r,
+        (offers.c.collectible_receive_id == cbl_r.c.id)).join(ctr,
+        (offers.c.trade_receiver_id == ctr.c.id))
+
+    return db.select(
+        offers.c.offer_id.label("offer_id"),
+        offers.c.is_past.label("is_past"),
+        cbl_s.c.id.label("collectible_s_id"),
+        cbl_s.c.name.label("collectible_s_name"),
+        cbl_s.c.image.label("collectible_s_img"),
+        cbl_r.c.id.label("collectible_r_id"),
+        cbl_r.c.name.label("collectible_r_name"),
+        cbl_r.c.image.label("collectible_r_img"),
+        offers.c.offer_status.label("offer_status"),
+        offers.c.date_offered.label("date_offer_sent"),
+        offers.c.date_updated.label("date_updated"),
+        ctr.c.id.label("trader_collector_id"),
+        ctr.c.username.label("trader_name"),
+        ctr.c.profile_picture.label("trader_profile_img"),
+    ).select_from(join)
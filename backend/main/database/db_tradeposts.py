@@ -55,10 +55,10 @@ def get_trade_posts(collectible_id):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the trade_posts, collections, collectibles and collectors table
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
-    ctn = db.Table("collections", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-    ctr = db.Table("collectors", metadata, autoload_with=engine)
+    tp = dbm.trade_posts_table
+    ctn = dbm.collections_table
+    cbl = dbm.collectible_table
+    ctr = dbm.collector_table
 
     join = db.join(tp, ctn, 
         (tp.c.collection_id == ctn.c.id)).join(cbl, 
@@ -117,20 +117,19 @@ def get_current_trade_posts(collector_id):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the trade_posts, collections, collectibles and collectors table
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
-    ctn = db.Table("collections", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-    ctr = db.Table("collectors", metadata, autoload_with=engine)
-    to = db.Table("trade_offers", metadata, autoload_with=engine)
+    tp = dbm.trade_posts_table
+    ctn = dbm.collections_table
+    cbl = dbm.collectible_table
+    ctr = dbm.collector_table
 
     join = db.join(tp, ctn, 
         (tp.c.collection_id == ctn.c.id) &
         (tp.c.collector_id == collector_id)).join(cbl, 
         (ctn.c.collectible_id == cbl.c.id)).join(ctr,
-        (tp.c.collector_id == ctr.c.id)).join(to,
-        (to.c.trade_post_id == tp.c.id) &
-        (to.c.offer_status == "SENT"), isouter=True)
+        (tp.c.collector_id == ctr.c.id))
 
+    # offers_received is kept up to date as offers are made and closed, so the
+    # offers themselves are not counted here
     select_stmt = (
         db.select(
             tp.c.id.label("trade_post_id"),
@@ -139,9 +138,7 @@ def get_current_trade_posts(collector_id):
             cbl.c.name.label("trader_collectible_name"),
             tp.c.post_date.label("trade_post_date"),
             cbl.c.image.label("trader_collectible_img"),
-            db.func.count(to.c.id).label("offers_received")
-        ).group_by(
-            tp.c.id, ctn.c.id, cbl.c.id, cbl.c.name, tp.c.post_date, cbl.c.image
+            tp.c.offers_received.label("offers_received")
         ).select_from(join)
     )
 
@@ -186,13 +183,13 @@ def get_trade_post_info(trade_post_id):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the trade_posts, collections, collectibles and collectors table
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
-    ctn = db.Table("collections", metadata, autoload_with=engine)
-    cbl = db.Table("collectibles", metadata, autoload_with=engine)
-    ctr = db.Table("collectors", metadata, autoload_with=engine)
+    tp = dbm.trade_posts_table
+    ctn = dbm.collections_table
+    cbl = dbm.collectible_table
+    ctr = dbm.collector_table
 
     # Load in the trade_post_images table
-    tp_imgs = db.Table("trade_post_images", metadata, autoload_with=engine)
+    tp_imgs = dbm.trade_post_images_table
 
     join = db.join(tp, ctn,
         (tp.c.collection_id == ctn.c.id) &
@@ -252,8 +249,8 @@ def insert_trade_post(collector_id, collection_id, post_title, post_desc, post_i
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the trade_posts and trade_post_images table
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
-    tp_imgs = db.Table("trade_post_images", metadata, autoload_with=engine)
+    tp = dbm.trade_posts_table
+    tp_imgs = dbm.trade_post_images_table
 
     insert_stmt = db.insert(tp).values(
         {
@@ -263,23 +260,21 @@ def insert_trade_post(collector_id, collection_id, post_title, post_desc, post_i
             "post_description": post_desc,
             "post_date": date.today()
         }
-    )
-    conn.execute(insert_stmt)
-
-    # Find the id of the trade_post associated with the new entry
-    trade_post_id = find_trade_post(collector_id, collection_id)
+    ).returning(tp.c.id)
+    trade_post_id = conn.execute(insert_stmt).scalar_one()
 
-    # Add the images to the trade_post_images table
-    for image_dict in post_imgs:
-        insert_img_stmt = db.insert(tp_imgs).values(
-            {
-                "trade_post_id": trade_post_id,
-                "name": image_dict.get("name"),
-                "caption": image_dict.get("caption"),
-                "image_url": image_dict.get("image")
-            }
-        )
-        conn.execute(insert_img_stmt)
+    # Add all the images to the trade_post_images table at once
+    image_rows = [
+        {
+            "trade_post_id": trade_post_id,
+            "name": image_dict.get("name"),
+            "caption": image_dict.get("caption"),
+            "image_url": image_dict.get("image")
+        }
+        for image_dict in post_imgs or []
+    ]
+    if image_rows:
+        conn.execute(db.insert(tp_imgs).values(image_rows))
     conn.close()
 
     return jsonify({"trade_post_id": trade_post_id}), OK
@@ -303,8 +298,8 @@ def remove_trade_post(collector_id, collection_id):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the trade_posts and trade_post_images table
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
-    tp_imgs = db.Table("trade_post_images", metadata, autoload_with=engine)
+    tp = dbm.trade_posts_table
+    tp_imgs = dbm.trade_post_images_table
 
     # Find id associated with trade listing we want to remove
     trade_post_id = find_trade_post(collector_id, collection_id)
@@ -337,7 +332,7 @@ def find_trade_post(collector_id, collection_id):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in the trade_posts table
-    tp = db.Table("trade_posts", metadata, autoload_with=engine)
+    tp = dbm.trade_posts_table
     
     select_stmt = db.select(tp).where(
         (tp.c.collector_id == collector_id) &
@@ -348,3 +343,94 @@ def find_trade_post(collector_id, collection_id):
     conn.close()
 
     return tp_id
+
+
+""" |------------------------------------|
+    |  Functions for the offer counters  |
+    |------------------------------------| """
+
+
+def offer_counts_stmt():
+    """Select statement comparing each trade post's offers_received with the
+    number of its offers that are still SENT
+
+    Returns:
+        Select: trade_post_id, offers_received and actual of every trade post
+    """
+    tp = dbm.trade_posts_table
+    to = dbm.trade_offers_table
+
+    sent = db.select(
+        to.c.trade_post_id, db.func.count().label("actual")
+    ).where(to.c.offer_status == "SENT").group_by(to.c.trade_post_id).subquery()
+
+    return db.select(
+        tp.c.id.label("trade_post_id"),
+        tp.c.offers_received,
+        db.func.coalesce(sent.c.actual, 0).label("actual"),
+    ).select_from(db.join(tp, sent, tp.c.id == sent.c.trade_post_id, isouter=True))
+
+
+def check_offer_counts(conn=None):
+    """Finds the trade posts whose offers_received is wrong
+
+    Args:
+        conn (Connection): connection to check with, db_connect()'s if None
+
+    Returns:
+        [dictionary]: one entry per wrong trade post, empty when all are right
+
+    Example Output:
+        [{"trade_post_id": 4, "offers_received": 3, "actual": 2}]
+    """
+    close = conn is None
+    if conn is None:
+        engine, conn, metadata = dbm.db_connect()
+
+    counts = offer_counts_stmt().subquery()
+    select_stmt = db.select(counts).where(
+        counts.c.offers_received != counts.c.actual
+    ).order_by(counts.c.trade_post_id)
+    wrong = [row._asdict() for row in conn.execute(select_stmt)]
+
+    if close:
+        conn.close()
+
+    return wrong
+
+
+def reconcile_offer_counts(conn=None):
+    """Recounts offers_received for the trade posts where it is wrong, e.g.
+    after offers are loaded straight into the database
+
+    Notes:
+        - the wrong posts are locked before they are recounted, so offers made
+          or closed meanwhile either wait for the recount or are already in it;
+          their own change to the count is relative, so it is never lost
+
+    Args:
+        conn (Connection): transaction to recount in, a new one if None
+
+    Returns:
+        int: number of trade posts whose count was wrong
+    """
+    if conn is None:
+        with dbm.db_transaction() as conn:
+            return reconcile_offer_counts(conn)
+
+    tp = dbm.trade_posts_table
+    to = dbm.trade_offers_table
+
+    wrong = [row["trade_post_id"] for row in check_offer_counts(conn)]
+    if not wrong:
+        return 0
+
+    lock_stmt = db.select(tp.c.id).where(tp.c.id.in_(wrong)).order_by(tp.c.id).with_for_update()
+    conn.execute(lock_stmt)
+
+    actual = db.select(db.func.count()).where(
+        (to.c.trade_post_id == tp.c.id) & (to.c.offer_status == "SENT")
+    ).scalar_subquery()
+    conn.execute(db.update(tp).where(tp.c.id.in_(wrong)).values(offers_received=actual))
+
+    return len(wrong)
@@ -0,0 +1,122 @@
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy.dialects.postgresql import insert
+import sqlalchemy as db
+
+from main.database import db_manager as dbm
+
+"""
+Preface:
+    - each kind of rarely changing data (e.g. the "catalog" of campaigns and
+    collectibles) has a version counter in the data_versions table, which
+    the write paths bump
+    - read routes wrapped in versioned() send the counter as their ETag and
+    Last-Modified, and answer conditional GETs that still match with a 304
+    after reading only the counter, before the route's own queries run
+"""
+
+CATALOG = "catalog"
+
+
+def get_version(name):
+    """Returns the current version of some data, creating its counter if needed.
+
+    Args:
+        name (string): name of the data, e.g. CATALOG
+
+    Returns:
+        (int, datetime): version number, and when it was last bumped
+    """
+    engine, conn, metadata = dbm.db_connect()
+    versions = dbm.data_versions_table
+
+    select_stmt = db.select(versions.c.version, versions.c.updated_at).where(
+        versions.c.name == name
+    )
+    row = conn.execute(select_stmt).fetchone()
+    conn.close()
+
+    if row is None:
+        return bump_version(name)
+
+    return row.version, row.updated_at
+
+
+def bump_version(name):
+    """Marks some data as changed, so clients holding the old version refetch it.
+
+    Args:
+        name (string): name of the data, e.g. CATALOG
+
+    Returns:
+        (int, datetime): new version number, and when it was bumped
+    """
+    engine, conn, metadata = dbm.db_connect()
+    versions = dbm.data_versions_table
+
+    upsert_stmt = (
+        insert(versions)
+        .values(name=name, version=1, updated_at=db.func.now())
+        .on_conflict_do_update(
+            index_elements=[versions.c.name],
+            set_={"version": versions.c.version + 1, "updated_at": db.func.now()},
+        )
+        .returning(versions.c.version, versions.c.updated_at)
+    )
+    row = conn.execute(upsert_stmt).fetchone()
+    conn.close()
+
+    return row.version, row.updated_at
+
+
+def versioned(name):
+    """Route decorator adding ETag and Last-Modified headers from the version
+    of some data, and answering matching conditional GETs with a 304.
+
+    Notes:
+        - the route's response must only depend on the request and the
+          versioned data
+        - the ETag includes when the version was bumped, so a counter that
+          restarts after a database reset never matches an old ETag
+
+    Args:
+        name (string): name of the data the route returns, e.g. CATALOG
+
+    Example:
+        @APP.route("/campaign/get_campaigns", methods=["GET"])
+        @db_versions.versioned(db_versions.CATALOG)
+        def get_all_campaigns():
+    """
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            version, updated_at = get_version(name)
+            etag = f"{name}-{version}-{int(updated_at.timestamp() * 1000000)}"
+            last_modified = updated_at.replace(microsecond=0)
+
+            # If-None-Match takes precedence over If-Modified-Since
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (
+                    request.if_modified_since is not None
+                    and last_modified <= request.if_modified_since
+                )
+
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            # Clients may keep the data but have to check it is current before using it
+            response.cache_control.no_cache = True
+            return response
+
+        return decorator
+
+    return wrapper
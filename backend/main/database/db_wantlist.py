@@ -3,7 +3,8 @@ from flask import jsonify
 import sqlalchemy as db
 
 from error import OK
-import db_collections, db_helpers, db_manager as dbm
+from main.database import db_matching
+import db_campaign_analytics, db_collections, db_helpers, db_manager as dbm
 
 """ |------------------------------------|
     |      Functions for wantlist        |
@@ -19,6 +20,9 @@ def get_wantlist(user_id):
     Returns:
         JSON, int: JSON holds the wantlist, int is the error code
 
+    Notes:
+        the wantlist is streamed out, see db_helpers.stream_list
+
     Example Output:
     {
         [
@@ -45,12 +49,10 @@ def get_wantlist(user_id):
         ]
     }, OK
     """
-    engine, conn, metadata = dbm.db_connect()
-
     # Load in the wantlist, campaign and collectible tables
-    want = db.Table("wantlist", metadata, autoload_with=engine)
-    coll = db.Table("collectibles", metadata, autoload_with=engine)
-    camp = db.Table("campaigns", metadata, autoload_with=engine)
+    want = dbm.wantlist_table
+    coll = dbm.collectible_table
+    camp = dbm.campaign_table
 
     # Join the tables
     join = db.join(
@@ -70,10 +72,7 @@ def get_wantlist(user_id):
         camp.c.start_date.label("date_released"),
     ).select_from(join)
 
-    wantlist = db_helpers.rows_to_list(conn.execute(search_stmt).fetchall())
-    conn.close()
-
-    return jsonify(wantlist), OK
+    return db_helpers.stream_list(search_stmt), OK
 
 
 def insert_wantlist(collector_id, collectible_id):
@@ -89,25 +88,25 @@ def insert_wantlist(collector_id, collectible_id):
     Example Output:
         {"wantlist_id": 1}, 200
     """
-    engine, conn, metadata = dbm.db_connect()
-
     # Loads in the wantlist and collectibles table into our metadata
-    wantlist = db.Table("wantlist", metadata, autoload_with=engine)
+    wantlist = dbm.wantlist_table
 
     curr_date = date.today()
 
-    # Insert a new entry into wantlist table
-    insert_stmt = db.insert(wantlist).values(
-        {
-            "collector_id": collector_id,
-            "collectible_id": collectible_id,
-            "date_added": curr_date,
-        }
-    )
-    conn.execute(insert_stmt)
-    conn.close()
+    with dbm.db_transaction() as conn:
+        # Insert a new entry into wantlist table
+        insert_stmt = db.insert(wantlist).values(
+            {
+                "collector_id": collector_id,
+                "collectible_id": collectible_id,
+                "date_added": curr_date,
+            }
+        ).returning(wantlist.c.id)
+        wantlist_id = conn.execute(insert_stmt).scalar_one()
+        db_campaign_analytics.record_activity(
+            [(collectible_id, curr_date, "wanted", 1)], conn)
 
-    wantlist_id = find_last_wantlist(collector_id).get("id")
+    db_matching.update_holding(collector_id, collectible_id)
 
     return jsonify({"wantlist_id": wantlist_id}), OK
 
@@ -126,16 +125,20 @@ def remove_from_wantlist(collector_id, wantlist_id):
     Example Output:
         {"wantlist_id": 1}, 200
     """
-    engine, conn, metadata = dbm.db_connect()
-
-    want = db.Table("wantlist", metadata, autoload_with=engine)
+    want = dbm.wantlist_table
 
     delete_stmt = db.delete(want).where(
         (want.c.collector_id == collector_id) & (want.c.id == wantlist_id)
-    )
+    ).returning(want.c.collectible_id, want.c.date_added)
 
-    conn.execute(delete_stmt)
-    conn.close()
+    with dbm.db_transaction() as conn:
+        removed = conn.execute(delete_stmt).one_or_none()
+        if removed is not None:
+            db_campaign_analytics.record_activity(
+                [(removed.collectible_id, removed.date_added, "wanted", -1)], conn)
+
+    if removed is not None:
+        db_matching.update_holding(collector_id, removed.collectible_id)
 
     return jsonify({"wantlist_id": wantlist_id}), OK
 
@@ -149,12 +152,10 @@ def move_to_collection(collector_id, wantlist_id):
     """
     collectible_id = get_wantlist_dict(wantlist_id).get("collectible_id")
 
-    db_collections.insert_collectible(collector_id, collectible_id)
+    resp, status = db_collections.insert_collectible(collector_id, collectible_id)
     remove_from_wantlist(collector_id, wantlist_id)
 
-    collection = db_collections.get_last_collection(collector_id)
-
-    return jsonify({"collection_id": collection.get("id")})
+    return jsonify({"collection_id": resp.get_json().get("collection_id")})
 
 
 """ |------------------------------------|
@@ -177,7 +178,7 @@ def find_wantlist_id(collector_id, collectible_id):
     engine, conn, metadata = dbm.db_connect()
 
     # Loads in our wantlist table
-    want = db.Table("wantlist", metadata, autoload_with=engine)
+    want = dbm.wantlist_table
 
     select_stmt = db.select(want.c.id).where(
         (want.c.collector_id == collector_id)
@@ -201,7 +202,7 @@ def find_last_wantlist(collector_id):
         dictionary: dictionary of the last wantlist item of the collector
     """
     engine, conn, metadata = dbm.db_connect()
-    wantlist = db.Table("wantlist", metadata, autoload_with=engine)
+    wantlist = dbm.wantlist_table
     select_stmt = (
         db.select(wantlist)
         .where(wantlist.c.collector_id == collector_id)
@@ -226,7 +227,7 @@ def get_wantlist_dict(wantlist_id):
     """
     engine, conn, metadata = dbm.db_connect()
 
-    wantlist = db.Table("wantlist", metadata, autoload_with=engine)
+    wantlist = dbm.wantlist_table
 
     select_stmt = db.select(wantlist).where(wantlist.c.id == wantlist_id)
     res = conn.execute(select_stmt)
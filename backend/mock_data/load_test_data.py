@@ -0,0 +1,344 @@
+from datetime import date, timedelta
+import csv
+import io
+import json
+import random
+
+from main.database import db_manager as dbm
+from main.privelage import COLLECTOR, MANAGER
+
+"""
+Preface:
+    - generates a synthetic dataset of any size for load testing: collectors,
+    campaigns, collectibles, collections, wantlists, trade posts, offers and
+    past exchanges, e.g.
+        flask --app server load-test-data --collectors 1000000
+    - rows are streamed into postgres with COPY, all in one transaction, so
+    millions of rows load in minutes and a failed load leaves nothing behind
+    - generated rows are given ids after the largest existing ones, so the
+    dataset can be added on top of the demo data
+    - every generated collector has the password LOAD_TEST_PASSWORD
+"""
+
+LOAD_TEST_PASSWORD = "password"
+# bcrypt hash of LOAD_TEST_PASSWORD, shared by every generated collector as
+# hashing millions of passwords would take hours
+LOAD_TEST_PASSWORD_HASH = "$2b$12$/QYJGeGNMFuPgiIR4UkQIeassbHt5ndEzrypn3F1bGRwV1MBYUD9e"
+
+FIRST_NAMES = ["Allina", "Lanny", "Danella", "Philbert", "Meng", "Stella", "Greg", "Uma"]
+LAST_NAMES = ["Melloy", "Thomazet", "Cleft", "Godlip", "Xiao", "Zhang", "White", "Amar"]
+DESCRIPTION = "Morbi non quam nec dui luctus rutrum. Nulla tellus. In sagittis dui vel nisl."
+
+# Tables in the order they are loaded, as later ones reference earlier ones
+TABLES = [
+    "collectors",
+    "privelages",
+    "campaigns",
+    "collectibles",
+    "collections",
+    "wantlist",
+    "trade_posts",
+    "trade_offers",
+    "exchange_history",
+]
+
+
+def generate_load_test_data(
+    collectors=10000,
+    managers=10,
+    campaigns=20,
+    collectibles_per_campaign=50,
+    collections_per_collector=20,
+    wantlist_per_collector=5,
+    trade_posts=1000,
+    offers_per_post=3,
+    exchanges=10000,
+    seed=0,
+):
+    """Adds a synthetic dataset of the given size to the database.
+
+    Args:
+        collectors (int): number of collectors, the first managers of which
+                          are managers
+        managers (int): number of managers running the campaigns
+        campaigns (int): number of campaigns
+        collectibles_per_campaign (int): number of collectibles in each campaign
+        collections_per_collector (int): collectibles in each collector's collection
+        wantlist_per_collector (int): collectibles in each collector's wantlist
+        trade_posts (int): number of trade posts, each for a different collection
+        offers_per_post (int): pending offers made on each trade post
+        exchanges (int): number of past exchanges between collectors
+        seed (int): seed of the random generator, so datasets can be recreated
+
+    Returns:
+        dictionary: table name -> number of rows added
+
+    Example Output:
+        {"collectors": 10000, "privelages": 10000, "campaigns": 20, ...}
+    """
+    rng = random.Random(seed)
+    managers = max(1, min(managers, collectors))
+    with open("./mock_data/collectibles.json") as f:
+        names = [collectible["name"] for collectible in json.load(f)]
+
+    with dbm.db_transaction() as conn:
+        start = {table: next_id(conn, table) for table in TABLES if table != "privelages"}
+
+        collector_ids = range(start["collectors"], start["collectors"] + collectors)
+        campaign_ids = range(start["campaigns"], start["campaigns"] + campaigns)
+        collectible_ids = range(
+            start["collectibles"], start["collectibles"] + campaigns * collectibles_per_campaign
+        )
+        collection_count = collectors * collections_per_collector
+
+        def collection_owner(index):
+            # Each collector's collections are consecutive
+            return collector_ids[index // collections_per_collector]
+
+        tables = {
+            "collectors": (
+                ["id", "email", "username", "first_name", "last_name", "phone",
+                 "password", "address"],
+                (
+                    [
+                        collector_id,
+                        f"load{collector_id}@example.com",
+                        f"load{collector_id}",
+                        rng.choice(FIRST_NAMES),
+                        rng.choice(LAST_NAMES),
+                        f"{rng.randrange(10 ** 10):010d}",
+                        LOAD_TEST_PASSWORD_HASH,
+                        f"{rng.randrange(1, 1000)} Load Test Street",
+                    ]
+                    for collector_id in collector_ids
+                ),
+            ),
+            "privelages": (
+                ["collector_id", "privelage"],
+                (
+                    [collector_id, MANAGER if i < managers else COLLECTOR]
+                    for i, collector_id in enumerate(collector_ids)
+                ),
+            ),
+            "campaigns": (
+                ["id", "name", "image", "description", "manager_id", "start_date",
+                 "end_date", "approved"],
+                (
+                    [
+                        campaign_id,
+                        f"Load Test Campaign {campaign_id}",
+                        f"https://picsum.photos/id/{rng.randrange(300)}/600/400",
+                        DESCRIPTION,
+                        collector_ids[i % managers],
+                        random_date(rng, days_ago=730),
+                        random_date(rng, days_ago=-365),
+                        True,
+                    ]
+                    for i, campaign_id in enumerate(campaign_ids)
+                ),
+            ),
+            "collectibles": (
+                ["id", "name", "description", "image", "campaign_id"],
+                (
+                    [
+                        collectible_id,
+                        f"{rng.choice(names)} {collectible_id}",
+                        DESCRIPTION,
+                        f"https://robohash.org/{collectible_id}.png?size=500x500&set=set1",
+                        campaign_ids[i // collectibles_per_campaign],
+                    ]
+                    for i, collectible_id in enumerate(collectible_ids)
+                ),
+            ),
+            "collections": (
+                ["id", "collector_id", "collectible_id", "date_added"],
+                (
+                    [
+                        start["collections"] + i,
+                        collection_owner(i),
+                        rng.choice(collectible_ids),
+                        random_date(rng),
+                    ]
+                    for i in range(collection_count)
+                ),
+            ),
+            "wantlist": (
+                ["id", "collector_id", "collectible_id", "date_added"],
+                (
+                    [
+                        start["wantlist"] + i,
+                        collector_ids[i // wantlist_per_collector],
+                        rng.choice(collectible_ids),
+                        random_date(rng),
+                    ]
+                    for i in range(collectors * wantlist_per_collector)
+                ),
+            ),
+        }
+
+        # Each trade post is for a different collection
+        trade_posts = min(trade_posts, collection_count)
+        posted = rng.sample(range(collection_count), trade_posts)
+
+        offers_per_post = offers_per_post if collectors > 1 else 0
+
+        tables["trade_posts"] = (
+            ["id", "collector_id", "collection_id", "post_title", "post_description",
+             "post_date", "offers_received"],
+            (
+                [
+                    start["trade_posts"] + i,
+                    collection_owner(index),
+                    start["collections"] + index,
+                    f"Trading collection {start['collections'] + index}",
+                    DESCRIPTION,
+                    random_date(rng, days_ago=60),
+                    offers_per_post,
+                ]
+                for i, index in enumerate(posted)
+            ),
+        )
+
+        def offers():
+            offer_id = start["trade_offers"]
+            for i, index in enumerate(posted):
+                for _ in range(offers_per_post):
+                    # An offer of one of another collector's collections
+                    sent = rng.randrange(collection_count)
+                    while collection_owner(sent) == collection_owner(index):
+                        sent = rng.randrange(collection_count)
+
+                    offered = random_date(rng, days_ago=30)
+                    yield [
+                        offer_id,
+                        start["trade_posts"] + i,
+                        collection_owner(sent),
+                        start["collections"] + sent,
+                        "Would you trade for this?",
+                        "",
+                        "SENT",
+                        offered,
+                        offered,
+                    ]
+                    offer_id += 1
+
+        tables["trade_offers"] = (
+            ["id", "trade_post_id", "trade_sender_id", "collection_send_id",
+             "offer_message", "offer_image", "offer_status", "date_offered",
+             "date_updated"],
+            offers(),
+        )
+
+        def past_exchanges():
+            for i in range(exchanges if collectors > 1 else 0):
+                sender, receiver = rng.sample(collector_ids, 2)
+                offered = random_date(rng, days_ago=365)
+                yield [
+                    start["exchange_history"] + i,
+                    sender,
+                    rng.choice(collectible_ids),
+                    receiver,
+                    rng.choice(collectible_ids),
+                    offered,
+                    offered + timedelta(days=rng.randrange(14)),
+                ]
+
+        tables["exchange_history"] = (
+            ["id", "trade_sender_id", "collectible_send_id", "trade_receiver_id",
+             "collectible_receive_id", "date_offered", "date_accepted"],
+            past_exchanges(),
+        )
+
+        counts = {}
+        for table in TABLES:
+            columns, rows = tables[table]
+            counts[table] = copy_rows(conn, table, columns, rows)
+
+        # New rows get ids after the generated ones
+        for table in start:
+            conn.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {table}), false)"
+            )
+
+    return counts
+
+
+""" |------------------------------------|
+    | Helper functions for load testing  |
+    |------------------------------------| """
+
+
+def copy_rows(conn, table, columns, rows):
+    """Streams rows into a table with COPY.
+
+    Args:
+        conn (Connection): transaction to copy the rows in
+        table (string): name of the table
+        columns ([string]): columns the rows' values are for
+        rows (iterable of lists): the rows
+
+    Returns:
+        int: number of rows copied
+    """
+    stream = CsvStream(rows)
+    cursor = conn.connection.dbapi_connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", stream
+    )
+    cursor.close()
+
+    return stream.count
+
+
+class CsvStream(io.RawIOBase):
+    """File-like object that reads rows as CSV, producing them as COPY asks
+    for them, so the rows never all have to be in memory.
+
+    Args:
+        rows (iterable of lists): the rows
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b""
+        self.count = 0
+        self.text = io.StringIO()
+        self.writer = csv.writer(self.text, lineterminator="\n")
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        # Writes rows a thousand at a time until there is enough to return
+        while size < 0 or len(self.buffer) < size:
+            written = 0
+            for row in self.rows:
+                self.writer.writerow(row)
+                written += 1
+                if written == 1000:
+                    break
+
+            if written == 0:
+                break
+
+            self.count += written
+            self.buffer += self.text.getvalue().encode("utf-8")
+            self.text.seek(0)
+            self.text.truncate()
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def next_id(conn, table):
+    """Returns the id after the largest one in a table."""
+    return conn.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").scalar()
+
+
+def random_date(rng, days_ago=365):
+    """Returns a random date within days_ago days of today (after today if
+    days_ago is negative)."""
+    return date.today() - timedelta(days=rng.randrange(min(0, days_ago), max(0, days_ago) + 1))
@@ -1,6 +1,7 @@
 import json
 # from random import random
 import random
+import re
 from main.database import db_manager as dbm
 from main.database import db_collectors, db_collectibles
 from flask import jsonify
@@ -8,6 +9,15 @@ from main import auth
 from main.error import OK
 from main.privelage import COLLECTOR, MANAGER, ADMIN
 from sqlalchemy import text
+import sqlalchemy as db
+
+
+# Max number of rows in each multi-row INSERT built from an SQL file
+INSERT_BATCH_SIZE = 1000
+
+INSERT_PATTERN = re.compile(
+    r"insert\s+into\s+(\w+)\s*\(([^)]*)\)\s*values\s*(.*)", re.IGNORECASE | re.DOTALL
+)
 
 
 def read_sql_file(filename):
@@ -15,26 +25,51 @@ def read_sql_file(filename):
         return file.read()
 
 
-def execute_sql_file(filename):
-    engine, conn, metadata = dbm.db_connect()
+def execute_sql_file(filename, conn=None):
+    """Runs the statements in an SQL file of single-row INSERTs, merging
+    consecutive ones into the same table into multi-row INSERTs.
+
+    Args:
+        filename (string): path of the SQL file
+        conn (Connection): transaction to run the statements in, or None to run
+                           them in a transaction of their own
+    """
+    if conn is None:
+        with dbm.db_transaction() as conn:
+            return execute_sql_file(filename, conn)
 
     commands = read_sql_file(filename).split(";")  # Split commands by ';'
-    with engine.connect() as connection:
-        for command in commands:
-            # Skip executing empty command caused by the split
-            if command.strip() == "":
-                continue
 
-            try:
-                connection.execute(text(command))
-            except Exception as e:
-                print(f"Error executing command: {command.strip()}")
-                print("Error message:", e)
+    # (table, columns) of the current batch, and the batch's VALUES tuples
+    batch_target = None
+    batch = []
+
+    def flush():
+        if batch:
+            table, columns = batch_target
+            conn.execute(
+                text(f"INSERT INTO {table} ({columns}) VALUES {', '.join(batch)}")
+            )
+            batch.clear()
+
+    for command in commands:
+        # Skip executing empty command caused by the split
+        if command.strip() == "":
+            continue
 
-    # commands = read_sql_file(filename)
-    # # cursor = conn.cursor()
-    # cursor = conn.execute(commands)
-    # cursor.close()
+        match = INSERT_PATTERN.match(command.strip())
+        if match is None:
+            flush()
+            conn.execute(text(command))
+            continue
+
+        table, columns, values = match.groups()
+        if (table, columns) != batch_target or len(batch) >= INSERT_BATCH_SIZE:
+            flush()
+            batch_target = (table, columns)
+        batch.append(values.strip())
+
+    flush()
 
 
 def generate_demo():
@@ -93,23 +128,25 @@ def generate_demo():
     )
 
 
-    # Collectors will instantiate 20 more collectors
-    execute_sql_file("./mock_data/collectors.sql")
+    # The SQL files are loaded in one transaction, so a failed load leaves no partial data
+    with dbm.db_transaction() as conn:
+        # Collectors will instantiate 20 more collectors
+        execute_sql_file("./mock_data/collectors.sql", conn)
 
-    # Populates db with 5 campaigns
-    execute_sql_file("./mock_data/campaigns.sql")
+        # Populates db with 5 campaigns
+        execute_sql_file("./mock_data/campaigns.sql", conn)
 
-    # Populates campaignes with 100 randomly allocatedc collectibles
-    execute_sql_file("./mock_data/collectibles.sql")
+        # Populates campaignes with 100 randomly allocatedc collectibles
+        execute_sql_file("./mock_data/collectibles.sql", conn)
 
-    # Uncomment for different images
-    # generate_collectibles()
+        # Uncomment for different images
+        # generate_collectibles(conn=conn)
 
-    # Populates the first 20 collectors with 500 randomly allocated collectibles to their collections
-    execute_sql_file("./mock_data/collections.sql")
+        # Populates the first 20 collectors with 500 randomly allocated collectibles to their collections
+        execute_sql_file("./mock_data/collections.sql", conn)
 
-    # Populates the first 20 collectors with 300 randomly allocated collectibles to their wantlists
-    execute_sql_file("./mock_data/wantlist.sql")
+        # Populates the first 20 collectors with 300 randomly allocated collectibles to their wantlists
+        execute_sql_file("./mock_data/wantlist.sql", conn)
 
     return (
         jsonify(
@@ -118,19 +155,31 @@ def generate_demo():
         OK,
     )
 
-def generate_collectibles(num_collectibles=100, num_campaigns=5):
-    f = open('./mock_data/collectibles.json')
-    collectibles = random.sample(json.load(f), num_collectibles)
-
-    for collectible_id in range(0, num_collectibles):
-        campaign_id = random.randrange(1, num_campaigns + 1)
-        photo_id = random.randrange(300)
-
-        db_collectibles.register_collectible(
-            campaign_id,
-            collectibles[collectible_id]["name"],
-            collectibles[collectible_id]["paragraph"],
-            f"https://picsum.photos/id/{photo_id}/600/400",
-        )
-
-    f.close()
+def generate_collectibles(num_collectibles=100, num_campaigns=5, conn=None):
+    """Inserts collectibles with random names and images into random campaigns.
+
+    Args:
+        num_collectibles (int): number of collectibles to insert
+        num_campaigns (int): collectibles go in campaigns 1 to num_campaigns
+        conn (Connection): transaction to insert them in, or None to use one of
+                           their own
+    """
+    if conn is None:
+        with dbm.db_transaction() as conn:
+            return generate_collectibles(num_collectibles, num_campaigns, conn)
+
+    with open("./mock_data/collectibles.json") as f:
+        collectibles = random.sample(json.load(f), num_collectibles)
+
+    rows = [
+        {
+            "campaign_id": random.randrange(1, num_campaigns + 1),
+            "name": collectible["name"],
+            "description": collectible["paragraph"],
+            "image": f"https://picsum.photos/id/{random.randrange(300)}/600/400",
+        }
+        for collectible in collectibles
+    ]
+
+    # Sent as multi-row INSERTs rather than one statement per collectible
+    conn.execute(db.insert(dbm.collectible_table), rows)
@@ -1,4 +1,6 @@
+import click
 import os
+import time
 
 from datetime import timedelta
 from flask import Flask, jsonify, request
@@ -12,25 +14,34 @@ from flask_jwt_extended import (
 
 from main import auth
 from main.database import (
+    db_cache,
     db_campaigns,
     db_campaign_analytics,
     db_collectibles,
     db_collections,
     db_collectors,
     db_exchangehistory,
+    db_indexes,
     db_manager as dbm,
+    db_matching,
+    db_migrations,
+    db_trade_cycles,
     db_tradeoffers,
     db_tradeposts,
+    db_versions,
     db_wantlist,
 )
 from main.error import InputError, AccessError, OK
 from main.privelage import ADMIN, MANAGER
-from mock_data import mock_data_init
+from mock_data import load_test_data, mock_data_init
+import helpers.compression as compression
 import helpers.config as config
 import helpers.exceptions as exceptions
+import helpers.json_provider as json_provider
 
 APP = Flask(__name__)
-APP.config.from_object(config.DevelopmentConfig)
+APP.config.from_object(config.get_config())
+APP.json = json_provider.create_json_provider(APP, APP.config["JSON_PROVIDER"])
 APP.config["TRAP_HTTP_EXCEPTIONS"] = True
 APP.register_error_handler(Exception, exceptions.defaultHandler)
 
@@ -45,13 +56,97 @@ APP.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
 APP.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=30)
 APP.config["JWT_COOKIE_CSRF_PROTECT"] = False
 
+# Database App Settings
+dbm.init_app(APP)
+
+# Cache App Settings
+db_cache.init_app(APP)
+
+# Compression App Settings
+compression.init_app(APP)
+
 
 # @APP.route("/")
 # def entry():
 #     return "<h1>Hello, Collector<h1\>"
 
+# Brings the schema up to date, doing nothing if it already is
 with APP.app_context():
-    dbm.database_setup()
+    db_migrations.upgrade()
+
+
+@APP.cli.command("reset-db")
+@click.confirmation_option(prompt="This deletes all data in the database. Continue?")
+def reset_db_command():
+    """Deletes the database and rebuilds its schema."""
+    db_migrations.reset()
+    click.echo("Database has been reset!")
+
+
+@APP.cli.command("load-test-data")
+@click.option("--collectors", default=10000, show_default=True)
+@click.option("--managers", default=10, show_default=True)
+@click.option("--campaigns", default=20, show_default=True)
+@click.option("--collectibles-per-campaign", default=50, show_default=True)
+@click.option("--collections-per-collector", default=20, show_default=True)
+@click.option("--wantlist-per-collector", default=5, show_default=True)
+@click.option("--trade-posts", default=1000, show_default=True)
+@click.option("--offers-per-post", default=3, show_default=True)
+@click.option("--exchanges", default=10000, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+def load_test_data_command(**sizes):
+    """Adds a synthetic dataset of the given size, for load testing."""
+    started = time.perf_counter()
+    counts = load_test_data.generate_load_test_data(**sizes)
+    db_versions.bump_version(db_versions.CATALOG)
+    db_matching.rebuild()
+    db_campaign_analytics.rebuild_rollups()
+
+    for table, count in counts.items():
+        click.echo(f"{table:<20}{count}")
+    click.echo(f"Loaded in {time.perf_counter() - started:.1f}s")
+
+
+@APP.cli.command("reconcile-offer-counts")
+@click.option("--check", is_flag=True, help="Only report the wrong counts.")
+def reconcile_offer_counts_command(check):
+    """Fixes trade posts whose offers_received does not match their open offers."""
+    if check:
+        wrong = db_tradeposts.check_offer_counts()
+        for post in wrong:
+            click.echo(
+                f"Trade post {post['trade_post_id']}: offers_received "
+                f"{post['offers_received']}, actual {post['actual']}"
+            )
+        click.echo(f"{len(wrong)} trade posts have the wrong offer count")
+        if wrong:
+            raise SystemExit(1)
+        return
+
+    fixed = db_tradeposts.reconcile_offer_counts()
+    click.echo(f"Fixed the offer count of {fixed} trade posts")
+
+
+@APP.cli.command("backfill-analytics")
+def backfill_analytics_command():
+    """Recounts the analytics rollups from the exchange history, wantlists and collections."""
+    started = time.perf_counter()
+    counts = db_campaign_analytics.rebuild_rollups()
+    for table, count in counts.items():
+        click.echo(f"{table:<28}{count} days")
+    click.echo(f"Counted in {time.perf_counter() - started:.1f}s")
+
+
+@APP.cli.command("find-trade-cycles")
+@click.option("--max-length", default=db_trade_cycles.MAX_CYCLE_LENGTH, show_default=True)
+@click.option("--workers", default=None, type=int, help="Processes, one per CPU if unset.")
+def find_trade_cycles_command(max_length, workers):
+    """Finds the trades between three or more collectors, replacing the last run's."""
+    result = db_trade_cycles.find_trade_cycles(max_length, workers)
+    click.echo(
+        f"Found {result['cycles']} cycles between {result['collectors']} "
+        f"collectors in {result['seconds']}s"
+    )
 
 """ |------------------------------------|
     |          Database Routes           |
@@ -60,10 +155,69 @@ with APP.app_context():
 
 @APP.route("/initdb")
 def init_db():
-    dbm.database_setup()
+    """Deletes the database and rebuilds its schema, in development only (use
+    the reset-db command elsewhere).
+
+    Example Success Output:
+        {"msg": "Database has been setup successfully!"}, 200
+
+    Example Error Output:
+        {"msg": "Database resets are disabled!"}, 403
+    """
+    if not APP.config.get("ALLOW_DATABASE_RESET"):
+        return jsonify(msg="Database resets are disabled!"), AccessError
+
+    db_migrations.reset()
     return jsonify(msg="Database has been setup successfully!"), OK
 
 
+@APP.route("/check_indexes", methods=["GET"])
+@auth.privelage_required(ADMIN)
+def check_indexes():
+    """Checks that the hot queries' plans use the indexes designed for them.
+
+    Example Success Output:
+        {
+            "ok": true,
+            "queries": [
+                {
+                    "query": "collection",
+                    "expected_index": "ix_collections_collector_id_collectible_id",
+                    "used_indexes": ["ix_collections_collector_id_collectible_id"],
+                    "ok": true
+                },
+            ]
+        }, 200
+    """
+    results = db_indexes.check_index_usage()
+    return jsonify(ok=all(r["ok"] for r in results), queries=results), OK
+
+
+@APP.route("/cache_stats", methods=["GET"])
+@auth.privelage_required(ADMIN)
+def cache_stats():
+    """Returns the size and hit/miss/eviction counters of this worker's caches.
+
+    Example Success Output:
+        {
+            "caches": [
+                {
+                    "name": "collectibles",
+                    "entries": 100,
+                    "max_entries": 4096,
+                    "ttl": 600,
+                    "hits": 950,
+                    "misses": 100,
+                    "evictions": 0,
+                    "expirations": 0,
+                    "invalidations": 2
+                },
+            ]
+        }, 200
+    """
+    return jsonify(caches=db_cache.stats()), OK
+
+
 # @APP.route("/init_mock_data", methods=["GET"])
 # def init_mock_data():
 #     return jsonify(msg="Mock data initialised!"), OK
@@ -72,6 +226,9 @@ def init_db():
 @APP.route("/init_mock_data/demo", methods=["GET"])
 def init_mock_data_demo():
     mock_data_init.generate_demo()
+    db_versions.bump_version(db_versions.CATALOG)
+    db_matching.rebuild()
+    db_campaign_analytics.rebuild_rollups()
 
     return jsonify(msg="Mock data initialised!"), OK
 
@@ -180,7 +337,7 @@ def profile():
     Example Error Output:
         {"msg": "Invalid collector id"}, 400
     """
-    user_id = request.args.get("id")
+    user_id = request.args.get("id", None, type=int)
     return db_collectors.get_collector(user_id=user_id)
 
 
@@ -256,9 +413,45 @@ def get_collectors():
 
 
 @APP.route("/search", methods=["GET"])
+@db_versions.versioned(db_versions.CATALOG)
 def first_search():
-    """Returns all the collectibles within our database."""
-    return db_collectibles.get_all_collectibles()
+    """Searches the collectibles within our database.
+
+    Args:
+        q: str (optional, words to find in collectible names/descriptions)
+        campaign_id: int (optional, only collectibles of this campaign)
+        released_after: "DD/MM/YYYY" (optional, earliest release date)
+        released_before: "DD/MM/YYYY" (optional, latest release date)
+        sort: "name"/"-name"/"date_released"/"-date_released" (optional)
+        limit: int (optional, page size, default 25, at most 100)
+        cursor: str (optional, "next" cursor of the previous page)
+
+    Example Success Output:
+        {
+            "collectibles": [
+                {
+                    "id": 1,
+                    "collectible_name": "Chimpanzee",
+                    "collectible_image": "https://robohash.org/namutmagni.png",
+                    "collectible_description": "Morbi non quam nec dui luctus rutrum.",
+                    "campaign_name": "Mountain Duck",
+                    "date_released": "16/01/2022"
+                },
+            ],
+            "next": "WyJDaGltcGFuemVlIiwgMV0="
+        }, 200
+    """
+    query = request.args.get("q", None)
+    campaign_id = request.args.get("campaign_id", None, type=int)
+    released_after = request.args.get("released_after", None)
+    released_before = request.args.get("released_before", None)
+    sort = request.args.get("sort", "name")
+    limit = request.args.get("limit", None, type=int)
+    cursor = request.args.get("cursor", None)
+
+    return db_collectibles.search_collectibles(
+        query, campaign_id, released_after, released_before, sort, limit, cursor
+    )
 
 
 """ |------------------------------------|
@@ -267,7 +460,7 @@ def first_search():
 
 
 @APP.route("/campaign/register", methods=["POST"])
-@jwt_required(fresh=False)
+@auth.privelage_required(MANAGER)
 def register_campaign():
     """Registers a campaign to our database."""
     verify_jwt_in_request()
@@ -281,11 +474,12 @@ def register_campaign():
     collectibles = request.json.get("collectibles_list", None)
 
     return db_campaigns.register_campaign(
-        user_id, name, description, image, start_date, end_date
+        user_id, name, description, image, start_date, end_date, collectibles
     )
 
 
 @APP.route("/campaign/get_campaigns", methods=["GET"])
+@db_versions.versioned(db_versions.CATALOG)
 def get_all_campaigns():
     """Returns all campaigns stored in the database."""
     return db_campaigns.get_all_campaigns()
@@ -306,6 +500,7 @@ def register_collectible():
 
 @APP.route("/campaign/get_collectibles", methods=["GET"])
 @jwt_required(fresh=False)
+@db_versions.versioned(db_versions.CATALOG)
 def get_campaign_collectibles():
     """Return the collectibles associated with the passed in campaign_id."""
     campaign_id = request.args.get("campaign_id")
@@ -548,6 +743,35 @@ def trade_offers_list():
     return db_tradeoffers.find_tradelist_offers(trade_post_id)
 
 
+@APP.route("/trade/matches", methods=["GET"])
+@jwt_required(fresh=False)
+def trade_matches():
+    """
+    Returns the collectors the user could trade with: they have collectibles
+    on the user's wantlist, and want collectibles in the user's collection
+
+    Args:
+        limit: int (optional, max number of collectors, default 20)
+    """
+    user_id = get_jwt_identity()
+    limit = request.args.get("limit", 20, type=int)
+
+    return db_matching.find_matches(user_id, limit)
+
+
+@APP.route("/trade/cycles", methods=["GET"])
+@jwt_required(fresh=False)
+def trade_cycles():
+    """
+    Returns the trades between three or more collectors the user is in, where
+    everyone gives one collectible and gets one off their wantlist
+    (found by the find-trade-cycles command)
+    """
+    user_id = get_jwt_identity()
+
+    return db_trade_cycles.get_trade_cycles(user_id)
+
+
 """ |------------------------------------|
     |           Offers Routes            |
     |------------------------------------| """
@@ -556,9 +780,20 @@ def trade_offers_list():
 @APP.route("/offers/get", methods=["GET"])
 @jwt_required(fresh=False)
 def offers_get():
+    """
+    Returns the current and past offers the user has sent
+
+    Args:
+        status: str (optional, "SENT", "ACCEPTED" or "DECLINED")
+        limit: int (optional, page size)
+        cursor: str (optional, "next" cursor of the previous page)
+    """
     user_id = get_jwt_identity()
+    status = request.args.get("status", None)
+    limit = request.args.get("limit", None, type=int)
+    cursor = request.args.get("cursor", None)
 
-    return db_tradeoffers.find_outgoing_offers(user_id)
+    return db_tradeoffers.find_outgoing_offers(user_id, status, limit, cursor)
 
 
 """ |------------------------------------|
@@ -571,10 +806,16 @@ def offers_get():
 def exchange_history():
     """
     Find the user's exchange history
+
+    Args:
+        limit: int (optional, page size)
+        cursor: str (optional, "next" cursor of the previous page)
     """
     user_id = get_jwt_identity()
+    limit = request.args.get("limit", None, type=int)
+    cursor = request.args.get("cursor", None)
 
-    return db_exchangehistory.find_exchange_history(user_id)
+    return db_exchangehistory.find_exchange_history(user_id, limit, cursor)
 
 
 @APP.route("/exchange/makeoffer", methods=["POST"])
@@ -619,6 +860,7 @@ def exchange_accept():
 
 @APP.route("/collectible/get", methods=["GET"])
 @jwt_required(fresh=False)
+@db_versions.versioned(db_versions.CATALOG)
 def get_collectible_info():
     """Find the information of a certain collectible.
     Takes in collectible_id as request argument
@@ -653,7 +895,7 @@ def get_trade_posts():
 
 
 @APP.route("/manager/invite", methods=["POST"])
-@jwt_required(fresh=False)
+@auth.privelage_required(ADMIN)
 def invite_manager():
     admin_id = get_jwt_identity()
     email = request.json.get("email", None)
@@ -667,10 +909,33 @@ def get_manager_analytics():
     Returns analytics of a campaigns posted by the given manager.
 
     If no campaigns are posted, or if no analytics are available, return an empty list.
+
+    Args:
+        bucket: str (optional, "day", "week" or "month", default "day")
     """
     manager_id = get_jwt_identity()
+    bucket = request.args.get("bucket", "day")
+
+    return db_campaign_analytics.return_analytics(manager_id, bucket)
 
-    return db_campaign_analytics.return_analytics(manager_id)
+
+@APP.route("/manager/analytics/timeseries", methods=["GET"])
+@jwt_required(fresh=False)
+def get_manager_analytics_timeseries():
+    """
+    Returns time series of the exchanges, wantlist demand and collection growth
+    of the manager's campaigns' collectibles, and their most wanted and most
+    traded collectibles.
+
+    Args:
+        bucket: str (optional, "day", "week" or "month", default "week")
+        top: int (optional, length of the top lists, default 10)
+    """
+    manager_id = get_jwt_identity()
+    bucket = request.args.get("bucket", "week")
+    top = request.args.get("top", 10, type=int)
+
+    return db_campaign_analytics.return_timeseries(manager_id, bucket, top)
 
 
 @APP.route("/manager/feedback", methods=["GET"])
@@ -792,7 +1057,7 @@ def get_collector_list():
 
 
 @APP.route("/collector/ban", methods=["POST"])
-@jwt_required(fresh=False)
+@auth.privelage_required(ADMIN)
 def ban_collector():
     """Bans a collector account, actionable only by an Admin
 
@@ -811,10 +1076,16 @@ def ban_collector():
 
 
 @APP.route("/admin/get_campaigns", methods=["GET"])
-@jwt_required(fresh=False)
+@auth.privelage_required(ADMIN)
 def get_campaigns_for_review():
     """Provides a list of campaigns, either reviewed or not for the Admin to view and review.
 
+    Args:
+        approved: "true"/"false" (optional, filter on approval status)
+        limit: int (optional, page size)
+        cursor: str (optional, "next" cursor of the previous page)
+        collectibles: "true"/"false" (optional, "false" leaves out collection_list)
+
     stub_return = {
         "campaigns": [
             {
@@ -890,11 +1161,18 @@ def get_campaigns_for_review():
         ]
     }
     """
-    return db_campaigns.get_campaigns_and_collectibles()
+    approved = request.args.get("approved", None, type=lambda v: v.lower() == "true")
+    limit = request.args.get("limit", None, type=int)
+    cursor = request.args.get("cursor", None)
+    include_collectibles = request.args.get("collectibles", "true").lower() != "false"
+
+    return db_campaigns.get_campaigns_and_collectibles(
+        approved, limit, cursor, include_collectibles
+    )
 
 
 @APP.route("/admin/campaign/approve", methods=["POST"])
-@jwt_required(fresh=False)
+@auth.privelage_required(ADMIN)
 def admin_campaign_approve():
     """An Admin Approves the campaign.
 
@@ -909,7 +1187,7 @@ def admin_campaign_approve():
 
 
 @APP.route("/admin/campaign/decline", methods=["POST"])
-@jwt_required(fresh=False)
+@auth.privelage_required(ADMIN)
 def admin_campaign_decline():
     """An Admin Declines the campaign.
 
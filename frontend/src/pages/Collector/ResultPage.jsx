@@ -10,36 +10,37 @@ import {
   MRT_FullScreenToggleButton,
 } from 'material-react-table';
 
-import { Box } from '@mui/material';
+import { Box, Button } from '@mui/material';
 import { apiCall } from "../../App";
 
+// Number of collectibles fetched from the backend at a time
+const PAGE_SIZE = 25;
+
 // Displays list of collectibles that matches the search query
 // Clicking on a result takes the user to the collectible page
 // Table sourced from https://github.com/KevinVandy/material-react-table/blob/v1/apps/material-react-table-docs/examples/custom-top-toolbar/sandbox/src/JS.js
 function ResultsPage() {
   const { query } = useParams();
   const [results, setResults] = useState([]);
-
-  const fetchData = (query_str) => {
+  const [next, setNext] = useState(null);
+
+  const fetchData = (query_str, cursor) => {
+    // search is done by the backend, which matches the start of words in names and descriptions
+    // and returns one page at a time, with a cursor to fetch the next page with
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (query_str !== undefined) {
+      params.set("q", query_str);
+    }
+    if (cursor) {
+      params.set("cursor", cursor);
+    }
     const options = {
       method: "GET",
-      route: "/search"
+      route: `/search?${params}`
     };
     apiCall((d) => {
-      if (query_str === undefined) {
-        setResults(d.collectibles);
-      }
-      else {
-        const searchKey = d.collectibles.map(item => item.collectible_name);
-        const searchResults = searchKey.filter(str =>
-          str.toLowerCase().includes(query_str.toString().toLowerCase())
-        );
-
-        const filteredData = d.collectibles.filter(item => searchResults.includes(item.collectible_name));
-
-        setResults(filteredData);
-      }
-
+      setResults((prev) => cursor ? [...prev, ...d.collectibles] : d.collectibles);
+      setNext(d.next);
     }, options);
   }
 
@@ -116,6 +117,19 @@ function ResultsPage() {
         size: 250,
       }}
 
+      // fetches the next page of results, if there is one
+      renderBottomToolbarCustomActions={() => (
+        <Box sx={{ display: 'flex', gap: '1rem', p: '4px' }}>
+          <Button
+            disabled={!next}
+            onClick={() => fetchData(query, next)}
+            variant="contained"
+          >
+            Load More
+          </Button>
+        </Box>
+      )}
+
       //customize built-in buttons in the top-right of top toolbar
       renderToolbarInternalActions={({ table }) => (
 